@@ -0,0 +1,84 @@
+"""
+Load balancing simulation.
+
+Five simulated endpoints of one upstream, each handling at most 4 requests at a time: three fast ones (10 ms median),
+a slow one (40 ms median) and one that answers every request with an error. Requests arrive at random at 70% of the
+pool's capacity and go through `EndpointPool` with each strategy, with and without passive outlier ejection.
+Latency includes the time a request waits for a free slot on its endpoint.
+
+    python -m benchmarks.bench_balancer
+"""
+import asyncio
+import math
+import random
+import statistics
+import time
+
+from config.config import config
+from core.balancer import EndpointPool
+
+SLOTS = 4
+# (median service time in seconds, fails every request)
+ENDPOINTS = [(0.010, False), (0.010, False), (0.010, False), (0.040, False), (0.005, True)]
+LOAD = 0.7
+DURATION = 3.0
+STRATEGIES = ("round_robin", "least_outstanding", "power_of_two")
+
+
+class SimulatedEndpoint:
+    def __init__(self, median: float, failing: bool):
+        self.median = median
+        self.failing = failing
+        self.slots = asyncio.Semaphore(SLOTS)
+
+    async def handle(self) -> bool:
+        async with self.slots:
+            await asyncio.sleep(random.lognormvariate(math.log(self.median), 0.5))
+        return not self.failing
+
+
+async def simulate(strategy: str) -> tuple[list[float], int]:
+    random.seed(7)
+    pool = EndpointPool("sim", [(f"http://endpoint-{i}", 1) for i in range(len(ENDPOINTS))], strategy)
+    servers = {endpoint.url: SimulatedEndpoint(*spec) for endpoint, spec in zip(pool.endpoints, ENDPOINTS)}
+    capacity = sum(SLOTS / median for median, failing in ENDPOINTS if not failing)
+    latencies = []
+    errors = 0
+
+    async def request():
+        nonlocal errors
+        endpoint = pool.pick()
+        start = time.perf_counter()
+        ok = await servers[endpoint.url].handle()
+        latency = time.perf_counter() - start
+        endpoint.release(ok, latency)
+        if ok:
+            latencies.append(latency)
+        else:
+            errors += 1
+
+    tasks = []
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(request()))
+        await asyncio.sleep(random.expovariate(capacity * LOAD))
+    await asyncio.gather(*tasks)
+    return latencies, errors
+
+
+def main():
+    print(f"{len(ENDPOINTS)} endpoints, offered load {LOAD:.0%} of capacity for {DURATION:.0f} s, latency in ms")
+    print(f"{'strategy':>18} {'ejection':>9} {'p50':>8} {'p99':>8} {'p99.9':>8} {'errors':>7}")
+    limits = config.OUTLIER_CONSECUTIVE_FAILURES, config.OUTLIER_LATENCY_FACTOR
+    for ejection in (False, True):
+        config.OUTLIER_CONSECUTIVE_FAILURES, config.OUTLIER_LATENCY_FACTOR = limits if ejection else (
+            math.inf, math.inf)
+        for strategy in STRATEGIES:
+            latencies, errors = asyncio.run(simulate(strategy))
+            cuts = statistics.quantiles(latencies, n=1000)
+            print(f"{strategy:>18} {'on' if ejection else 'off':>9} {statistics.median(latencies) * 1000:>8.1f} "
+                  f"{cuts[989] * 1000:>8.1f} {cuts[998] * 1000:>8.1f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
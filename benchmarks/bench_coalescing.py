@@ -0,0 +1,77 @@
+"""
+Request coalescing benchmark.
+
+Fires 1,000 concurrent identical GETs through the gateway at an in-process upstream that takes 50 ms per call,
+with coalescing disabled and enabled, and reports upstream call count and client latency.
+
+    python -m benchmarks.bench_coalescing
+"""
+import asyncio
+import statistics
+import time
+
+import httpx
+import jwt
+from loguru import logger
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from config.config import config
+from core.client import upstream_clients
+from main import app
+
+CONCURRENCY = 1_000
+UPSTREAM_LATENCY = 0.05
+
+
+def build_upstream(counter: list):
+    async def endpoint(request):
+        counter[0] += 1
+        await asyncio.sleep(UPSTREAM_LATENCY)
+        # Only responses a shared cache may store are coalesced
+        return JSONResponse({"message": "This is service-a"}, headers={"cache-control": "public, max-age=60"})
+
+    return Starlette(routes=[Route("/some-path", endpoint)])
+
+
+async def run(coalesce: bool) -> tuple[int, list[float]]:
+    config.COALESCE_ENABLED = coalesce
+    config.RESPONSE_CACHE_ENABLED = False
+    config.RATE_LIMIT_ENABLED = False
+    # Measure the upstream calls, not the requests shed at the upstream's concurrency limit
+    config.CONCURRENCY_LIMIT_ENABLED = False
+    calls = [0]
+    upstream_clients.transport = httpx.ASGITransport(build_upstream(calls))
+    await upstream_clients.close()
+
+    token = jwt.encode({"sub": "bench"}, config.JWT_SECRET, algorithm=config.JWT_ALGORITHM)
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies = []
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway") as client:
+        async def one():
+            start = time.perf_counter()
+            response = await client.get("/service-a/some-path", headers=headers)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+        await asyncio.gather(*(one() for _ in range(CONCURRENCY)))
+    return calls[0], latencies
+
+
+def main():
+    logger.remove()
+    print(f"{CONCURRENCY} concurrent identical GETs, upstream latency {UPSTREAM_LATENCY * 1000:.0f} ms")
+    print(f"{'coalescing':>10} {'upstream calls':>15} {'p50 ms':>8} {'p99 ms':>8} {'total s':>8}")
+    for coalesce in (False, True):
+        start = time.perf_counter()
+        calls, latencies = asyncio.run(run(coalesce))
+        total = time.perf_counter() - start
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{'on' if coalesce else 'off':>10} {calls:>15} {quantiles[49] * 1000:>8.1f} "
+              f"{quantiles[98] * 1000:>8.1f} {total:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
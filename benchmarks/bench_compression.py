@@ -0,0 +1,73 @@
+"""
+Response compression benchmark.
+
+For JSON API responses from 1 KB to 1 MB and every installed encoding, measures the compression ratio and the
+CPU time of compressing the body on every request, as the gateway does for uncached responses. A body streamed
+in 64 KB chunks (each flushed to the client) shows what streaming costs in ratio. The last column is the cost of
+serving a cached response's precompressed variant, which is compressed once and then only looked up.
+
+    python -m benchmarks.bench_compression
+"""
+import json
+import time
+import timeit
+
+from core.cache import CachedResponse
+from core.compression import ENCODERS
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+CHUNK = 64 * 1024
+# Budget of CPU time per measurement, in seconds
+BUDGET = 0.3
+
+
+def payload(size: int) -> bytes:
+    records = []
+    length = 2
+    while length < size:
+        i = len(records)
+        record = {"id": 10_000_000 + i, "name": f"user-{i}", "email": f"user-{i}@example.com", "active": i % 3 != 0,
+                  "score": round(i * 0.37, 2), "tags": ["alpha", "beta"][:i % 3], "city": "Zürich"}
+        records.append(record)
+        length += len(json.dumps(record, separators=(",", ":"))) + 1
+    return json.dumps(records, separators=(",", ":")).encode("utf-8")
+
+
+def measure(fn) -> float:
+    """
+    CPU seconds of one call, averaged over as many calls as fit in BUDGET.
+    """
+    fn()
+    calls = 0
+    start = time.process_time()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.process_time() - start
+        if elapsed >= BUDGET:
+            return elapsed / calls
+
+
+def streamed(encoder, body: bytes) -> bytes:
+    compress = encoder.stream()
+    chunks = [body[i:i + CHUNK] for i in range(0, len(body), CHUNK)]
+    return b"".join(compress(chunk, i == len(chunks) - 1) for i, chunk in enumerate(chunks))
+
+
+def main():
+    print(f"{'payload':>9} {'encoding':>8} {'ratio':>7} {'streamed':>9} {'compress µs':>12} {'cached µs':>10}")
+    for size in SIZES:
+        body = payload(size)
+        for encoder in ENCODERS.values():
+            entry = CachedResponse(200, [(b"content-type", b"application/json")], body, ())
+            entry.encoded(encoder)
+            ratio = len(body) / len(encoder.compress(body))
+            stream_ratio = len(body) / len(streamed(encoder, body))
+            per_request = measure(lambda: encoder.compress(body))
+            cached = timeit.timeit(lambda: entry.encoded(encoder), number=100_000) / 100_000
+            print(f"{len(body) / 1000:>7.0f}KB {encoder.name:>8} {ratio:>6.1f}x {stream_ratio:>8.1f}x "
+                  f"{per_request * 1e6:>12.1f} {cached * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
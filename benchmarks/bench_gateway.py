@@ -0,0 +1,270 @@
+"""
+End-to-end gateway load test.
+
+Boots the gateway in-process, lifespan and background tasks included, against the bundled `services/service_a` and
+`services/service_b` stubs, which run in-process as well. fakeredis stands in for Redis and no traces are exported.
+An async load generator drives every scenario through the whole middleware stack, authentication, rate limiting,
+routing, the response cache and the upstream client:
+
+- small_get: GET of a small JSON response from service-a
+- large_post: POST of a 256 KB JSON body to service-b, which echoes it back (a request body transform applies);
+  a twentieth of the requests of the other scenarios
+- cache_hit: GET of a cacheable service-a response, answered from the response cache
+- auth_failure: GET with an invalid token, rejected by the gateway
+
+Requests are sent by CONCURRENCY workers, back to back or (with --rate) on a fixed schedule; then latency counts
+from the scheduled start, so a slow gateway cannot hide its queueing delay. Every scenario reports requests/sec,
+p50/p99/p99.9 latency, the peak Python memory allocated while it runs (measured in a separate, shorter pass,
+since tracing allocations is slow) and the process's peak RSS. Results are written as JSON; --compare prints the
+change against an earlier results file. The stubs run in the same process, so their work counts as well: the numbers
+are for comparing commits on one machine, not for sizing a deployment.
+
+    python -m benchmarks.bench_gateway [--scenarios small_get,cache_hit] [--requests 5000] [--concurrency 32]
+                                       [--rate 0] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+import fakeredis
+import httpx
+import jwt
+from loguru import logger
+
+import main as gateway
+from config.config import config
+from core.client import upstream_clients
+from services.service_a.main import app as service_a
+from services.service_b.main import app as service_b
+
+REQUESTS = 5_000
+CONCURRENCY = 32
+# Requests of the allocation-tracing pass
+MEMORY_REQUESTS = 300
+LARGE_BODY = 256 * 1024
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class Scenario:
+    __slots__ = ("name", "method", "path", "headers", "body", "status", "share")
+
+    def __init__(self, name: str, method: str, path: str, status: int = 200, token: Optional[str] = None,
+                 body: bytes = None, share: float = 1.0):
+        self.name = name
+        # Fraction of --requests sent in this scenario, for the slow ones
+        self.share = share
+        self.method = method
+        self.path = path
+        self.status = status
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+        if body is not None:
+            self.headers["Content-Type"] = "application/json"
+        self.body = body
+
+    async def send(self, client: httpx.AsyncClient) -> bool:
+        response = await client.request(self.method, self.path, headers=self.headers, content=self.body)
+        return response.status_code == self.status
+
+
+def large_body(size: int) -> bytes:
+    items = []
+    length = len('{"items":[]}')
+    while length < size:
+        item = {"id": len(items), "name": f"item-{len(items)}", "tags": ["alpha", "beta"], "price": len(items) / 4}
+        items.append(item)
+        length += len(json.dumps(item, separators=(",", ":"))) + 1
+    return json.dumps({"items": items}, separators=(",", ":")).encode()
+
+
+def scenarios() -> dict[str, Scenario]:
+    token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600}, config.JWT_SECRET,
+                       algorithm=config.JWT_ALGORITHM)
+    return {scenario.name: scenario for scenario in (
+        Scenario("small_get", "GET", "/service-a/some-path", token=token),
+        Scenario("large_post", "POST", "/service-b/some-path", token=token, body=large_body(LARGE_BODY),
+                 share=0.05),
+        Scenario("cache_hit", "GET", "/service-a/cacheable", token=token),
+        Scenario("auth_failure", "GET", "/service-a/some-path", status=401, token="not-a-token"),
+    )}
+
+
+class StubTransport(httpx.AsyncBaseTransport):
+    """
+    Sends upstream calls to the stub apps in-process, picked by the origin of the URL.
+    """
+
+    def __init__(self, apps: dict[str, object]):
+        self.transports = {origin.rstrip("/"): httpx.ASGITransport(app) for origin, app in apps.items()}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        origin = f"{request.url.scheme}://{request.url.netloc.decode('ascii')}"
+        return await self.transports[origin].handle_async_request(request)
+
+
+async def drive(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int,
+                rate: float) -> tuple[list[float], int, float]:
+    """
+    Sends `requests` requests from `concurrency` workers; returns the latencies, the number of requests that
+    failed or got an unexpected status, and the elapsed time.
+    """
+    latencies = []
+    errors = 0
+    issued = itertools.count()
+    start = time.perf_counter()
+
+    async def worker():
+        nonlocal errors
+        while (i := next(issued)) < requests:
+            if rate:
+                scheduled = start + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                scheduled = time.perf_counter()
+            try:
+                ok = await scenario.send(client)
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - scheduled)
+            errors += not ok
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(len(ordered) * fraction + 0.5) - 1))]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int,
+                       rate: float) -> dict:
+    # Warm up connection pools, caches and the token cache
+    await drive(client, scenario, min(requests, max(concurrency, requests // 10)), concurrency, 0)
+    latencies, errors, elapsed = await drive(client, scenario, requests, concurrency, rate)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    await drive(client, scenario, min(requests, MEMORY_REQUESTS), concurrency, 0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "p999_ms": round(percentile(latencies, 0.999) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        "memory_peak_kb": round((peak - baseline) / 1024, 1),
+        # Linux reports kilobytes, macOS bytes
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+
+
+async def run(selected: list[Scenario], requests: int, concurrency: int, rate: float) -> dict:
+    # Every upstream URL of the built-in routes goes to its stub
+    upstream_clients.transport = StubTransport({**{url: service_a for url in config.SERVICE_A_URLS},
+                                                **{url: service_b for url in config.SERVICE_B_URLS}})
+    gateway.Redis = fakeredis.FakeAsyncRedis
+    results = {}
+    async with gateway.app.router.lifespan_context(gateway.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(gateway.app), base_url="http://gateway",
+                                     timeout=30) as client:
+            for scenario in selected:
+                count = max(concurrency, int(requests * scenario.share))
+                results[scenario.name] = await run_scenario(client, scenario, count, concurrency, rate)
+                print(format_row(scenario.name, results[scenario.name]))
+    return results
+
+
+def format_row(name: str, result: dict, baseline: Optional[dict] = None) -> str:
+    row = (f"{name:>13} {result['rps']:>9.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+           f"{result['p999_ms']:>8.2f} {result['memory_peak_kb']:>10.0f} {result['errors']:>7}")
+    if baseline:
+        row += (f"   rps {change(result['rps'], baseline['rps'])}"
+                f", p99 {change(result['p99_ms'], baseline['p99_ms'])}")
+    return row
+
+
+def change(value: float, previous: float) -> str:
+    return f"{(value - previous) / previous * 100:+.1f}%" if previous else "n/a"
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    available = scenarios()
+    parser = argparse.ArgumentParser(description="End-to-end load test of the gateway against in-process stubs.")
+    parser.add_argument("--scenarios", default=",".join(available), help="Comma-separated scenarios to run")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Concurrent requests")
+    parser.add_argument("--rate", type=float, default=0, help="Requests/sec on a fixed schedule (0: back to back)")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare with")
+    args = parser.parse_args()
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(available)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    # Per-request debug logging would dominate the measurements
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # Rate limiting stays on, with a limit the load test does not reach
+    config.RATE_LIMIT = "100000000/minute"
+
+    print(f"{args.requests} requests per scenario, concurrency {args.concurrency}"
+          + (f", {args.rate:.0f} req/s" if args.rate else ""))
+    print(f"{'scenario':>13} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'p99.9 ms':>8} {'alloc KB':>10} {'errors':>7}")
+    results = asyncio.run(run([available[name] for name in names], args.requests, args.concurrency, args.rate))
+
+    report = {
+        "commit": commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"requests": args.requests, "concurrency": args.concurrency, "rate": args.rate,
+                     "json_codec": config.JSON_CODEC, "streaming_proxy": config.STREAMING_PROXY},
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit'] or 'results'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {baseline.get('commit') or args.compare}:")
+        for name, result in results.items():
+            if name in baseline.get("scenarios", {}):
+                print(format_row(name, result, baseline["scenarios"][name]))
+
+
+if __name__ == "__main__":
+    main()
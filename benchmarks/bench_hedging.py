@@ -0,0 +1,91 @@
+"""
+Hedged requests against a heavy-tailed upstream.
+
+Three endpoints of one upstream (an httpx mock transport, so no sockets) answer most GETs in about 10 ms, but 5% of
+the calls take 10 to 100 times as long, Pareto distributed, as when a replica pauses for garbage collection or hits
+a cold cache. Requests arrive at random through `hedged` and `forward_request`, with hedging off, after the route's
+observed p95 and after fixed delays. Extra load is the share of upstream calls that were hedges.
+
+    python -m benchmarks.bench_hedging
+"""
+import asyncio
+import math
+import random
+import statistics
+import time
+
+import httpx
+
+from config.config import config
+from core.client import upstream_clients
+from core.concurrency import concurrency_limits
+from core.hedging import hedged
+from core.routing import RouteTable, RouteTableConfig
+from core.utils import forward_request
+
+RATE = 200
+DURATION = 5.0
+MEDIAN = 0.010
+# Share of slow calls, and the Pareto shape of their slowdown (10x at least, capped at 100x)
+TAIL = 0.05
+TAIL_SHAPE = 1.2
+SCENARIOS = [("off", None), ("p95", {"percentile": 0.95}), ("20 ms", {"delay": 0.020}), ("50 ms", {"delay": 0.050})]
+
+
+def latency() -> float:
+    sample = random.lognormvariate(math.log(MEDIAN), 0.25)
+    if random.random() < TAIL:
+        sample *= min(100.0, 10 * random.paretovariate(TAIL_SHAPE))
+    return sample
+
+
+async def simulate(hedge) -> tuple[list[float], int, int]:
+    random.seed(11)
+    route = RouteTable(RouteTableConfig.model_validate({
+        "upstreams": {"catalog": {"endpoints": [f"http://replica-{i}" for i in range(3)],
+                                  "balancer": "least_outstanding"}},
+        "routes": [{"name": "catalog", "prefix": "/catalog", "upstream": "catalog", "hedge": hedge}],
+    })).routes[0]
+    calls = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(latency())
+        return httpx.Response(200, json={"ok": True})
+
+    upstream_clients.transport = httpx.MockTransport(handler)
+    concurrency_limits.clear()
+    latencies = []
+
+    async def request():
+        start = time.perf_counter()
+        await hedged(route, "GET", {}, None,
+                     lambda endpoint: forward_request(endpoint.rebase(route.url_for("/items")), "GET", headers={},
+                                                      timeout=5, route=route.name, endpoint=endpoint))
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    deadline = time.perf_counter() + DURATION
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(request()))
+        await asyncio.sleep(random.expovariate(RATE))
+    await asyncio.gather(*tasks)
+    await upstream_clients.close()
+    return latencies, len(tasks), calls
+
+
+def main():
+    print(f"3 endpoints, {TAIL:.0%} of calls 10-100x slower, {RATE} requests/s for {DURATION:.0f} s, latency in ms")
+    # Slow calls are spread evenly over the endpoints; ejecting one of them would only add noise
+    config.OUTLIER_LATENCY_FACTOR = math.inf
+    print(f"{'hedge after':>12} {'p50':>8} {'p99':>8} {'p99.9':>8} {'extra load':>11}")
+    for name, hedge in SCENARIOS:
+        latencies, requests, calls = asyncio.run(simulate(hedge))
+        cuts = statistics.quantiles(latencies, n=1000)
+        print(f"{name:>12} {statistics.median(latencies) * 1000:>8.1f} {cuts[989] * 1000:>8.1f} "
+              f"{cuts[998] * 1000:>8.1f} {(calls - requests) / requests:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
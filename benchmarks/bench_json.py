@@ -0,0 +1,74 @@
+"""
+JSON codec benchmark.
+
+Measures the CPU time the buffered proxy path spends on JSON per request: decoding the upstream body and
+rendering the response, for payloads from 1 KB to 10 MB. The baseline is what the gateway did before
+`core/codec.py` (httpx's `response.json()` and Starlette's `JSONResponse`); every installed backend of the
+codec is compared against it.
+
+    python -m benchmarks.bench_json
+"""
+import json
+import time
+
+from starlette.responses import JSONResponse
+
+from core.codec import BACKENDS, JSONCodec
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+# Budget of CPU time per payload size and codec, in seconds
+BUDGET = 0.5
+
+
+def payload(size: int) -> bytes:
+    """
+    A JSON array of API-style records, about `size` bytes long.
+    """
+    records = []
+    length = 2
+    while length < size:
+        i = len(records)
+        record = {"id": 10_000_000 + i, "name": f"user-{i}", "email": f"user-{i}@example.com", "active": i % 3 != 0,
+                  "score": i * 0.37, "tags": ["alpha", "beta"][:i % 3], "address": {"city": "Zürich", "zip": "8001"},
+                  "parent": None}
+        records.append(record)
+        length += len(json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")) + 1
+    return json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def baseline(body: bytes) -> bytes:
+    # httpx decodes the text before parsing it
+    return JSONResponse(json.loads(body.decode("utf-8"))).body
+
+
+def measure(fn, body: bytes) -> float:
+    """
+    Returns the CPU time in seconds of one call, averaged over as many calls as fit in BUDGET.
+    """
+    fn(body)
+    calls = 0
+    start = time.process_time()
+    while True:
+        fn(body)
+        calls += 1
+        elapsed = time.process_time() - start
+        if elapsed >= BUDGET:
+            return elapsed / calls
+
+
+def main():
+    codecs = {name: JSONCodec(name) for name in BACKENDS if name != "json"}
+    print("CPU time per request to decode the upstream body and render the response")
+    print(f"{'payload':>10} {'baseline':>12}" + "".join(f" {name:>12} {'saved':>7}" for name in codecs))
+    for size in SIZES:
+        body = payload(size)
+        base = measure(baseline, body)
+        row = f"{len(body) / 1000:>8.0f}KB {base * 1e6:>10.0f}µs"
+        for codec in codecs.values():
+            elapsed = measure(lambda data: codec.dumps(codec.loads(data)), body)
+            row += f" {elapsed * 1e6:>10.0f}µs {1 - elapsed / base:>7.0%}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+JWT verification benchmark.
+
+Sends requests carrying 100 distinct tokens through a minimal FastAPI app guarded by `authenticate`
+and reports requests/sec for HS256 and RS256, with the verified-token cache disabled and enabled.
+
+    python -m benchmarks.bench_jwt
+"""
+import asyncio
+import itertools
+import time
+
+import httpx
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI
+
+from config.config import config
+from core import security
+from core.security import VerifiedTokenCache, authenticate
+
+REQUESTS = 5_000
+USERS = 100
+
+
+def build_app() -> FastAPI:
+    bench_app = FastAPI()
+
+    @bench_app.get("/")
+    async def index(payload: dict = Depends(authenticate)):
+        return {"sub": payload["sub"]}
+
+    return bench_app
+
+
+def keys(algorithm: str) -> tuple:
+    if algorithm.startswith("HS"):
+        return config.JWT_SECRET, config.JWT_SECRET
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_key = private_key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                       serialization.PublicFormat.SubjectPublicKeyInfo)
+    return private_key, public_key.decode("ascii")
+
+
+async def run(bench_app: FastAPI, tokens: list[str]) -> float:
+    headers = itertools.cycle([{"Authorization": f"Bearer {token}"} for token in tokens])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(bench_app), base_url="http://gateway") as client:
+        # Warm up, this also fills the token cache when it is enabled
+        for _ in range(USERS):
+            await client.get("/", headers=next(headers))
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            response = await client.get("/", headers=next(headers))
+            assert response.status_code == 200
+        return REQUESTS / (time.perf_counter() - start)
+
+
+def main():
+    bench_app = build_app()
+    print(f"{REQUESTS} requests, {USERS} distinct tokens")
+    print(f"{'algorithm':>10} {'cache':>6} {'req/s':>10}")
+    for algorithm in ("HS256", "RS256"):
+        signing_key, verification_key = keys(algorithm)
+        config.JWT_ALGORITHM = algorithm
+        config.JWT_PUBLIC_KEY = verification_key if algorithm.startswith("RS") else ""
+        expires = int(time.time()) + 3600
+        tokens = [jwt.encode({"sub": f"user-{i}", "exp": expires}, signing_key, algorithm=algorithm)
+                  for i in range(USERS)]
+        for cache in (False, True):
+            config.JWT_CACHE_ENABLED = cache
+            security.token_cache = VerifiedTokenCache(maxsize=10_000, max_ttl=300)
+            print(f"{algorithm:>10} {'on' if cache else 'off':>6} {asyncio.run(run(bench_app, tokens)):>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
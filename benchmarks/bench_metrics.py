@@ -0,0 +1,71 @@
+"""
+Metrics instrumentation overhead benchmark.
+
+Measures what `core/metrics.py` adds to the hot path: a single counter increment and histogram observation,
+and everything a proxied request records (request count, duration and bytes in the logging middleware,
+the authentication outcome and the upstream latency), timestamps included.
+Also measures a `/metrics` scrape that merges the snapshots of several workers.
+
+    python -m benchmarks.bench_metrics
+"""
+import os
+import tempfile
+import time
+import timeit
+
+from core.metrics import (AUTHENTICATIONS, REQUEST_BYTES, REQUEST_DURATION, REQUESTS, RESPONSE_BYTES,
+                          UPSTREAM_DURATION, Registry, registry)
+
+ITERATIONS = 1_000_000
+WORKERS = 8
+ROUTES = 50
+
+
+def per_request():
+    start = time.perf_counter()
+    AUTHENTICATIONS.inc(("cached",))
+    upstream_start = time.perf_counter()
+    UPSTREAM_DURATION.observe(time.perf_counter() - upstream_start, ("service-a", "GET", 200))
+    duration = time.perf_counter() - start
+    REQUESTS.inc(("GET", "service-a", 200))
+    REQUEST_DURATION.observe(duration, ("GET", "service-a"))
+    REQUEST_BYTES.inc(("service-a",), 0)
+    RESPONSE_BYTES.inc(("service-a",), 1024)
+
+
+def scrape() -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        for route in range(ROUTES):
+            for status in (200, 404, 500):
+                REQUESTS.inc(("GET", f"route-{route}", status))
+                REQUEST_DURATION.observe(0.01, ("GET", f"route-{route}"))
+        # Every other worker's snapshot is a copy of this one
+        registry.directory = directory
+        registry.write()
+        with open(os.path.join(directory, f"{os.getpid()}.json")) as file:
+            snapshot = file.read()
+        for worker in range(1, WORKERS):
+            with open(os.path.join(directory, f"{os.getpid() + worker}.json"), "w") as file:
+                file.write(snapshot)
+        scraper = Registry(directory=directory)
+        scraper.metrics = registry.metrics
+        elapsed = timeit.timeit(scraper.render, number=20) / 20
+        registry.directory = ""
+        return elapsed
+
+
+def main():
+    print(f"{ITERATIONS} iterations, cost per call in us")
+    cases = {
+        "Counter.inc": lambda: REQUESTS.inc(("GET", "service-a", 200)),
+        "Histogram.observe": lambda: REQUEST_DURATION.observe(0.0123, ("GET", "service-a")),
+        "per request": per_request,
+    }
+    for name, call in cases.items():
+        seconds = timeit.timeit(call, number=ITERATIONS) / ITERATIONS
+        print(f"{name:>20} {seconds * 1e6:>8.3f}")
+    print(f"/metrics scrape, {WORKERS} workers x {ROUTES * 4} series: {scrape() * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Middleware stack overhead benchmark.
+
+Measures the per-request cost of the middlewares in front of a trivial endpoint:
+no middleware, three pass-through `BaseHTTPMiddleware` layers (how the stack used to be registered with
+`app.middleware("http")`) and the pure ASGI stack from `core/middleware.py`, for a small and a 1 MB response.
+The access log only counts body bytes, so its cost does not grow with the body size.
+
+Then measures `TracingMiddleware` on its own, called directly around a minimal ASGI app, with tracing off and on at
+several sample ratios (spans are exported to nowhere); without the HTTP client in the loop, the few microseconds
+an unsampled request costs are not lost in the noise.
+
+    python -m benchmarks.bench_middleware
+"""
+import asyncio
+import time
+from typing import Optional
+
+import httpx
+from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config.config import config
+from core.middleware import LoggingMiddleware, TracingMiddleware
+from core.tracing import tracing
+
+REQUESTS = 2_000
+TRACING_CALLS = 50_000
+# Sample ratios TracingMiddleware is measured with; None is tracing off
+SAMPLE_RATIOS = (None, 0.0, 0.01, 1.0)
+LARGE_BODY = b"x" * 1024 * 1024
+
+
+async def endpoint(request):
+    return JSONResponse({"message": "This is service-a"})
+
+
+async def large(request):
+    return Response(LARGE_BODY)
+
+
+async def pass_through(request, call_next):
+    return await call_next(request)
+
+
+STACKS = {
+    "none": [],
+    "BaseHTTPMiddleware x3": [Middleware(BaseHTTPMiddleware, dispatch=pass_through) for _ in range(3)],
+    "pure ASGI": [Middleware(TracingMiddleware), Middleware(LoggingMiddleware)],
+}
+
+
+async def run(middleware: list, path: str) -> float:
+    bench_app = Starlette(routes=[Route("/small", endpoint), Route("/large", large)], middleware=middleware)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(bench_app), base_url="http://gateway") as client:
+        for _ in range(100):
+            await client.get(path)
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            response = await client.get(path)
+            assert response.status_code == 200
+        return (time.perf_counter() - start) / REQUESTS
+
+
+class DiscardingExporter(SpanExporter):
+    def export(self, spans) -> SpanExportResult:
+        return SpanExportResult.SUCCESS
+
+
+async def minimal_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def tracing_overhead(sample_ratio: Optional[float]) -> float:
+    """
+    Seconds TracingMiddleware adds to a call of `minimal_app`.
+    """
+    scope = {"type": "http", "method": "GET", "path": "/small", "query_string": b"",
+             "headers": [(b"host", b"gateway"), (b"accept", b"*/*"), (b"authorization", b"Bearer token")]}
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    async def measure(app) -> float:
+        start = time.perf_counter()
+        for _ in range(TRACING_CALLS):
+            await app(dict(scope), receive, send)
+        return time.perf_counter() - start
+
+    if sample_ratio is not None:
+        config.TRACING_SAMPLE_RATIO = sample_ratio
+        # Tail sampling off, so the rows differ by head sampling alone
+        config.TRACING_TAIL_ERRORS = False
+        config.TRACING_TAIL_SLOW_THRESHOLD = 0.0
+        tracing.start(DiscardingExporter())
+    try:
+        return (await measure(TracingMiddleware(minimal_app)) - await measure(minimal_app)) / TRACING_CALLS
+    finally:
+        await tracing.stop()
+
+
+def main():
+    print(f"{REQUESTS} sequential GETs per stack and body size, overhead over no middleware in us/request")
+    print(f"{'stack':>22} {'small':>10} {'1 MB':>10}")
+    results = {name: [asyncio.run(run(middleware, path)) for path in ("/small", "/large")]
+               for name, middleware in STACKS.items()}
+    for name, seconds in results.items():
+        overhead = [(seconds[i] - results["none"][i]) * 1e6 for i in range(2)]
+        print(f"{name:>22} {overhead[0]:>10.1f} {overhead[1]:>10.1f}")
+
+    print(f"\nTracingMiddleware alone, {TRACING_CALLS} calls per sample ratio, us/request")
+    for ratio in SAMPLE_RATIOS:
+        label = "tracing off" if ratio is None else f"{ratio:.0%} sampled"
+        print(f"{label:>22} {asyncio.run(tracing_overhead(ratio)) * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
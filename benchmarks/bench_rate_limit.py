@@ -0,0 +1,133 @@
+"""
+Rate limiter accuracy vs throughput benchmark.
+
+Compares a Redis round trip per check (the fixed-window INCR + PEXPIRE approach of fastapi-limiter) with the local
+token buckets of `core/rate_limit.py` that sync with Redis in batches:
+
+- throughput: how many checks per second a single worker can make
+- accuracy: four workers receive 1.5x the allowed rate on one key for a few seconds; how many requests were
+  admitted in the busiest window and in total over the limit
+
+Uses the Redis server at REDIS_URL when it is reachable and fakeredis otherwise; fakeredis has no network
+round trip, so it understates the cost of the per-request approach.
+
+    python -m benchmarks.bench_rate_limit
+"""
+import asyncio
+import time
+from collections import Counter
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config.config import config
+from core.rate_limit import RateLimiter, parse_rate
+
+WORKERS = 4
+RATE = "1000/second"
+OFFERED_LOAD = 1.5
+DURATION = 5.0
+TICK = 0.005
+SYNC_INTERVAL = 0.1
+
+
+async def connect():
+    redis = Redis.from_url(config.REDIS_URL)
+    try:
+        await redis.ping()
+        return redis, "redis"
+    except (RedisError, OSError):
+        import fakeredis
+        return fakeredis.FakeAsyncRedis(), "fakeredis"
+
+
+def per_request_check(redis, key: str):
+    limit, period = parse_rate(RATE)
+
+    async def check() -> bool:
+        counter = f"bench:{key}:{int(time.time() // period)}"
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.incr(counter)
+            pipe.pexpire(counter, period * 1000)
+            count, _ = await pipe.execute()
+        return count <= limit
+
+    return check
+
+
+def local_check(limiter: RateLimiter, key: str):
+    async def check() -> bool:
+        return limiter.allow(key, RATE) == 0
+
+    return check
+
+
+async def checkers(mode: str, redis, workers: int) -> tuple[list, list[RateLimiter]]:
+    key = f"{mode}:{time.time()}"
+    if mode == "per-request":
+        return [per_request_check(redis, key) for _ in range(workers)], []
+    limiters = [RateLimiter(prefix="bench:", sync_interval=SYNC_INTERVAL) for _ in range(workers)]
+    for limiter in limiters:
+        await limiter.start(redis)
+    return [local_check(limiter, key) for limiter in limiters], limiters
+
+
+async def throughput(mode: str) -> tuple[str, float]:
+    redis, backend = await connect()
+    (check,), limiters = await checkers(mode, redis, 1)
+    checks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < 1:
+        for _ in range(100):
+            await check()
+        checks += 100
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    for limiter in limiters:
+        await limiter.stop()
+    await redis.aclose()
+    return backend, checks / elapsed
+
+
+async def accuracy(mode: str) -> Counter:
+    """
+    Returns the number of admitted requests per limit window.
+    """
+    redis, _ = await connect()
+    limit, period = parse_rate(RATE)
+    checks, limiters = await checkers(mode, redis, WORKERS)
+    per_tick = round(limit / period * OFFERED_LOAD / WORKERS * TICK)
+    admitted = Counter()
+
+    async def worker(check):
+        next_tick = time.monotonic()
+        deadline = next_tick + DURATION
+        while next_tick < deadline:
+            for _ in range(per_tick):
+                if await check():
+                    admitted[int(time.time() // period)] += 1
+            next_tick += TICK
+            await asyncio.sleep(max(next_tick - time.monotonic(), 0))
+
+    await asyncio.gather(*(worker(check) for check in checks))
+    for limiter in limiters:
+        await limiter.stop()
+    await redis.aclose()
+    return admitted
+
+
+def main():
+    limit, _ = parse_rate(RATE)
+    print(f"{WORKERS} workers, one key limited to {RATE}, offered {OFFERED_LOAD}x that for {DURATION:.0f} s, "
+          f"local buckets sync every {SYNC_INTERVAL} s")
+    print(f"{'mode':>12} {'backend':>10} {'checks/s':>12} {'admitted':>9} {'max/window':>11} {'over limit':>11}")
+    for mode in ("per-request", "local"):
+        backend, rate = asyncio.run(throughput(mode))
+        windows = asyncio.run(accuracy(mode))
+        over = sum(max(count - limit, 0) for count in windows.values())
+        print(f"{mode:>12} {backend:>10} {rate:>12.0f} {sum(windows.values()):>9} {max(windows.values()):>11} "
+              f"{over:>11}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Route matching micro-benchmark.
+
+Compares the compiled trie lookup with a linear scan over the same prefixes for 10, 1,000 and 10,000 routes.
+
+    python -m benchmarks.bench_routing
+"""
+import random
+import timeit
+
+from core.routing import RouteTable, RouteTableConfig
+
+LOOKUPS = 20_000
+
+
+def build(route_count: int) -> tuple[RouteTable, list[str]]:
+    upstreams = {f"svc-{i}": f"http://svc-{i}:8000" for i in range(route_count)}
+    routes = [{"prefix": f"/svc-{i}/v1", "upstream": f"svc-{i}"} for i in range(route_count)]
+    table = RouteTable(RouteTableConfig.model_validate({"upstreams": upstreams, "routes": routes}))
+    prefixes = [route["prefix"] for route in routes]
+    return table, prefixes
+
+
+def linear_match(prefixes: list[str], path: str):
+    for prefix in prefixes:
+        if path == prefix or path.startswith(prefix + "/"):
+            return prefix
+    return None
+
+
+def main():
+    rng = random.Random(42)
+    print(f"{'routes':>8} {'trie ns/match':>15} {'linear ns/match':>17}")
+    for route_count in (10, 1_000, 10_000):
+        table, prefixes = build(route_count)
+        paths = [f"/svc-{rng.randrange(route_count)}/v1/items/{rng.randrange(1000)}" for _ in range(LOOKUPS)]
+
+        trie_time = min(timeit.repeat(lambda: [table.match("GET", p) for p in paths], number=1, repeat=5))
+        linear_time = min(timeit.repeat(lambda: [linear_match(prefixes, p) for p in paths], number=1, repeat=3))
+        print(f"{route_count:>8} {trie_time / LOOKUPS * 1e9:>15.0f} {linear_time / LOOKUPS * 1e9:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
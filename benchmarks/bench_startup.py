@@ -0,0 +1,90 @@
+"""
+Cold-start benchmark.
+
+Imports `main` in RUNS fresh interpreters and reports the median and best time of the import (which loads and
+validates the settings and builds the app; everything else waits for the lifespan), the CPU time of it and the
+time of the whole process. One more run with `-X importtime` shows the packages that cost the most, and whether
+any module that is only needed by a disabled feature (Redis, the tracing SDK and its exporters) was loaded.
+Exits with status 1 when one was, or when the median import takes longer than `--target` seconds.
+
+    python -m benchmarks.bench_startup [--target 1.0]
+"""
+import argparse
+import collections
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RUNS = 15
+# Median `import main` time on a single shared CPU; FastAPI itself takes about half of it
+TARGET = 1.0
+# Modules of features that are off by default; importing main must not load them
+DEFERRED = ("redis", "opentelemetry.sdk", "opentelemetry.exporter")
+ENV = {**os.environ, "REDIS_URL": "", "TRACING_EXPORTER": "none", "DISCOVERY_PROVIDER": ""}
+
+PROBE = f"""
+import sys, time
+started, cpu = time.perf_counter(), time.process_time()
+import main
+elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+loaded = [name for name in {DEFERRED!r} if any(m == name or m.startswith(name + ".") for m in sys.modules)]
+print(elapsed, cpu, ",".join(loaded))
+"""
+
+
+def run_once() -> tuple[float, float, float, list[str]]:
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", PROBE], env=ENV, capture_output=True, text=True, check=True).stdout
+    process = time.perf_counter() - started
+    elapsed, cpu, loaded = output.split(" ", 2)
+    return float(elapsed), float(cpu), process, [name for name in loaded.strip().split(",") if name]
+
+
+def import_costs(top: int = 8) -> list[tuple[str, float]]:
+    """
+    Import time spent in each top-level package, in milliseconds, excluding what they import from other packages.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], env=ENV,
+                            capture_output=True, text=True, check=True)
+    costs = collections.Counter()
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[0].split(":")[-1].strip().isdigit():
+            continue
+        costs[parts[2].strip().split(".")[0]] += int(parts[0].split(":")[-1]) / 1000
+    return costs.most_common(top)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold-start time of the gateway.")
+    parser.add_argument("--target", type=float, default=TARGET, help="Median `import main` time to stay under (s)")
+    parser.add_argument("--runs", type=int, default=RUNS, help="Fresh interpreters to measure")
+    args = parser.parse_args()
+
+    imports, cpus, processes, loaded = [], [], [], set()
+    for _ in range(args.runs):
+        elapsed, cpu, process, modules = run_once()
+        imports.append(elapsed)
+        cpus.append(cpu)
+        processes.append(process)
+        loaded.update(modules)
+
+    print(f"{args.runs} cold starts, in ms")
+    print(f"{'':>14} {'median':>8} {'best':>8}")
+    print(f"{'import main':>14} {statistics.median(imports) * 1000:>8.0f} {min(imports) * 1000:>8.0f}")
+    print(f"{'  of it CPU':>14} {statistics.median(cpus) * 1000:>8.0f} {min(cpus) * 1000:>8.0f}")
+    print(f"{'process':>14} {statistics.median(processes) * 1000:>8.0f} {min(processes) * 1000:>8.0f}")
+    print("\nimport time by package (ms)")
+    for package, cost in import_costs():
+        print(f"{package:>14} {cost:>8.0f}")
+    print(f"\nmodules of disabled features loaded: {', '.join(sorted(loaded)) or 'none'}")
+
+    met = statistics.median(imports) <= args.target and not loaded
+    print(f"target {args.target * 1000:.0f} ms: {'met' if met else 'missed'}")
+    sys.exit(0 if met else 1)
+
+
+if __name__ == "__main__":
+    main()
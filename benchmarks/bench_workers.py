@@ -0,0 +1,137 @@
+"""
+Multi-worker throughput benchmark.
+
+Starts the bundled `services/service_a` stub, then the gateway through `serve.py` with one worker and with one
+worker per CPU, and drives authenticated GET /service-a/some-path requests through it for DURATION seconds
+from LOAD_PROCESSES client processes. Reports requests/sec and latency percentiles per worker count.
+
+The gateway runs without Redis (rate limiting and the L2 cache off) and without request coalescing, so every
+request is proxied to the stub. The clients share the machine with the gateway and the stub, so the numbers
+understate what the workers do on a dedicated box.
+
+    python -m benchmarks.bench_workers
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import jwt
+
+DURATION = 10.0
+WARMUP = 2.0
+CONNECTIONS = 64
+CPUS = os.cpu_count() or 1
+LOAD_PROCESSES = max(2, CPUS // 2)
+WORKER_COUNTS = sorted({1, CPUS})
+SECRET = "bench-workers-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=40)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def drive(url: str, token: str, until: float, record_from: float) -> tuple[list[float], int]:
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=CONNECTIONS, max_keepalive_connections=CONNECTIONS)
+    async with httpx.AsyncClient(headers={"Authorization": f"Bearer {token}"}, limits=limits, timeout=10) as client:
+
+        async def loop():
+            nonlocal errors
+            while (now := time.perf_counter()) < until:
+                try:
+                    response = await client.get(url)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if now >= record_from:
+                    if ok:
+                        latencies.append(time.perf_counter() - now)
+                    else:
+                        errors += 1
+
+        await asyncio.gather(*(loop() for _ in range(CONNECTIONS // LOAD_PROCESSES or 1)))
+    return latencies, errors
+
+
+def load(args) -> tuple[list[float], int]:
+    url, token, start = args
+    return asyncio.run(drive(url, token, start + WARMUP + DURATION, start + WARMUP))
+
+
+def run(workers: int, stub_url: str) -> tuple[float, float, float, int]:
+    port = free_port()
+    env = {**os.environ, "SERVICE_A_URL": stub_url, "SERVICE_A_URLS": stub_url, "JWT_SECRET": SECRET,
+           "JWT_ALGORITHM": "HS256", "RATE_LIMIT_ENABLED": "false", "CACHE_L2_ENABLED": "false",
+           "COALESCE_ENABLED": "false", "DISCOVERY_PROVIDER": "", "METRICS_DIR": "", "DEBUG": "false"}
+    gateway = subprocess.Popen([sys.executable, "serve.py", "--host", "127.0.0.1", "--port", str(port),
+                                "--workers", str(workers)], env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/openapi.json")
+        token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 3600}, SECRET, algorithm="HS256")
+        url = f"http://127.0.0.1:{port}/service-a/some-path"
+        start = time.perf_counter()
+        with multiprocessing.Pool(LOAD_PROCESSES) as pool:
+            results = pool.map(load, [(url, token, start)] * LOAD_PROCESSES)
+    finally:
+        stop(gateway)
+    latencies = sorted(latency for result in results for latency in result[0])
+    errors = sum(result[1] for result in results)
+    if not latencies:
+        return 0.0, 0.0, 0.0, errors
+    p50 = latencies[len(latencies) // 2]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return len(latencies) / DURATION, p50, p99, errors
+
+
+def main():
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, "-m", "uvicorn", "services.service_a.main:app", "--host", "127.0.0.1",
+                             "--port", str(stub_port), "--workers", str(CPUS), "--no-access-log",
+                             "--log-level", "warning"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    try:
+        wait_ready(f"{stub_url}/health")
+        print(f"{CPUS} CPUs, {LOAD_PROCESSES} load processes, {CONNECTIONS} connections, {DURATION:.0f}s per run")
+        print(f"{'workers':>8} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        baseline = None
+        for workers in WORKER_COUNTS:
+            throughput, p50, p99, errors = run(workers, stub_url)
+            baseline = baseline or throughput
+            speedup = f"  {throughput / baseline:.2f}x" if baseline else ""
+            print(f"{workers:>8} {throughput:>9.0f} {p50 * 1000:>8.1f} {p99 * 1000:>8.1f} {errors:>7}{speedup}")
+    finally:
+        stop(stub)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,314 @@
+import functools
+import json
+import logging
 import os
 import secrets
+from typing import Literal, Mapping, Optional
+
 from dotenv import load_dotenv
-from consul import Consul
+from pydantic import BaseModel, ConfigDict, field_validator, model_validator
 
+# .env is exported into the environment without overriding it (the routes file expands variables from it too)
 load_dotenv()
 
-class Config:
+
+class Settings(BaseModel):
+    """
+    One validated, immutable set of the gateway's settings. Values come from the field defaults, the JSON file
+    named by SETTINGS_FILE and the environment, each overriding the one before (see `load_settings`).
+    """
+    model_config = ConfigDict(frozen=True)
+
     # Service URLs
-    SERVICE_A_URL = os.getenv("SERVICE_A_URL", "http://localhost:8001")
-    SERVICE_B_URL = os.getenv("SERVICE_B_URL", "http://localhost:8002")
+    SERVICE_A_URL: str = "http://localhost:8001"
+    SERVICE_B_URL: str = "http://localhost:8002"
+    # Comma-separated endpoints of the built-in upstreams (replaced by service discovery when it has instances)
+    SERVICE_A_URLS: tuple[str, ...] = ()
+    SERVICE_B_URLS: tuple[str, ...] = ()
 
     # API Gateway settings
-    PORT = int(os.getenv("PORT", 8000))
-    DEBUG = os.getenv("DEBUG", 'false').lower() == 'true'
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    # Worker processes started by serve.py (0: one per CPU); they share the port through SO_REUSEPORT
+    WORKERS: int = 0
+    SERVER_REUSE_PORT: bool = True
+    SERVER_BACKLOG: int = 2048
+    # Event loop (auto, uvloop or asyncio) and HTTP parser (auto, httptools or h11); auto uses uvloop and
+    # httptools when they are installed
+    SERVER_LOOP: Literal["auto", "uvloop", "asyncio"] = "auto"
+    SERVER_HTTP: Literal["auto", "httptools", "h11"] = "auto"
+    # On SIGTERM workers stop accepting connections and give in-flight requests this long to finish (seconds)
+    GRACEFUL_SHUTDOWN_TIMEOUT: float = 30.0
+    DEBUG: bool = False
+    # Stream request/response bodies through untouched instead of re-encoding them as JSON
+    STREAMING_PROXY: bool = True
+    # JSON encoder/decoder: auto (msgspec, then orjson, when installed), msgspec, orjson or json
+    JSON_CODEC: Literal["auto", "msgspec", "orjson", "json"] = "auto"
+
+    # Routing (JSON route table; the built-in service-a/service-b routes are used when unset)
+    ROUTES_FILE: str = ""
+    ROUTES_RELOAD_INTERVAL: float = 5.0
 
     # Authentication settings
-    JWT_SECRET = os.getenv("JWT_SECRET", secrets.token_urlsafe(32))
-    JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+    # Shared secret of HS* tokens; every worker and gateway instance needs the same one, so it must be set
+    # unless DEBUG is on
+    JWT_SECRET: str = ""
+    JWT_ALGORITHM: str = "HS256"
+    # PEM public key used to verify RS*/ES*/PS* tokens; "\\n" stands for a line break
+    JWT_PUBLIC_KEY: str = ""
+    # JWKS endpoint; when set, tokens are verified with the key named by their `kid`
+    JWT_JWKS_URL: str = ""
+    JWT_JWKS_CACHE_TTL: float = 300.0
+    JWT_JWKS_MIN_REFRESH_INTERVAL: float = 30.0
+    JWT_JWKS_TIMEOUT: float = 5.0
+    # Verified tokens are cached until they expire, so repeat tokens skip the signature check
+    JWT_CACHE_ENABLED: bool = True
+    JWT_CACHE_MAX_SIZE: int = 10_000
+    JWT_CACHE_MAX_TTL: float = 300.0
+
+    # Access log (structured, sampled and written in the background)
+    ACCESS_LOG_ENABLED: bool = True
+    ACCESS_LOG_SAMPLE_RATE: float = 1.0
+    # Share of requests whose (truncated) bodies and redacted headers are logged as well
+    ACCESS_LOG_BODY_SAMPLE_RATE: float = 0.0
+    ACCESS_LOG_BODY_MAX_BYTES: int = 1024
+    ACCESS_LOG_REDACT_HEADERS: str = "authorization,proxy-authorization,cookie,set-cookie,x-api-key"
+    ACCESS_LOG_QUEUE_SIZE: int = 10_000
+    ACCESS_LOG_FLUSH_INTERVAL: float = 0.5
+    # JSON lines file; entries go to the application log when unset
+    ACCESS_LOG_FILE: str = ""
+
+    # Prometheus metrics
+    METRICS_PATH: str = "/metrics"
+    # Directory where every worker process writes its metrics snapshot, merged on scrape; unset for a single worker
+    METRICS_DIR: str = ""
+    METRICS_FLUSH_INTERVAL: float = 1.0
 
     # Rate Limiting
-    RATE_LIMIT = os.getenv("RATE_LIMIT", "100/minute") # eg, 100/minute or 1000/hour
+    RATE_LIMIT: str = "100/minute"  # eg, 100/minute or 1000/hour
+    # Enforced per route and JWT subject from local token buckets that are reconciled with Redis in batches
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_SYNC_INTERVAL: float = 0.5
+    RATE_LIMIT_PREFIX: str = "gateway:ratelimit:"
 
-    # Jaeger Tracing
-    JAEGER_HOST = os.getenv("JAEGER_HOST", "localhost")
-    JAEGER_PORT = int(os.getenv("JAEGER_PORT", 14250))
+    # Tracing: spans are exported over OTLP/HTTP (otlp), to the Jaeger collector (jaeger) or not at all (none)
+    TRACING_EXPORTER: Literal["none", "otlp", "jaeger"] = "none"
+    TRACING_SERVICE_NAME: str = "api-gateway"
+    DEPLOYMENT_ENVIRONMENT: str = "development"
+    OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    # Share of requests traced from the start; a caller's traceparent decides for the requests that carry one
+    TRACING_SAMPLE_RATIO: float = 0.01
+    # Requests that were not sampled are still traced when they fail (5xx) or take longer than the threshold
+    # (seconds, 0 to disable)
+    TRACING_TAIL_ERRORS: bool = True
+    TRACING_TAIL_SLOW_THRESHOLD: float = 1.0
+
+    # Jaeger Tracing (TRACING_EXPORTER=jaeger)
+    JAEGER_HOST: str = "localhost"
+    JAEGER_PORT: int = 14250
 
     # Health Check
-    HEALTH_CHECK_PATH = os.getenv("HEALTH_CHECK_PATH", "/health")
-    HEALTH_CHECK_SERVICE_A = os.getenv("HEALTH_CHECK_SERVICE_A", "/health")
-    HEALTH_CHECK_SERVICE_B = os.getenv("HEALTH_CHECK_SERVICE_B", "/health")
+    HEALTH_CHECK_PATH: str = "/health"
+    HEALTH_CHECK_SERVICE_A: str = "/health"
+    HEALTH_CHECK_SERVICE_B: str = "/health"
+    HEALTH_CHECK_TIMEOUT: float = 2.0
+    # Upstreams are checked in the background; /health and routing use the latest results
+    HEALTH_CHECK_INTERVAL: float = 5.0
+    HEALTH_CHECK_UNHEALTHY_THRESHOLD: int = 2
+    HEALTH_CHECK_HEALTHY_THRESHOLD: int = 1
+    # Health check path of routes file upstreams without an entry in `health_checks`
+    HEALTH_CHECK_UPSTREAM_PATH: str = "/health"
+
+    # Upstream connection pool (one pool per upstream service)
+    UPSTREAM_MAX_CONNECTIONS: int = 100
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    UPSTREAM_KEEPALIVE_EXPIRY: float = 30.0
+    UPSTREAM_HTTP2: bool = False
+    UPSTREAM_CONNECT_TIMEOUT: float = 5.0
+    UPSTREAM_READ_TIMEOUT: float = 30.0
+    UPSTREAM_WRITE_TIMEOUT: float = 30.0
+    UPSTREAM_POOL_TIMEOUT: float = 5.0
+
+    # Load balancing over the endpoints of an upstream: round_robin, weighted, least_outstanding,
+    # power_of_two or consistent_hash
+    UPSTREAM_BALANCER: Literal["round_robin", "weighted", "least_outstanding", "power_of_two",
+                               "consistent_hash"] = "least_outstanding"
+    # Passive outlier ejection: endpoints that keep failing or are much slower than the rest are taken out
+    OUTLIER_CONSECUTIVE_FAILURES: int = 5
+    OUTLIER_LATENCY_FACTOR: float = 3.0
+    # Endpoints answering faster than this (seconds) are never ejected for latency
+    OUTLIER_MIN_LATENCY: float = 0.05
+    # Weight of the newest response time in an endpoint's moving average
+    OUTLIER_LATENCY_ALPHA: float = 0.1
+    # First ejection lasts OUTLIER_EJECTION_TIME seconds, every further one that much longer
+    OUTLIER_EJECTION_TIME: float = 30.0
+    OUTLIER_MAX_EJECTION_TIME: float = 300.0
+    OUTLIER_MAX_EJECTION_PERCENT: int = 50
+
+    # Service discovery: consul (blocking queries on the health API) or file (JSON file, polled); off when unset
+    DISCOVERY_PROVIDER: Literal["", "consul", "file"] = ""
+    CONSUL_URL: str = "http://localhost:8500"
+    CONSUL_TOKEN: str = ""
+    DISCOVERY_FILE: str = "services.json"
+    # How long Consul may hold a blocking query open when nothing changes (seconds)
+    DISCOVERY_WAIT: float = 55.0
+    # How often the file is polled and the set of watched services is updated
+    DISCOVERY_INTERVAL: float = 5.0
+    DISCOVERY_TIMEOUT: float = 5.0
+
+    # Circuit breakers (one per upstream, or per upstream and route)
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = 5
+    CIRCUIT_BREAKER_RESET_TIMEOUT: float = 30.0
+    CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS: int = 1
+    CIRCUIT_BREAKER_PER_ROUTE: bool = False
+
+    # Adaptive concurrency limit per upstream: the limit follows the upstream's latency, calls over it wait in a
+    # bounded queue by priority and are shed with a 503 when the queue is full or they waited too long (seconds)
+    CONCURRENCY_LIMIT_ENABLED: bool = True
+    CONCURRENCY_LIMIT_INITIAL: int = 20
+    CONCURRENCY_LIMIT_MIN: int = 4
+    CONCURRENCY_LIMIT_MAX: int = 500
+    # How much the short-term latency may exceed the long-term one before the limit shrinks
+    CONCURRENCY_LIMIT_TOLERANCE: float = 1.5
+    CONCURRENCY_QUEUE_SIZE: int = 100
+    CONCURRENCY_QUEUE_TIMEOUT: float = 1.0
+    # Priority classes, highest first, picked by a claim of the request's token
+    CONCURRENCY_PRIORITY_CLAIM: str = "priority"
+    CONCURRENCY_PRIORITY_CLASSES: str = "critical,default,batch"
+    CONCURRENCY_PRIORITY_DEFAULT: str = "default"
+
+    # Hedged GETs on routes with a `hedge` setting: the extra calls are capped at HEDGE_BUDGET_RATIO of the
+    # route's requests plus HEDGE_BUDGET_MIN_PER_SECOND; the observed delay is at least HEDGE_MIN_DELAY seconds
+    HEDGE_BUDGET_RATIO: float = 0.1
+    HEDGE_BUDGET_MIN_PER_SECOND: float = 1.0
+    HEDGE_MIN_DELAY: float = 0.005
+    # Upstream latencies per route the hedge delay percentile is taken from
+    HEDGE_LATENCY_WINDOW: int = 1000
+
+    # Retries (exponential backoff with jitter, capped by a retry budget and the request deadline)
+    RETRY_MAX_ATTEMPTS: int = 3
+    RETRY_BACKOFF_BASE: float = 0.05
+    RETRY_BACKOFF_MAX: float = 1.0
+    RETRY_BUDGET_RATIO: float = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND: float = 1.0
+    # Clients may send the number of seconds they are willing to wait; it is passed on to the upstream
+    REQUEST_TIMEOUT_HEADER: str = "x-request-timeout"
+
+    # Response cache for proxied GET requests (honours Cache-Control, ETag and Last-Modified)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_MAX_ENTRY_BYTES: int = 1024 * 1024
+    CACHE_STATS_PATH: str = "/cache/stats"
+
+    # Response compression, negotiated with Accept-Encoding; encodings in order of preference (br and zstd need the
+    # brotli and zstandard packages). Cached responses keep their compressed variants.
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_ENCODINGS: str = "zstd,br,gzip"
+    # Smaller bodies are sent as they are
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    COMPRESSION_ZSTD_LEVEL: int = 3
+
+    # Request coalescing: concurrent identical GETs share one upstream call
+    COALESCE_ENABLED: bool = True
+    # Requests are only coalesced when these headers match as well
+    COALESCE_KEY_HEADERS: str = "authorization,accept,accept-encoding,accept-language"
+
+    # Two-tier cache: in-process L1 in front of the shared Redis L2
+    CACHE_L2_ENABLED: bool = True
+    CACHE_L2_PREFIX: str = "gateway:cache:"
+    CACHE_L2_STALE_TTL: int = 300
+    CACHE_INVALIDATION_CHANNEL: str = "gateway:cache:invalidate"
+
+    # Redis shared by the workers for rate limits and the L2 cache; unset, every worker keeps both to itself
+    REDIS_URL: str = "redis://localhost:6379/0"
+
+    @field_validator("SERVICE_A_URLS", "SERVICE_B_URLS", mode="before")
+    @classmethod
+    def _split_urls(cls, value):
+        if isinstance(value, str):
+            return tuple(url.strip() for url in value.split(",") if url.strip())
+        return value
+
+    @field_validator("SERVER_LOOP", "SERVER_HTTP", "JSON_CODEC", "TRACING_EXPORTER", "DISCOVERY_PROVIDER",
+                     mode="before")
+    @classmethod
+    def _lower(cls, value):
+        return value.lower() if isinstance(value, str) else value
+
+    @field_validator("JWT_PUBLIC_KEY")
+    @classmethod
+    def _line_breaks(cls, value: str) -> str:
+        return value.replace("\\n", "\n")
+
+    @model_validator(mode="before")
+    @classmethod
+    def _default_urls(cls, values):
+        # Without an endpoint list, the built-in upstreams have a single endpoint each
+        if isinstance(values, dict):
+            for single, several in (("SERVICE_A_URL", "SERVICE_A_URLS"), ("SERVICE_B_URL", "SERVICE_B_URLS")):
+                if several not in values:
+                    values = {**values, several: values.get(single, cls.model_fields[single].default)}
+        return values
+
+    @model_validator(mode="after")
+    def _secret(self):
+        if not self.JWT_SECRET and self.JWT_ALGORITHM.startswith("HS") and not self.JWT_JWKS_URL and not self.DEBUG:
+            raise ValueError(f"JWT_SECRET must be set to verify {self.JWT_ALGORITHM} tokens")
+        return self
+
+
+def load_settings(environ: Optional[Mapping[str, str]] = None) -> Settings:
+    """
+    Reads and validates the settings from SETTINGS_FILE (a JSON object of setting names and values) and the
+    environment, which takes precedence. Raises ValueError (pydantic's ValidationError included) for an unknown
+    or invalid setting, and OSError when the file cannot be read.
+    """
+    environ = os.environ if environ is None else environ
+    values = {}
+    path = environ.get("SETTINGS_FILE")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            values = json.load(f)
+        if not isinstance(values, dict):
+            raise ValueError(f"{path} must hold a JSON object of settings")
+        unknown = values.keys() - Settings.model_fields.keys()
+        if unknown:
+            raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+    values.update((name, environ[name]) for name in Settings.model_fields if name in environ)
+    settings = Settings.model_validate(values)
+    if not settings.JWT_SECRET:
+        settings = settings.model_copy(update={"JWT_SECRET": _generated_secret()})
+    return settings
+
+
+@functools.lru_cache(maxsize=1)
+def _generated_secret() -> str:
+    logging.warning("JWT_SECRET is not set: using a random secret, which only this process knows")
+    return secrets.token_urlsafe(32)
+
+
+class Config:
+    """
+    The settings in effect. Every field of the current `Settings` snapshot is an attribute, so reading a setting
+    is a plain attribute lookup; `snapshot` is the snapshot itself, for code that needs values that belong
+    together. `reload` validates the sources again and swaps in the new snapshot as a whole, or raises and
+    keeps the current one.
+    """
+
+    def __init__(self, settings: Optional[Settings] = None):
+        self.apply(settings or load_settings())
 
-    # Redis URL
-    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    def apply(self, settings: Settings):
+        values = dict(settings)
+        values["snapshot"] = settings
+        # A single assignment, so no reader sees a mix of two snapshots
+        self.__dict__ = values
 
-    def __init__(self):
-        self.consul = Consul()
+    def reload(self) -> Settings:
+        self.apply(load_settings())
+        return self.snapshot
 
-    def discover_services(self):
-        index, services = self.consul.catalog.services()
-        service_a = services.get('service-a')
-        service_b = services.get('service-b')
-        if service_a:
-            self.SERVICE_A_URL = f"http://{service_a[0]['ServiceAddress']}:{service_a[0]['ServicePort']}"
-        if service_b:
-            self.SERVICE_B_URL = f"http://{service_b[0]['ServiceAddress']}:{service_b[0]['ServicePort']}"
 
 config = Config()
-config.discover_services()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Optional
+
+from loguru import logger
+
+from config.config import config
+from core.codec import json_codec
+
+REDACTED = "[REDACTED]"
+
+
+def redact_headers(raw_headers, redact: frozenset) -> dict:
+    """
+    Decodes raw (name, value) header pairs, replacing the values of sensitive headers.
+    """
+    headers = {}
+    for name, value in raw_headers:
+        key = name.decode("latin-1").lower()
+        headers[key] = REDACTED if key in redact else value.decode("latin-1")
+    return headers
+
+
+def capture_body(chunks: list[bytes], size: int, max_bytes: int) -> dict:
+    """
+    Decodes the captured start of a body; `size` is the full body length.
+    """
+    return {"body": b"".join(chunks)[:max_bytes].decode("utf-8", errors="replace"), "truncated": size > max_bytes}
+
+
+class AccessLog:
+    """
+    Bounded in-memory queue of access log records, drained in batches by a background writer.
+
+    Recording a request is an append to a deque; formatting and I/O happen in the writer, off the request path.
+    When the queue is full new records are dropped (and counted) rather than slowing requests down.
+    """
+
+    def __init__(self, max_size: int, flush_interval: float, path: str = ""):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.path = path
+        self.redact = frozenset(name.strip().lower() for name in config.ACCESS_LOG_REDACT_HEADERS.split(",")
+                                if name.strip())
+        self._records: deque[dict] = deque()
+        self._writer: Optional[asyncio.Task] = None
+        self._file = None
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, entry: dict):
+        if len(self._records) >= self.max_size:
+            self.dropped += 1
+            return
+        self._records.append(entry)
+
+    async def start(self):
+        if self.path:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._writer:
+            self._writer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._writer
+            self._writer = None
+        await self.flush()
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Failed to write access log: {e}")
+
+    async def flush(self):
+        """
+        Writes every queued record as one JSON line.
+        """
+        if not self._records:
+            return
+        batch = []
+        while self._records:
+            batch.append(self._format(self._records.popleft()))
+        if self._file:
+            await asyncio.to_thread(self._write, "".join(line + "\n" for line in batch))
+        else:
+            for line in batch:
+                logger.info(line)
+        self.written += len(batch)
+
+    def _write(self, data: str):
+        self._file.write(data)
+        self._file.flush()
+
+    @staticmethod
+    def _format(entry: dict) -> str:
+        entry["ts"] = datetime.fromtimestamp(entry["ts"], timezone.utc).isoformat(timespec="milliseconds")
+        entry["duration_ms"] = round(entry["duration_ms"], 3)
+        if entry.get("upstream_ms") is not None:
+            entry["upstream_ms"] = round(entry["upstream_ms"], 3)
+        return json_codec.dumps(entry).decode("utf-8")
+
+    def stats(self) -> dict:
+        return {"queued": len(self._records), "written": self.written, "dropped": self.dropped}
+
+
+access_log = AccessLog(max_size=config.ACCESS_LOG_QUEUE_SIZE, flush_interval=config.ACCESS_LOG_FLUSH_INTERVAL,
+                       path=config.ACCESS_LOG_FILE)
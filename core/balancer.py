@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import random
+import time
+from bisect import bisect
+from statistics import median
+from typing import Callable, Optional
+
+from config.config import config
+from core.metrics import UPSTREAM_EJECTIONS
+
+
+class Endpoint:
+    """
+    One instance of an upstream service, with what the gateway has observed about it.
+    """
+
+    __slots__ = ("url", "weight", "pool", "outstanding", "current_weight", "latency", "failures", "ejected_until",
+                 "ejections")
+
+    def __init__(self, url: str, weight: int, pool: "EndpointPool"):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.pool = pool
+        # Requests sent to this endpoint that have not been answered yet
+        self.outstanding = 0
+        # Smooth weighted round-robin state
+        self.current_weight = 0
+        # Moving average of the response time in seconds (None until the first response)
+        self.latency: Optional[float] = None
+        # Consecutive failed calls
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    def rebase(self, url: str) -> str:
+        """
+        Points a URL built from the pool's base URL (see `Route.url_for`) at this endpoint.
+        """
+        return self.url + url[len(self.pool.base_url):]
+
+    def release(self, ok: Optional[bool], latency: float):
+        """
+        Records the outcome of a call that was started with `EndpointPool.pick`; `ok` is None for a call that
+        never reached the endpoint.
+        """
+        self.outstanding -= 1
+        if ok is not None:
+            self.pool.record(self, ok, latency)
+
+
+def _round_robin(pool: "EndpointPool", candidates: list[Endpoint], key: Optional[str]) -> Endpoint:
+    pool.counter += 1
+    return candidates[pool.counter % len(candidates)]
+
+
+def _weighted(pool: "EndpointPool", candidates: list[Endpoint], key: Optional[str]) -> Endpoint:
+    # Smooth weighted round-robin (as in nginx): spreads the picks of heavy endpoints instead of bursting them
+    total = 0
+    best = None
+    for endpoint in candidates:
+        endpoint.current_weight += endpoint.weight
+        total += endpoint.weight
+        if best is None or endpoint.current_weight > best.current_weight:
+            best = endpoint
+    best.current_weight -= total
+    return best
+
+
+def _least_outstanding(pool: "EndpointPool", candidates: list[Endpoint], key: Optional[str]) -> Endpoint:
+    # Ties are broken at random so an idle pool does not send every request to the first endpoint
+    return min(candidates, key=lambda endpoint: (endpoint.outstanding / endpoint.weight, random.random()))
+
+
+def _power_of_two(pool: "EndpointPool", candidates: list[Endpoint], key: Optional[str]) -> Endpoint:
+    if len(candidates) < 3:
+        return _least_outstanding(pool, candidates, key)
+    first, second = random.sample(candidates, 2)
+    return first if first.outstanding / first.weight <= second.outstanding / second.weight else second
+
+
+def _consistent_hash(pool: "EndpointPool", candidates: list[Endpoint], key: Optional[str]) -> Endpoint:
+    if key is None:
+        return _least_outstanding(pool, candidates, key)
+    # Walk the ring clockwise from the key's position to the first endpoint that may be used
+    available = set(map(id, candidates))
+    ring = pool.ring
+    start = bisect(pool.ring_hashes, _hash(key))
+    for offset in range(len(ring)):
+        endpoint = ring[(start + offset) % len(ring)][1]
+        if id(endpoint) in available:
+            return endpoint
+    return candidates[0]
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+STRATEGIES: dict[str, Callable[["EndpointPool", list[Endpoint], Optional[str]], Endpoint]] = {
+    "round_robin": _round_robin,
+    "weighted": _weighted,
+    "least_outstanding": _least_outstanding,
+    "power_of_two": _power_of_two,
+    "consistent_hash": _consistent_hash,
+}
+
+# Points per unit of weight on the consistent hash ring
+_RING_REPLICAS = 100
+
+
+class EndpointPool:
+    """
+    The endpoints of one upstream and the strategy that spreads requests over them.
+
+    Endpoints that fail their health checks are skipped. Endpoints are also ejected passively, for a time
+    that grows with every ejection, when OUTLIER_CONSECUTIVE_FAILURES calls in a row fail or when their average
+    response time is OUTLIER_LATENCY_FACTOR times the pool's median. At most OUTLIER_MAX_EJECTION_PERCENT of the
+    endpoints are ejected at once; if no endpoint is left to pick, all of them are used again.
+    """
+
+    def __init__(self, name: str, endpoints: list[tuple[str, int]], strategy: str = None,
+                 hash_header: Optional[str] = None, service: Optional[str] = None):
+        strategy = strategy or config.UPSTREAM_BALANCER
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown balancer {strategy!r} for upstream {name!r}")
+        if not endpoints:
+            raise ValueError(f"Upstream {name!r} has no endpoints")
+        self.name = name
+        # Name of the upstream in service discovery
+        self.service = service or name
+        self.strategy = strategy
+        self.hash_header = hash_header.lower() if hash_header else None
+        self.endpoints: list[Endpoint] = []
+        # URLs built from the first configured endpoint identify resources (see `Route.url_for`); it stays the
+        # base URL when discovery replaces the endpoints
+        self.base_url = endpoints[0][0].rstrip("/")
+        self.counter = -1
+        self._choose = STRATEGIES[strategy]
+        self.update(endpoints)
+
+    def update(self, endpoints: list[tuple[str, int]]):
+        """
+        Replaces the set of endpoints. Endpoints that remain keep their outstanding requests and ejection state.
+        """
+        if not endpoints:
+            return
+        current = {endpoint.url: endpoint for endpoint in self.endpoints}
+        updated = []
+        for url, weight in endpoints:
+            endpoint = current.get(url.rstrip("/")) or Endpoint(url, weight, self)
+            endpoint.weight = weight
+            updated.append(endpoint)
+        ring = [(_hash(f"{endpoint.url}#{i}"), endpoint)
+                for endpoint in updated for i in range(_RING_REPLICAS * endpoint.weight)]
+        ring.sort(key=lambda point: point[0])
+        self.endpoints = updated
+        self.ring = ring
+        self.ring_hashes = [point for point, _ in ring]
+
+    def hash_key(self, headers) -> Optional[str]:
+        """
+        Returns the value of the consistent hashing header from a header dict or a list of raw header pairs.
+        """
+        if self.hash_header is None:
+            return None
+        if isinstance(headers, list):
+            name = self.hash_header.encode("latin-1")
+            return next((v.decode("latin-1") for k, v in headers if k.lower() == name), None)
+        return headers.get(self.hash_header)
+
+    def available(self, healthy: Callable[[str], bool] = None) -> list[Endpoint]:
+        now = time.monotonic()
+        return [endpoint for endpoint in self.endpoints
+                if endpoint.ejected_until <= now and (healthy is None or healthy(endpoint.url))]
+
+    def pick(self, key: Optional[str] = None, healthy: Callable[[str], bool] = None,
+             avoid: Optional[Endpoint] = None) -> Endpoint:
+        """
+        Chooses the endpoint for a call and counts it as outstanding until `Endpoint.release`.
+        `healthy` (endpoint URL -> bool) reports the results of the active health checks. `avoid` is passed over
+        unless it is the only endpoint that may be used.
+        """
+        if len(self.endpoints) == 1:
+            endpoint = self.endpoints[0]
+        else:
+            candidates = self.available(healthy) or self.endpoints
+            if avoid is not None and len(candidates) > 1:
+                candidates = [candidate for candidate in candidates if candidate is not avoid]
+            endpoint = self._choose(self, candidates, key)
+        endpoint.outstanding += 1
+        return endpoint
+
+    def record(self, endpoint: Endpoint, ok: bool, latency: float):
+        if ok:
+            endpoint.failures = 0
+            alpha = config.OUTLIER_LATENCY_ALPHA
+            endpoint.latency = latency if endpoint.latency is None else (
+                alpha * latency + (1 - alpha) * endpoint.latency)
+            if len(self.endpoints) > 2 and endpoint.latency > config.OUTLIER_MIN_LATENCY:
+                latencies = [other.latency for other in self.endpoints if other.latency is not None]
+                if len(latencies) > 2 and endpoint.latency > config.OUTLIER_LATENCY_FACTOR * median(latencies):
+                    self._eject(endpoint, f"average latency {endpoint.latency * 1000:.0f} ms")
+        else:
+            endpoint.failures += 1
+            if endpoint.failures >= config.OUTLIER_CONSECUTIVE_FAILURES:
+                self._eject(endpoint, f"{endpoint.failures} consecutive failures")
+
+    def _eject(self, endpoint: Endpoint, reason: str):
+        now = time.monotonic()
+        if endpoint.ejected_until > now:
+            return
+        ejected = sum(1 for other in self.endpoints if other.ejected_until > now)
+        if (ejected + 1) * 100 > config.OUTLIER_MAX_EJECTION_PERCENT * len(self.endpoints):
+            return
+        endpoint.ejections += 1
+        duration = min(config.OUTLIER_EJECTION_TIME * endpoint.ejections, config.OUTLIER_MAX_EJECTION_TIME)
+        endpoint.ejected_until = now + duration
+        endpoint.failures = 0
+        # Start over once it is back, so the old average does not eject it again straight away
+        endpoint.latency = None
+        UPSTREAM_EJECTIONS.inc((self.name, endpoint.url))
+        logging.warning(f"Ejected {endpoint.url} from upstream {self.name} for {duration:.0f}s: {reason}")
+
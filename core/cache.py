@@ -0,0 +1,345 @@
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+from config.config import config
+from core.compression import Encoder
+
+# Status codes a shared cache may store when the response carries explicit freshness or validators
+CACHEABLE_STATUS_CODES = frozenset({200, 203, 204, 300, 301, 404, 410})
+
+# Headers describing the stored representation, the only ones sent along with a 304
+NOT_MODIFIED_HEADERS = frozenset({
+    b"cache-control", b"content-location", b"date", b"etag", b"expires", b"last-modified", b"vary",
+})
+
+# Rough per-entry bookkeeping overhead counted against the byte budget
+ENTRY_OVERHEAD = 256
+
+
+def parse_cache_control(value: Optional[str]) -> dict[str, Optional[str]]:
+    """
+    Parses a Cache-Control header into a {directive: argument} dict.
+    """
+    directives = {}
+    if value:
+        for part in value.split(","):
+            name, _, argument = part.strip().partition("=")
+            if name:
+                directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _seconds(value: Optional[str]) -> Optional[int]:
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _find_header(headers: list[tuple[bytes, bytes]], name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+def freshness_lifetime(headers: list[tuple[bytes, bytes]]) -> float:
+    """
+    Seconds a response stays fresh in a shared cache, 0 when it must always be revalidated.
+    """
+    directives = parse_cache_control(_find_header(headers, b"cache-control"))
+    if "no-cache" in directives:
+        return 0
+    for directive in ("s-maxage", "max-age"):
+        if directive in directives:
+            return _seconds(directives[directive]) or 0
+    expires = _http_date(_find_header(headers, b"expires"))
+    if expires is not None:
+        date = _http_date(_find_header(headers, b"date")) or time.time()
+        return max(expires - date, 0)
+    return 0
+
+
+def is_storable(request_headers, status_code: int, response_headers: list[tuple[bytes, bytes]]) -> bool:
+    """
+    Decides whether a GET response may be stored by the gateway, which acts as a shared cache (RFC 9111).
+    """
+    if status_code not in CACHEABLE_STATUS_CODES:
+        return False
+    request_directives = parse_cache_control(request_headers.get("cache-control"))
+    directives = parse_cache_control(_find_header(response_headers, b"cache-control"))
+    if "no-store" in request_directives or "no-store" in directives or "private" in directives:
+        return False
+    if "*" in (_find_header(response_headers, b"vary") or ""):
+        return False
+    # Responses to authenticated requests are only shared when the upstream explicitly allows it
+    if "authorization" in request_headers and not {"public", "s-maxage", "must-revalidate"} & directives.keys():
+        return False
+    return (freshness_lifetime(response_headers) > 0
+            or _find_header(response_headers, b"etag") is not None
+            or _find_header(response_headers, b"last-modified") is not None)
+
+
+def vary_names(response_headers: list[tuple[bytes, bytes]]) -> tuple[str, ...]:
+    """
+    Request header names the stored response varies on.
+    Content-encoded bodies always vary on Accept-Encoding, even if the upstream forgot to say so.
+    """
+    names = {name.strip().lower() for name in (_find_header(response_headers, b"vary") or "").split(",")}
+    if _find_header(response_headers, b"content-encoding") is not None:
+        names.add("accept-encoding")
+    names.discard("")
+    return tuple(sorted(names))
+
+
+class CachedResponse:
+    """
+    A stored upstream response: raw headers, raw body bytes and its freshness information.
+    Compressed variants of the body are added on first use and kept with the entry (see `encoded`).
+    """
+    __slots__ = ("status_code", "headers", "body", "vary", "size", "stored_at", "initial_age", "ttl",
+                 "stale_while_revalidate", "etag", "last_modified", "encodings", "cache")
+
+    def __init__(self, status_code: int, headers: list[tuple[bytes, bytes]], body: bytes, vary: tuple[str, ...]):
+        self.status_code = status_code
+        self.body = body
+        self.vary = vary
+        self.encodings: dict[str, bytes] = {}
+        # The ResponseCache holding this entry, whose size grows with the compressed variants
+        self.cache: Optional[ResponseCache] = None
+        self._set_headers(headers)
+
+    def _set_headers(self, headers: list[tuple[bytes, bytes]]):
+        self.headers = [(k, v) for k, v in headers if k.lower() not in (b"age", b"content-length")]
+        self.size = (len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+                     + sum(map(len, self.encodings.values())) + ENTRY_OVERHEAD)
+        self.stored_at = time.monotonic()
+        self.initial_age = _seconds(_find_header(headers, b"age")) or 0
+        self.ttl = freshness_lifetime(headers)
+        self.stale_while_revalidate = _seconds(
+            parse_cache_control(_find_header(headers, b"cache-control")).get("stale-while-revalidate")) or 0
+        self.etag = _find_header(headers, b"etag")
+        self.last_modified = _find_header(headers, b"last-modified")
+
+    @property
+    def age(self) -> float:
+        return self.initial_age + time.monotonic() - self.stored_at
+
+    def is_fresh(self) -> bool:
+        return self.age < self.ttl
+
+    def is_within_stale_while_revalidate(self) -> bool:
+        return self.age < self.ttl + self.stale_while_revalidate
+
+    @property
+    def has_validators(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def revalidated(self, headers: list[tuple[bytes, bytes]]):
+        """
+        Applies the headers of a 304 to the stored response and restarts its freshness clock.
+        """
+        updated = {k.lower() for k, _ in headers}
+        self._set_headers([(k, v) for k, v in self.headers if k.lower() not in updated] + headers)
+
+    def validators(self) -> list[tuple[bytes, bytes]]:
+        """
+        Conditional request headers used to revalidate this response upstream.
+        """
+        headers = []
+        if self.etag is not None:
+            headers.append((b"if-none-match", self.etag.encode("latin-1")))
+        if self.last_modified is not None:
+            headers.append((b"if-modified-since", self.last_modified.encode("latin-1")))
+        return headers
+
+    def matches_conditional(self, request_headers) -> bool:
+        """
+        True when the client already holds this representation and can be answered with a 304.
+        """
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            if self.etag is None:
+                return False
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag.removeprefix("W/") in tags
+        since = _http_date(request_headers.get("if-modified-since"))
+        modified = _http_date(self.last_modified)
+        return since is not None and modified is not None and modified <= since
+
+    def encoded(self, encoder: Encoder) -> bytes:
+        """
+        Returns the body compressed with `encoder`, compressing it only the first time.
+        """
+        body = self.encodings.get(encoder.name)
+        if body is None:
+            body = encoder.compress(self.body)
+            # A variant that would make the entry too large for the cache is compressed again on every use
+            if self.cache is None or self.size + len(body) <= self.cache.max_entry_bytes:
+                self.encodings[encoder.name] = body
+                self.size += len(body)
+                if self.cache is not None:
+                    self.cache.grown(len(body))
+        return body
+
+    def response_headers(self, not_modified: bool = False, age: bool = True) -> list[tuple[bytes, bytes]]:
+        if not_modified:
+            headers = [(k, v) for k, v in self.headers if k.lower() in NOT_MODIFIED_HEADERS]
+        else:
+            headers = self.headers + [(b"content-length", str(len(self.body)).encode("latin-1"))]
+        if age:
+            headers.append((b"age", str(int(self.age)).encode("latin-1")))
+        return headers
+
+
+class ResponseCache:
+    """
+    Byte-bounded LRU cache of upstream responses.
+
+    Entries are keyed on method, upstream URL, normalized query string and the values of the request headers
+    named in the response's Vary header. The least recently used entries are evicted once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        # (base key, variant) -> entry; the base key holds the request path as is, newlines and all
+        self._entries: OrderedDict[tuple[str, str], CachedResponse] = OrderedDict()
+        # base key -> (vary header names, keys of the stored variants)
+        self._variants: dict[str, tuple[tuple[str, ...], set[tuple[str, str]]]] = {}
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def base_key(method: str, url: str, query: str = "") -> str:
+        if query:
+            query = urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+        return f"{method} {url}?{query}"
+
+    @staticmethod
+    def _variant(vary: tuple[str, ...], request_headers) -> str:
+        """
+        The values of the request headers named in Vary, which tell the stored variants of a resource apart.
+        """
+        return "".join(f"\n{request_headers.get(name, '')}" for name in vary)
+
+    def get(self, base_key: str, request_headers) -> Optional[CachedResponse]:
+        variants = self._variants.get(base_key)
+        if variants is None:
+            return None
+        key = (base_key, self._variant(variants[0], request_headers))
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, base_key: str, request_headers, entry: CachedResponse):
+        if entry.size > self.max_entry_bytes:
+            return
+        variants = self._variants.get(base_key)
+        if variants is not None and variants[0] != entry.vary:
+            # The upstream changed its Vary header, older variants are unreachable now
+            self.invalidate(base_key)
+            variants = None
+        if variants is None:
+            variants = self._variants[base_key] = (entry.vary, set())
+
+        key = (base_key, self._variant(entry.vary, request_headers))
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= previous.size
+            previous.cache = None
+        variants[1].add(key)
+        self._entries[key] = entry
+        entry.cache = self
+        self.size += entry.size
+        self.stores += 1
+        self._shrink()
+
+    def grown(self, size: int):
+        """
+        Accounts for `size` bytes added to a stored entry, such as a compressed variant of its body.
+        """
+        self.size += size
+        self._shrink()
+
+    def revalidated(self, entry: CachedResponse, headers: list[tuple[bytes, bytes]]):
+        """
+        Refreshes a stored entry after the upstream answered a conditional request with 304.
+        """
+        size = entry.size
+        entry.revalidated(headers)
+        self.revalidations += 1
+        self.grown(entry.size - size)
+
+    def invalidate(self, base_key: str):
+        """
+        Drops every stored variant of a resource.
+        """
+        variants = self._variants.get(base_key)
+        if variants is None:
+            return
+        for key in list(variants[1]):
+            self._forget(key, self._entries.pop(key))
+
+    def clear(self):
+        for entry in self._entries.values():
+            entry.cache = None
+        self._entries.clear()
+        self._variants.clear()
+        self.size = 0
+
+    def _shrink(self):
+        """
+        Evicts the least recently used entries until the cache fits in `max_bytes`.
+        """
+        while self.size > self.max_bytes and self._entries:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._forget(evicted_key, evicted)
+            self.evictions += 1
+
+    def _forget(self, key: tuple[str, str], entry: CachedResponse):
+        self.size -= entry.size
+        entry.cache = None
+        base_key = key[0]
+        variants = self._variants[base_key]
+        variants[1].discard(key)
+        if not variants[1]:
+            del self._variants[base_key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+response_cache = ResponseCache(max_bytes=config.RESPONSE_CACHE_MAX_BYTES,
+                               max_entry_bytes=config.RESPONSE_CACHE_MAX_ENTRY_BYTES)
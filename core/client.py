@@ -0,0 +1,106 @@
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+
+from config.config import config
+from core.metrics import UPSTREAM_CONNECTIONS, registry
+
+
+def _origin(url: str) -> str:
+    """
+    Returns the scheme://host:port part of a URL, used to key connection pools per upstream.
+    """
+    return "/".join(url.split("/", 3)[:3])
+
+
+class UpstreamClientPool:
+    """
+    Gateway-owned pool of long-lived httpx clients, one per upstream origin.
+
+    Each upstream gets its own connection limits so a slow service cannot starve the others,
+    and connections are kept alive between proxied requests instead of being re-opened.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport = None):
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._loop = None
+        # Optional transport shared by all clients, e.g. an httpx.ASGITransport to run upstreams in-process
+        self.transport = transport
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = config.UPSTREAM_HTTP2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logging.warning("UPSTREAM_HTTP2 is enabled but the 'h2' package is not installed, using HTTP/1.1")
+            http2 = False
+
+        return httpx.AsyncClient(
+            transport=self.transport,
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=config.UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=config.UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=config.UPSTREAM_CONNECT_TIMEOUT,
+                read=config.UPSTREAM_READ_TIMEOUT,
+                write=config.UPSTREAM_WRITE_TIMEOUT,
+                pool=config.UPSTREAM_POOL_TIMEOUT,
+            ),
+        )
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        """
+        Returns the shared client for the upstream that serves the given URL.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Pooled connections are bound to the loop that opened them. In production there is a
+            # single loop per worker; this only triggers when the app is driven from several loops (tests).
+            self._clients = {}
+            self._loop = loop
+
+        origin = _origin(url)
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            client = self._clients[origin] = self._build_client()
+        return client
+
+    async def start(self, urls: list[str]):
+        """
+        Creates the clients for the known upstreams up front.
+        """
+        for url in urls:
+            self.get(url)
+
+    async def close(self):
+        """
+        Closes every pooled client and its open connections.
+        """
+        clients, self._clients = list(self._clients.values()), {}
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    def connections(self) -> dict[str, dict[str, int]]:
+        """
+        Returns the number of active and idle pooled connections per upstream origin.
+        """
+        usage = {}
+        for origin, client in self._clients.items():
+            # httpx does not expose its pool; a custom transport (e.g. ASGITransport) has none
+            pool = getattr(getattr(client, "_transport", None), "_pool", None)
+            connections = getattr(pool, "connections", [])
+            idle = sum(1 for connection in connections if connection.is_idle())
+            usage[origin] = {"active": len(connections) - idle, "idle": idle}
+        return usage
+
+
+upstream_clients = UpstreamClientPool()
+
+
+@registry.collector
+def _collect_connections():
+    for origin, usage in upstream_clients.connections().items():
+        for state, count in usage.items():
+            UPSTREAM_CONNECTIONS.set((origin, state), count)
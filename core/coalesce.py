@@ -0,0 +1,45 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into a single in-flight call.
+
+    The first caller starts the call as its own task and every caller, including the first, awaits it.
+    A caller that is cancelled (e.g. the client disconnected) does not cancel the shared call for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.calls += 1
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller has gone away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "calls": self.calls, "coalesced": self.coalesced}
+
+
+upstream_flights = SingleFlight()
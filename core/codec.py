@@ -0,0 +1,114 @@
+import json
+import logging
+import math
+from typing import Any, Callable, Union
+
+from starlette.responses import JSONResponse
+
+from config.config import config
+
+
+def _finite(obj: Any) -> Any:
+    """
+    Copy of `obj` with NaN and infinities replaced by None.
+    """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    return obj
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    # Same output as Starlette's JSONResponse, except for non-finite floats
+    try:
+        return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        # JSON has no NaN or infinities; they are written as null, as msgspec and orjson do
+        return json.dumps(_finite(obj), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def _finite_float(value: str) -> float:
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{value} is out of range")
+    return number
+
+
+def _stdlib_loads(data: Union[bytes, str]) -> Any:
+    # Strict like msgspec and orjson: no NaN or Infinity literals, no numbers that overflow a float
+    return json.loads(data, parse_constant=_reject_constant, parse_float=_finite_float)
+
+
+def _backends() -> dict[str, tuple[Callable[[Any], bytes], Callable[[Union[bytes, str]], Any]]]:
+    backends = {}
+    try:
+        import msgspec
+        backends["msgspec"] = (msgspec.json.Encoder().encode, msgspec.json.Decoder().decode)
+    except ImportError:
+        pass
+    try:
+        import orjson
+        backends["orjson"] = (orjson.dumps, orjson.loads)
+    except ImportError:
+        pass
+    backends["json"] = (_stdlib_dumps, _stdlib_loads)
+    return backends
+
+
+# Installed backends in order of preference. msgspec comes first because orjson turns integers wider than
+# 64 bits into floats, and IDs in proxied bodies must survive unchanged.
+BACKENDS = _backends()
+
+
+class JSONCodec:
+    """
+    The JSON encoder and decoder used throughout the gateway, backed by msgspec or orjson when installed
+    (`JSON_CODEC=auto`) and by the standard library otherwise.
+
+    Values the fast backend cannot encode (e.g. dicts with non-string keys) are handed to the standard library.
+    Every backend writes NaN and infinities as null and rejects them when decoding, so results never depend on
+    the backend, only the speed does.
+    """
+
+    def __init__(self, backend: str = "auto"):
+        if backend == "auto":
+            backend = next(iter(BACKENDS))
+        elif backend not in BACKENDS:
+            logging.warning(f"JSON_CODEC {backend!r} is not installed, using {next(iter(BACKENDS))}")
+            backend = next(iter(BACKENDS))
+        self.name = backend
+        self._dumps, self._loads = BACKENDS[backend]
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        Encodes `obj` as compact UTF-8 JSON.
+        """
+        try:
+            return self._dumps(obj)
+        except TypeError:
+            return _stdlib_dumps(obj)
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """
+        Decodes a JSON document; raises ValueError when it is not valid JSON.
+        """
+        return self._loads(data)
+
+
+json_codec = JSONCodec(config.JSON_CODEC)
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with the gateway's JSON codec.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return json_codec.dumps(content)
@@ -0,0 +1,216 @@
+import asyncio
+import re
+from typing import Any, Callable, Optional
+from urllib.parse import quote
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel
+
+from core.balancer import EndpointPool
+from core.resilience import Deadline, request_timeout
+from core.utils import forward_request, proxy_headers
+
+_PLACEHOLDER = re.compile(r"\{([^{}]+)\}")
+
+# Request headers that describe the client's body, which is not sent to the calls
+_BODY_HEADERS = frozenset({b"content-length", b"content-type"})
+
+
+class CompositeCallConfig(BaseModel):
+    """
+    One upstream call of a composite route. `path` may contain placeholders: {path} is the request path after the
+    route's rewrite, {query.NAME} a query parameter of the request and {CALL.FIELD} a field of the JSON response
+    of a call listed in `depends_on` (dotted paths and list indexes, e.g. {user.teams.0.id}).
+    """
+    name: str
+    upstream: str
+    path: str = "{path}"
+    method: str = "GET"
+    # Seconds for this call, retries included; the route timeout applies when unset
+    timeout: Optional[float] = None
+    # Calls whose responses this call needs; they must be declared before it
+    depends_on: list[str] = []
+    # A failing required call fails the whole request; a failing optional call leaves null in its place and an
+    # entry in the response's "errors" object
+    required: bool = True
+
+
+class CompositeConfig(BaseModel):
+    """
+    Upstream calls run concurrently for one request, as soon as their dependencies are done, and merged into one
+    JSON response: keyed by call name ("keyed"), or the JSON objects merged in declaration order ("flat").
+    """
+    calls: list[CompositeCallConfig]
+    merge: str = "keyed"
+
+
+def compile_template(template: str, dependencies: list[str]) -> Callable[[dict], str]:
+    """
+    Compiles a call path template into a function of the request values and the dependencies' results.
+    Raises ValueError for placeholders that can never be filled.
+    """
+    parts: list = []
+    position = 0
+    for placeholder in _PLACEHOLDER.finditer(template):
+        parts.append(template[position:placeholder.start()])
+        root, *keys = placeholder.group(1).split(".")
+        if root == "path" and keys or root == "query" and len(keys) != 1:
+            raise ValueError(f"Invalid placeholder {placeholder.group(0)} in {template!r}")
+        if root not in ("path", "query") and root not in dependencies:
+            raise ValueError(f"Placeholder {placeholder.group(0)} in {template!r} does not name a dependency")
+        parts.append((placeholder.group(0), root, keys))
+        position = placeholder.end()
+    parts.append(template[position:])
+    parts = [part for part in parts if part != ""]
+
+    def render(values: dict) -> str:
+        rendered = []
+        for part in parts:
+            if isinstance(part, str):
+                rendered.append(part)
+                continue
+            placeholder, root, keys = part
+            value = values[root]
+            if root == "path":
+                rendered.append(value)
+                continue
+            try:
+                for key in keys:
+                    value = value[int(key)] if isinstance(value, list) else value[key]
+            except (KeyError, IndexError, ValueError, TypeError):
+                status = 400 if root == "query" else 502
+                raise HTTPException(status_code=status, detail=f"No value for {placeholder}")
+            rendered.append(quote(value if isinstance(value, str) else str(value), safe=""))
+        return "".join(rendered)
+
+    return render
+
+
+class CompositeCall:
+    __slots__ = ("name", "pool", "method", "timeout", "depends_on", "required", "path")
+
+    def __init__(self, call: CompositeCallConfig, pool: EndpointPool):
+        self.name = call.name
+        self.pool = pool
+        self.method = call.method.upper()
+        self.timeout = call.timeout
+        self.depends_on = call.depends_on
+        self.required = call.required
+        self.path = compile_template(call.path, call.depends_on)
+
+
+class _Failed:
+    """
+    Result of an optional call that failed.
+    """
+
+
+_FAILED = _Failed()
+
+
+class Composite:
+    """
+    The calls of a composite route, compiled once when the route table is built.
+
+    Every call starts as soon as the calls it depends on are done, so independent calls run concurrently and the
+    request takes as long as the slowest chain of calls rather than all of them. Calls go through the same
+    balancer, retries, circuit breakers and deadline as proxied requests.
+    """
+
+    __slots__ = ("route", "calls", "merge")
+
+    def __init__(self, route: str, composite: CompositeConfig, pools: dict[str, EndpointPool]):
+        if composite.merge not in ("keyed", "flat"):
+            raise ValueError(f"Route {route!r}: unknown merge {composite.merge!r}")
+        if not composite.calls:
+            raise ValueError(f"Route {route!r} declares no calls")
+        self.route = route
+        self.calls: list[CompositeCall] = []
+        declared = set()
+        for call in composite.calls:
+            if call.name in declared or call.name in ("path", "query", "errors"):
+                raise ValueError(f"Route {route!r}: call name {call.name!r} is taken")
+            if call.upstream not in pools:
+                raise ValueError(f"Route {route!r}: call {call.name!r} references unknown upstream {call.upstream!r}")
+            for dependency in call.depends_on:
+                if dependency not in declared:
+                    raise ValueError(f"Route {route!r}: call {call.name!r} depends on {dependency!r}, "
+                                     f"which is not declared before it")
+            declared.add(call.name)
+            self.calls.append(CompositeCall(call, pools[call.upstream]))
+        self.merge = composite.merge
+
+    def healthy(self, healthy: Callable[[str], bool]) -> bool:
+        return all(any(healthy(endpoint.url) for endpoint in call.pool.endpoints)
+                   for call in self.calls if call.required)
+
+    async def execute(self, request: Request, path: str, timeout: Optional[float],
+                      healthy: Callable[[str], bool] = None, priority: Optional[int] = None) -> Any:
+        """
+        Runs the calls for a request and returns the merged JSON response. The first required call to fail
+        cancels the others and its error becomes the response. `priority` is the request's priority class for
+        the upstreams' concurrency limits.
+        """
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in proxy_headers(request.headers.raw)
+                   if k.lower() not in _BODY_HEADERS}
+        values = {"path": path, "query": request.query_params}
+        deadline = Deadline(request_timeout(request.headers, timeout))
+        errors = {}
+        tasks: dict[str, asyncio.Task] = {}
+        for call in self.calls:
+            tasks[call.name] = asyncio.ensure_future(
+                self._run(call, tasks, values, headers, request.headers, deadline, errors, healthy, priority))
+        try:
+            done, _ = await asyncio.wait(tasks.values(), return_when=asyncio.FIRST_EXCEPTION)
+            failed = [task.exception() for task in done if task.exception() is not None]
+            if failed:
+                raise failed[0]
+        finally:
+            for task in tasks.values():
+                task.cancel()
+            # Cancelled calls release their endpoints before the response goes out
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        results = {name: None if task.result() is _FAILED else task.result() for name, task in tasks.items()}
+        if self.merge == "flat":
+            merged = {}
+            for name, result in results.items():
+                if isinstance(result, dict):
+                    merged.update(result)
+                elif result is not None:
+                    merged[name] = result
+        else:
+            merged = results
+        if errors:
+            merged["errors"] = errors
+        return merged
+
+    async def _run(self, call: CompositeCall, tasks: dict, values: dict, headers: dict, request_headers,
+                   deadline: Deadline, errors: dict, healthy: Optional[Callable[[str], bool]],
+                   priority: Optional[int]) -> Any:
+        try:
+            call_values = values
+            if call.depends_on:
+                call_values = dict(values)
+                for dependency in call.depends_on:
+                    result = await tasks[dependency]
+                    if result is _FAILED:
+                        raise HTTPException(status_code=424, detail=f"Depends on failed call {dependency!r}")
+                    call_values[dependency] = result
+            call_timeout = deadline.remaining()
+            if call.timeout is not None:
+                call_timeout = call.timeout if call_timeout is None else min(call.timeout, call_timeout)
+            url = call.pool.base_url + call.path(call_values)
+            endpoint = call.pool.pick(call.pool.hash_key(request_headers), healthy)
+            try:
+                data, _ = await forward_request(url=endpoint.rebase(url), method=call.method, headers=headers,
+                                                timeout=call_timeout, route=f"{self.route}/{call.name}",
+                                                endpoint=endpoint, priority=priority)
+            except ValueError:
+                raise HTTPException(status_code=502, detail=f"Call {call.name!r} did not return JSON")
+            return data
+        except HTTPException as e:
+            if call.required:
+                raise
+            errors[call.name] = {"status": e.status_code, "detail": e.detail}
+            return _FAILED
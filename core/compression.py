@@ -0,0 +1,166 @@
+import zlib
+from functools import lru_cache
+from typing import Callable, Optional
+
+from config.config import config
+
+RawHeaders = list[tuple[bytes, bytes]]
+
+# Content types worth compressing (matched anywhere in the Content-Type value)
+COMPRESSIBLE_TYPES = (b"text/", b"json", b"xml", b"javascript", b"application/x-www-form-urlencoded",
+                      b"image/svg")
+
+
+class Encoder:
+    """
+    One content coding: one-shot compression for buffered bodies and a factory of streaming compressors.
+    A streaming compressor is called with every chunk and `last=True` for the final one; every call returns
+    everything compressed so far, so a streamed response is never held back waiting for more data.
+    """
+
+    __slots__ = ("name", "compress", "stream")
+
+    def __init__(self, name: str, compress: Callable[[bytes], bytes],
+                 stream: Callable[[], Callable[[bytes, bool], bytes]]):
+        self.name = name
+        self.compress = compress
+        self.stream = stream
+
+
+def _gzip() -> Encoder:
+    level = config.COMPRESSION_GZIP_LEVEL
+
+    def stream():
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+        def chunk(data: bytes, last: bool) -> bytes:
+            return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+        return chunk
+
+    # wbits=31 writes the gzip container
+    return Encoder("gzip", lambda data: zlib.compress(data, level, 31), stream)
+
+
+def _brotli() -> Optional[Encoder]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    quality = config.COMPRESSION_BROTLI_QUALITY
+
+    def stream():
+        compressor = brotli.Compressor(quality=quality)
+
+        def chunk(data: bytes, last: bool) -> bytes:
+            return compressor.process(data) + (compressor.finish() if last else compressor.flush())
+
+        return chunk
+
+    return Encoder("br", lambda data: brotli.compress(data, quality=quality), stream)
+
+
+def _zstd() -> Optional[Encoder]:
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    level = config.COMPRESSION_ZSTD_LEVEL
+    compressor = zstandard.ZstdCompressor(level=level)
+
+    def stream():
+        compressobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+        def chunk(data: bytes, last: bool) -> bytes:
+            return compressobj.compress(data) + compressobj.flush(
+                zstandard.COMPRESSOBJ_FLUSH_FINISH if last else zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+        return chunk
+
+    return Encoder("zstd", compressor.compress, stream)
+
+
+def _encoders() -> dict[str, Encoder]:
+    available = {encoder.name: encoder for encoder in (_zstd(), _brotli(), _gzip()) if encoder is not None}
+    preferred = [name.strip().lower() for name in config.COMPRESSION_ENCODINGS.split(",") if name.strip()]
+    return {name: available[name] for name in preferred if name in available}
+
+
+# Installed encoders from COMPRESSION_ENCODINGS, in the gateway's order of preference
+ENCODERS = _encoders()
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding: Optional[str]) -> Optional[Encoder]:
+    """
+    Chooses the encoder for an Accept-Encoding header: the highest q-value wins, ties go to the gateway's
+    preference. Clients send a handful of distinct values, so the result is memoized.
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, *params = part.split(";")
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[name.strip()] = weight
+    best = None
+    best_weight = 0.0
+    for name, encoder in ENCODERS.items():
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoder, weight
+    return best
+
+
+def _header(headers: RawHeaders, name: bytes) -> Optional[bytes]:
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+def is_compressible(headers: RawHeaders) -> bool:
+    """
+    Whether a response with these headers may be compressed by the gateway.
+    """
+    content_type = _header(headers, b"content-type")
+    if content_type is None or _header(headers, b"content-encoding") is not None:
+        return False
+    # The byte offsets of a range refer to the uncompressed body
+    if _header(headers, b"content-range") is not None:
+        return False
+    if b"no-transform" in (_header(headers, b"cache-control") or b"").lower():
+        return False
+    content_type = content_type.lower()
+    return any(kind in content_type for kind in COMPRESSIBLE_TYPES)
+
+
+def encoded_headers(headers: RawHeaders, encoding: str, length: Optional[int]) -> RawHeaders:
+    """
+    Adjusts response headers for a body compressed with `encoding`: sets Content-Encoding and the new
+    Content-Length (dropped when unknown), adds Accept-Encoding to Vary and weakens a strong ETag,
+    since the compressed bytes differ from the upstream's representation.
+    """
+    result = []
+    vary = False
+    for name, value in headers:
+        lowered = name.lower()
+        if lowered == b"content-length":
+            continue
+        if lowered == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        elif lowered == b"vary":
+            vary = True
+            if b"accept-encoding" not in value.lower() and value.strip() != b"*":
+                value += b", Accept-Encoding"
+        result.append((name, value))
+    if not vary:
+        result.append((b"vary", b"Accept-Encoding"))
+    result.append((b"content-encoding", encoding.encode("latin-1")))
+    if length is not None:
+        result.append((b"content-length", str(length).encode("latin-1")))
+    return result
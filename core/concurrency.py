@@ -0,0 +1,203 @@
+import asyncio
+import functools
+import heapq
+import itertools
+import math
+from typing import Optional
+
+from config.config import config
+from core.client import _origin
+from core.metrics import CONCURRENCY_LIMIT, UPSTREAM_INFLIGHT, UPSTREAM_QUEUED, UPSTREAM_SHED, registry
+from core.resilience import DeadlineExceeded
+
+# Requests per sample the short-term and long-term latency averages follow
+SHORT_WINDOW = 10
+LONG_WINDOW = 500
+# Weight of a new limit against the current one
+SMOOTHING = 0.2
+# Limit kept after a call that failed or timed out
+BACKOFF_RATIO = 0.9
+
+
+class LoadShedError(Exception):
+    """
+    Raised instead of calling an upstream that is at its concurrency limit when the call cannot wait for a slot.
+    """
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive concurrency limit for a single upstream, with a bounded queue of the calls waiting for a slot.
+
+    The limit follows the upstream's latency (the gradient algorithm of Netflix's concurrency-limits): while the
+    short-term average latency stays within `tolerance` times the long-term average the limit grows by about the
+    square root of itself, and as latency rises above that it shrinks in proportion, down to half per sample.
+    Failed calls cut it by a tenth. The limit only grows while at least half of it is used.
+
+    Waiting calls are let through by priority (lower values first), then in arrival order. When the queue is
+    full a call is shed right away, unless a queued call of lower priority can be shed in its place.
+    """
+
+    def __init__(self, name: str, initial: int, min_limit: int, max_limit: int, tolerance: float,
+                 queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.short_rtt: Optional[float] = None
+        self.long_rtt: Optional[float] = None
+        # Heap of (priority, arrival, future)
+        self._waiters: list = []
+        self._arrivals = itertools.count()
+
+    @property
+    def capacity(self) -> int:
+        return int(self.limit)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, priority: int, timeout: Optional[float] = None):
+        """
+        Takes a slot, waiting at most `queue_timeout` seconds (or `timeout`, the time left until the request
+        deadline, when it is shorter) for one. Raises LoadShedError when the call is shed and DeadlineExceeded
+        when the deadline expired first.
+        """
+        if self.inflight < self.capacity and not self._waiters:
+            self.inflight += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            victim = max(self._waiters) if self._waiters else None
+            if victim is None or victim[0] <= priority:
+                UPSTREAM_SHED.inc((self.name, "queue_full"))
+                raise LoadShedError(self.name)
+            self._waiters.remove(victim)
+            heapq.heapify(self._waiters)
+            victim[2].set_exception(LoadShedError(self.name))
+            UPSTREAM_SHED.inc((self.name, "preempted"))
+
+        waiter = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        wait = self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[2]), wait)
+        except asyncio.TimeoutError:
+            self._forget(waiter)
+            if timeout is not None and timeout <= self.queue_timeout:
+                raise DeadlineExceeded(self.name)
+            UPSTREAM_SHED.inc((self.name, "queue_timeout"))
+            raise LoadShedError(self.name)
+        except asyncio.CancelledError:
+            self._forget(waiter)
+            raise
+
+    def _forget(self, waiter: tuple):
+        """
+        Removes a waiter that gave up, handing its slot back if it had been granted one in the meantime.
+        """
+        future = waiter[2]
+        if not future.done():
+            future.cancel()
+            self._waiters.remove(waiter)
+            heapq.heapify(self._waiters)
+        elif not future.cancelled() and future.exception() is None:
+            self.release()
+
+    def release(self, rtt: Optional[float] = None, dropped: bool = False):
+        """
+        Gives a slot back. `rtt` is the latency of the call, if it completed, and `dropped` whether it failed
+        in a way that suggests the upstream is overloaded.
+        """
+        if dropped:
+            self.limit = max(self.min_limit, self.limit * BACKOFF_RATIO)
+        elif rtt is not None:
+            self._update(rtt)
+        self.inflight -= 1
+        while self._waiters and self.inflight < self.capacity:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.inflight += 1
+                future.set_result(None)
+
+    def _update(self, rtt: float):
+        if self.long_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+            return
+        self.short_rtt += (rtt - self.short_rtt) / SHORT_WINDOW
+        self.long_rtt += (rtt - self.long_rtt) / LONG_WINDOW
+        # Once an overload is over, let the long-term average come down rather than wait for it to decay
+        if self.long_rtt > 2 * self.short_rtt:
+            self.long_rtt *= 0.95
+        if self.inflight < self.limit / 2:
+            return
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = min(self.max_limit, max(self.min_limit, self.limit * (1 - SMOOTHING) + limit * SMOOTHING))
+
+
+class ConcurrencyLimiterRegistry:
+    """
+    One adaptive limiter per upstream origin, and the priority classes requests are mapped to.
+    """
+
+    def __init__(self):
+        self._limiters: dict[str, AdaptiveLimiter] = {}
+
+    def get(self, url: str) -> AdaptiveLimiter:
+        origin = _origin(url)
+        limiter = self._limiters.get(origin)
+        if limiter is None:
+            limiter = self._limiters[origin] = AdaptiveLimiter(
+                origin,
+                initial=config.CONCURRENCY_LIMIT_INITIAL,
+                min_limit=config.CONCURRENCY_LIMIT_MIN,
+                max_limit=config.CONCURRENCY_LIMIT_MAX,
+                tolerance=config.CONCURRENCY_LIMIT_TOLERANCE,
+                queue_size=config.CONCURRENCY_QUEUE_SIZE,
+                queue_timeout=config.CONCURRENCY_QUEUE_TIMEOUT,
+            )
+        return limiter
+
+    def clear(self):
+        self._limiters.clear()
+
+    @staticmethod
+    def priority(claims: dict) -> int:
+        """
+        The priority of a request from the CONCURRENCY_PRIORITY_CLAIM claim of its token, 0 being the highest.
+        Requests without a known class get CONCURRENCY_PRIORITY_DEFAULT.
+        """
+        classes = _priority_classes(config.CONCURRENCY_PRIORITY_CLASSES)
+        value = claims.get(config.CONCURRENCY_PRIORITY_CLAIM)
+        # Claims may hold any JSON value; lists and objects name no class
+        rank = classes.get(str(value)) if isinstance(value, (str, int)) else None
+        if rank is None:
+            rank = classes.get(config.CONCURRENCY_PRIORITY_DEFAULT, len(classes))
+        return rank
+
+    def stats(self) -> dict[str, tuple[int, int, int]]:
+        return {name: (limiter.capacity, limiter.inflight, limiter.queued) for name, limiter in self._limiters.items()}
+
+
+@functools.lru_cache(maxsize=4)
+def _priority_classes(setting: str) -> dict[str, int]:
+    """
+    Ranks of the comma-separated priority classes, highest priority first.
+    """
+    return {name.strip(): rank for rank, name in enumerate(n for n in setting.split(",") if n.strip())}
+
+
+concurrency_limits = ConcurrencyLimiterRegistry()
+
+
+@registry.collector
+def _collect_limits():
+    for name, (limit, inflight, queued) in concurrency_limits.stats().items():
+        CONCURRENCY_LIMIT.set((name,), limit)
+        UPSTREAM_INFLIGHT.set((name,), inflight)
+        UPSTREAM_QUEUED.set((name,), queued)
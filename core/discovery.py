@@ -0,0 +1,183 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+from contextlib import suppress
+from typing import Callable, Optional
+
+import httpx
+
+from config.config import config
+
+# (url, weight) pairs of a service's endpoints
+Endpoints = list[tuple[str, int]]
+
+
+class _Discovery(abc.ABC):
+    """
+    Base for the providers: runs in the background and reports the endpoints of the watched services
+    through `on_change(service, endpoints)` whenever they change. Empty results are ignored, so a service
+    that disappears keeps its last known (or configured) endpoints.
+    """
+
+    def __init__(self):
+        self._services: Optional[Callable[[], set[str]]] = None
+        self._on_change: Optional[Callable[[str, Endpoints], None]] = None
+        self._known: dict[str, Endpoints] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, services: Callable[[], set[str]], on_change: Callable[[str, Endpoints], None]):
+        """
+        Starts watching the services returned by `services()`, which is called again periodically
+        so services of reloaded routes are picked up.
+        """
+        self._services = services
+        self._on_change = on_change
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    @abc.abstractmethod
+    async def _run(self):
+        """
+        Watches the services until cancelled, reporting their endpoints with `_apply`.
+        """
+
+    def _apply(self, service: str, endpoints: Endpoints):
+        if endpoints and endpoints != self._known.get(service):
+            self._known[service] = endpoints
+            logging.info(f"Discovered {len(endpoints)} endpoints for {service}: "
+                         f"{', '.join(url for url, _ in endpoints)}")
+            self._on_change(service, endpoints)
+
+
+class ConsulDiscovery(_Discovery):
+    """
+    Watches the passing instances of every service with Consul blocking queries: each request is held by Consul
+    until the service changes or `wait` seconds pass, so changes arrive within moments without polling.
+    One watch runs per service, and each one only updates its own service.
+    """
+
+    def __init__(self, url: str, wait: float, token: str = "", transport: httpx.AsyncBaseTransport = None):
+        super().__init__()
+        self.url = url.rstrip("/")
+        self.wait = wait
+        self.token = token
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._watches: dict[str, asyncio.Task] = {}
+
+    async def start(self, services: Callable[[], set[str]], on_change: Callable[[str, Endpoints], None]):
+        self._client = httpx.AsyncClient(
+            base_url=self.url,
+            headers={"X-Consul-Token": self.token} if self.token else None,
+            # Blocking queries are answered after up to `wait` seconds (plus Consul's jitter of wait / 16)
+            timeout=httpx.Timeout(config.DISCOVERY_TIMEOUT, read=self.wait * 1.1 + config.DISCOVERY_TIMEOUT),
+            transport=self._transport,
+        )
+        await super().start(services, on_change)
+
+    async def stop(self):
+        await super().stop()
+        for watch in self._watches.values():
+            watch.cancel()
+        await asyncio.gather(*self._watches.values(), return_exceptions=True)
+        self._watches = {}
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def _run(self):
+        while True:
+            services = self._services()
+            for service in self._watches.keys() - services:
+                self._watches.pop(service).cancel()
+            for service in services - self._watches.keys():
+                self._watches[service] = asyncio.create_task(self._watch(service))
+            await asyncio.sleep(config.DISCOVERY_INTERVAL)
+
+    async def _watch(self, service: str):
+        index = 0
+        backoff = 1.0
+        while True:
+            try:
+                new_index, endpoints = await self.fetch(service, index)
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                logging.warning(f"Consul discovery of {service} failed, retrying in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, config.DISCOVERY_INTERVAL)
+                continue
+            backoff = 1.0
+            # The index only moves forward; when it goes back (e.g. Consul was restarted) the watch starts over
+            index = new_index if new_index > index else 0
+            self._apply(service, endpoints)
+
+    async def fetch(self, service: str, index: int = 0) -> tuple[int, Endpoints]:
+        """
+        Returns Consul's index and the passing instances of a service, waiting for a change past `index`.
+        """
+        params = {"passing": "true"}
+        if index:
+            params.update(index=str(index), wait=f"{self.wait:.0f}s")
+        response = await self._client.get(f"/v1/health/service/{service}", params=params)
+        response.raise_for_status()
+        endpoints = []
+        for instance in response.json():
+            address = instance["Service"]["Address"] or instance["Node"]["Address"]
+            scheme = (instance["Service"].get("Meta") or {}).get("scheme", "http")
+            weight = (instance["Service"].get("Weights") or {}).get("Passing", 1)
+            endpoints.append((f"{scheme}://{address}:{instance['Service']['Port']}", weight))
+        return int(response.headers.get("X-Consul-Index", 0)), sorted(endpoints)
+
+
+class FileDiscovery(_Discovery):
+    """
+    Reads the endpoints of every service from a JSON file, polled for changes every `interval` seconds:
+    {"service-a": ["http://localhost:8001", {"url": "http://localhost:8011", "weight": 2}]}
+    Stands in for Consul in tests and local setups.
+    """
+
+    def __init__(self, path: str, interval: float):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self._mtime: Optional[float] = None
+
+    async def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to read service discovery file {self.path}: {e}")
+            await asyncio.sleep(self.interval)
+
+    def refresh(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            services = json.load(f)
+        self._mtime = mtime
+        for service in self._services():
+            endpoints = [(endpoint, 1) if isinstance(endpoint, str) else (endpoint["url"], endpoint.get("weight", 1))
+                         for endpoint in services.get(service, [])]
+            self._apply(service, endpoints)
+
+
+def _provider() -> Optional[_Discovery]:
+    if config.DISCOVERY_PROVIDER == "consul":
+        return ConsulDiscovery(config.CONSUL_URL, wait=config.DISCOVERY_WAIT, token=config.CONSUL_TOKEN)
+    if config.DISCOVERY_PROVIDER == "file":
+        return FileDiscovery(config.DISCOVERY_FILE, interval=config.DISCOVERY_INTERVAL)
+    if config.DISCOVERY_PROVIDER:
+        raise ValueError(f"Unknown DISCOVERY_PROVIDER {config.DISCOVERY_PROVIDER!r}")
+    return None
+
+
+discovery = _provider()
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Callable, Optional
+
+from config.config import config
+from core.metrics import UPSTREAM_HEALTHY, registry
+from core.routing import router
+from core.utils import check_service_health
+
+
+class UpstreamHealth:
+    """
+    Latest health check results of one upstream.
+    """
+
+    __slots__ = ("url", "healthy", "successes", "failures", "checked_at", "latency")
+
+    def __init__(self, url: str):
+        self.url = url
+        # None until the first check has finished
+        self.healthy: Optional[bool] = None
+        self.successes = 0
+        self.failures = 0
+        self.checked_at: Optional[float] = None
+        self.latency: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {"url": self.url, "healthy": self.healthy, "checked_at": self.checked_at, "latency": self.latency}
+
+
+class HealthMonitor:
+    """
+    Probes every upstream's health endpoint in the background, all at once, every `interval` seconds.
+
+    An upstream is marked unhealthy after `unhealthy_threshold` failed checks in a row and healthy again after
+    `healthy_threshold` successful ones, so a single slow probe does not flap it. Lookups only read the latest
+    results, so neither `/health` nor routing ever wait for an upstream.
+    """
+
+    def __init__(self, targets: Callable[[], dict[str, str]], interval: float, unhealthy_threshold: int,
+                 healthy_threshold: int):
+        # Returns the endpoints to check (endpoint URL -> health check URL); called before every round,
+        # so reloaded routes are picked up
+        self.targets = targets
+        self.interval = interval
+        self.unhealthy_threshold = unhealthy_threshold
+        self.healthy_threshold = healthy_threshold
+        self.upstreams: dict[str, UpstreamHealth] = {}
+        self._checker: Optional[asyncio.Task] = None
+        self._round: Optional[asyncio.Task] = None
+
+    def is_healthy(self, upstream: str) -> bool:
+        """
+        Returns False only for upstreams whose checks have failed; unknown upstreams count as healthy.
+        """
+        state = self.upstreams.get(upstream)
+        return state is None or state.healthy is not False
+
+    async def start(self):
+        self._checker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._checker, self._round):
+            if task:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self._checker = self._round = None
+
+    async def _run(self):
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.interval)
+
+    async def check_all(self):
+        """
+        Runs one round of checks. Concurrent callers share the round that is already running.
+        """
+        if self._round is None or self._round.done():
+            self._round = asyncio.create_task(self._check_all(self.targets()))
+        await asyncio.shield(self._round)
+
+    async def _check_all(self, targets: dict[str, str]):
+        for name in self.upstreams.keys() - targets.keys():
+            del self.upstreams[name]
+        await asyncio.gather(*(self._check(name, url) for name, url in targets.items()))
+
+    async def _check(self, name: str, url: str):
+        state = self.upstreams.get(name)
+        if state is None or state.url != url:
+            state = self.upstreams[name] = UpstreamHealth(url)
+
+        start = time.perf_counter()
+        try:
+            ok = await asyncio.wait_for(check_service_health(url), config.HEALTH_CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            ok = False
+        state.latency = time.perf_counter() - start
+        state.checked_at = time.time()
+
+        previous = state.healthy
+        if ok:
+            state.successes, state.failures = state.successes + 1, 0
+            if previous is None or state.successes >= self.healthy_threshold:
+                state.healthy = True
+        else:
+            state.successes, state.failures = 0, state.failures + 1
+            if previous is None or state.failures >= self.unhealthy_threshold:
+                state.healthy = False
+        if state.healthy != previous:
+            logging.log(logging.INFO if state.healthy else logging.WARNING,
+                        f"Upstream endpoint {name} is {'healthy' if state.healthy else 'unhealthy'} ({url})")
+
+    async def snapshot(self) -> dict[str, dict]:
+        """
+        Returns the latest results, running the first round of checks if none has finished yet.
+        """
+        if not self.upstreams or any(state.healthy is None for state in self.upstreams.values()):
+            await self.check_all()
+        return {name: state.as_dict() for name, state in self.upstreams.items()}
+
+
+health_monitor = HealthMonitor(
+    router.health_targets,
+    interval=config.HEALTH_CHECK_INTERVAL,
+    unhealthy_threshold=config.HEALTH_CHECK_UNHEALTHY_THRESHOLD,
+    healthy_threshold=config.HEALTH_CHECK_HEALTHY_THRESHOLD,
+)
+
+
+@registry.collector
+def _collect_health():
+    for name, state in health_monitor.upstreams.items():
+        if state.healthy is not None:
+            UPSTREAM_HEALTHY.set((name,), int(state.healthy))
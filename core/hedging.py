@@ -0,0 +1,162 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from config.config import config
+from core.balancer import Endpoint
+from core.metrics import HEDGED_REQUESTS
+from core.resilience import RetryBudget
+
+T = TypeVar("T")
+
+# Latencies a route needs before its percentile is trusted as the hedge delay
+MIN_SAMPLES = 50
+
+
+class HedgeConfig(BaseModel):
+    """
+    Hedged GETs for a route: when the upstream has not answered after `delay` seconds, the request is sent
+    again to another endpoint and the first answer wins. Without `delay`, the route's recent upstream latency
+    at `percentile` is used, once enough calls were seen.
+    """
+    delay: Optional[float] = None
+    percentile: float = 0.95
+
+
+class LatencyWindow:
+    """
+    The upstream latencies of a route's last `size` calls. Percentiles are recomputed after every tenth of the
+    window was replaced, so recording a latency stays a list assignment.
+    """
+
+    __slots__ = ("size", "samples", "position", "count", "_fresh", "_percentiles")
+
+    def __init__(self, size: int):
+        self.size = size
+        self.samples: list[float] = []
+        self.position = 0
+        self.count = 0
+        self._fresh = 0
+        self._percentiles: dict[float, float] = {}
+
+    def record(self, latency: float):
+        if len(self.samples) < self.size:
+            self.samples.append(latency)
+        else:
+            self.samples[self.position] = latency
+            self.position = (self.position + 1) % self.size
+        self.count += 1
+        self._fresh += 1
+        if self._fresh * 10 >= self.size:
+            self._fresh = 0
+            self._percentiles.clear()
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        value = self._percentiles.get(fraction)
+        if value is None:
+            ordered = sorted(self.samples)
+            value = self._percentiles[fraction] = ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+        return value
+
+
+class Hedging:
+    """
+    The hedging state of a route: its latency window and its budget of extra calls, which caps hedges at
+    HEDGE_BUDGET_RATIO of the route's requests (plus HEDGE_BUDGET_MIN_PER_SECOND) so that a slow upstream is
+    not sent twice the load.
+    """
+
+    __slots__ = ("delay", "percentile", "latencies", "budget")
+
+    def __init__(self, hedge: HedgeConfig):
+        if hedge.delay is not None and hedge.delay <= 0:
+            raise ValueError(f"Hedge delay must be positive, got {hedge.delay}")
+        if not 0 < hedge.percentile < 1:
+            raise ValueError(f"Hedge percentile must be between 0 and 1, got {hedge.percentile}")
+        self.delay = hedge.delay
+        self.percentile = hedge.percentile
+        self.latencies = LatencyWindow(config.HEDGE_LATENCY_WINDOW)
+        self.budget = RetryBudget(config.HEDGE_BUDGET_RATIO, config.HEDGE_BUDGET_MIN_PER_SECOND)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Seconds to wait for the first call before hedging, or None while the route's latency is not known yet.
+        """
+        if self.delay is not None:
+            return self.delay
+        observed = self.latencies.percentile(self.percentile)
+        return None if observed is None else max(config.HEDGE_MIN_DELAY, observed)
+
+
+def _answered(call: asyncio.Task) -> bool:
+    """
+    Whether a finished call has an answer to give: a result, or a client error the upstream responded with.
+    """
+    error = call.exception()
+    return error is None or isinstance(error, HTTPException) and error.status_code < 500
+
+
+async def hedged(route, method: str, headers, healthy: Optional[Callable[[str], bool]],
+                 send: Callable[[Endpoint], Awaitable[T]],
+                 discard: Callable[[T], Awaitable] = None, replayable: bool = True) -> T:
+    """
+    Calls `send` with an endpoint picked for the route. For GETs on a hedging route, when that call has not
+    finished after the hedge delay, `send` is called once more with another endpoint. The first call with an
+    answer wins and the other one is cancelled; `discard` disposes of the result of a call that finished but
+    lost. A failed call only wins when both failed. `send` must take its timeout from the request deadline,
+    since the second call starts later. Requests that are not `replayable` (with a streamed body) are not hedged.
+    """
+    hedging = route.hedging
+    endpoint = route.pick(headers, healthy)
+    if hedging is None or method != "GET" or not replayable:
+        return await send(endpoint)
+
+    hedging.budget.record_request()
+    calls = [asyncio.ensure_future(_timed(send, endpoint, hedging))]
+    winner = None
+    try:
+        delay = hedging.hedge_delay()
+        if delay is not None:
+            done, _ = await asyncio.wait(calls, timeout=delay)
+            if not done:
+                if hedging.budget.try_withdraw():
+                    calls.append(asyncio.ensure_future(
+                        _timed(send, route.pick(headers, healthy, avoid=endpoint), hedging)))
+                else:
+                    HEDGED_REQUESTS.inc((route.name, "budget_exhausted"))
+
+        pending = set(calls)
+        while pending:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((call for call in calls if call.done() and _answered(call)), None)
+            if winner is not None:
+                if len(calls) > 1:
+                    HEDGED_REQUESTS.inc((route.name, "primary_won" if winner is calls[0] else "hedge_won"))
+                return winner.result()
+        return calls[0].result()
+    finally:
+        for call in calls:
+            call.cancel()
+        await asyncio.gather(*calls, return_exceptions=True)
+        if discard is not None:
+            for call in calls:
+                if call is not winner and not call.cancelled() and call.exception() is None:
+                    await discard(call.result())
+
+
+async def _timed(send: Callable[[Endpoint], Awaitable[T]], endpoint: Endpoint, hedging: Hedging) -> T:
+    started = time.perf_counter()
+    try:
+        result = await send(endpoint)
+    except asyncio.CancelledError:
+        # A call that lost the race took at least this long; leaving it out would only show the percentile
+        # the calls that were fast enough to win
+        hedging.latencies.record(time.perf_counter() - started)
+        raise
+    hedging.latencies.record(time.perf_counter() - started)
+    return result
@@ -0,0 +1,297 @@
+import asyncio
+import glob
+import logging
+import os
+from bisect import bisect_left
+from contextlib import suppress
+from typing import Callable, Optional
+
+from config.config import config
+from core.codec import json_codec
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """
+    Monotonic counter per label tuple. Labels are passed positionally, in `labelnames` order, to keep `inc` cheap.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def set(self, labels: tuple, value: float):
+        """
+        Sets the total directly, for counts that are kept elsewhere and copied in by a collector.
+        """
+        self._values[labels] = value
+
+    def snapshot(self) -> list:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """
+    Current value per label tuple. Across workers the values are summed, or the largest one is kept with
+    `aggregate="max"`. Gauges of workers that are gone are dropped.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), aggregate: str = "sum"):
+        super().__init__(name, documentation, labelnames)
+        self.aggregate = aggregate
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram per label tuple. Each observation increments a single (non-cumulative) bucket;
+    buckets are only made cumulative when rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label tuple: one count per bucket, one for +Inf, then the sum of all observations
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, labels: tuple = ()):
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def snapshot(self) -> list:
+        return [[list(labels), state] for labels, state in self._values.items()]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Registry:
+    """
+    The gateway's metrics, plus collectors that copy values kept elsewhere (cache stats, breaker states, pool usage)
+    into them when a snapshot is taken.
+
+    With several worker processes every worker writes its snapshot to `<METRICS_DIR>/<pid>.json` in the background,
+    and `/metrics` merges the snapshots of all workers.
+    """
+
+    def __init__(self, directory: str = "", flush_interval: float = 1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics: dict[str, object] = {}
+        self._collectors: list[Callable[[], None]] = []
+        self._writer: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), aggregate: str = "sum") -> Gauge:
+        return self._add(Gauge(name, documentation, labelnames, aggregate))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def _add(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collector(self, collect: Callable[[], None]):
+        self._collectors.append(collect)
+        return collect
+
+    def snapshot(self) -> dict:
+        for collect in self._collectors:
+            try:
+                collect()
+            except Exception as e:
+                logging.error(f"Metrics collector {collect.__name__} failed: {e}")
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    async def start(self):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._writer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._writer:
+            self._writer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._writer
+            self._writer = None
+            self.write()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.write()
+            except OSError as e:
+                logging.error(f"Failed to write metrics snapshot: {e}")
+
+    def write(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(json_codec.dumps(self.snapshot()))
+        os.replace(f"{path}.tmp", path)
+
+    def _snapshots(self) -> list[tuple[dict, bool]]:
+        """
+        Returns (snapshot, worker alive) for this worker and every other worker that wrote one.
+        """
+        snapshots = [(self.snapshot(), True)]
+        if not self.directory:
+            return snapshots
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            name = os.path.basename(path)[:-5]
+            # Only "<pid>.json" files are snapshots; anything else in the directory is not ours
+            if not name.isdigit():
+                continue
+            pid = int(name)
+            if pid == os.getpid():
+                continue
+            try:
+                with open(path, "rb") as file:
+                    snapshots.append((json_codec.loads(file.read()), _alive(pid)))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """
+        Merges the snapshots of all workers into the Prometheus text exposition format.
+        """
+        merged: dict[str, dict[tuple, object]] = {name: {} for name in self.metrics}
+        for snapshot, alive in self._snapshots():
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.type == "gauge" and not alive):
+                    continue
+                values = merged[name]
+                for labels, value in samples:
+                    labels = tuple(labels)
+                    current = values.get(labels)
+                    if current is None:
+                        values[labels] = list(value) if metric.type == "histogram" else value
+                    elif metric.type == "histogram":
+                        values[labels] = [a + b for a, b in zip(current, value)]
+                    elif metric.type == "gauge" and metric.aggregate == "max":
+                        values[labels] = max(current, value)
+                    else:
+                        values[labels] = current + value
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for labels, value in merged[name].items():
+                if metric.type != "histogram":
+                    lines.append(f"{name}{_labels(metric.labelnames, labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric.labelnames, labels)} {value[-1]}")
+                lines.append(f"{name}_count{_labels(metric.labelnames, labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+registry = Registry(directory=config.METRICS_DIR, flush_interval=config.METRICS_FLUSH_INTERVAL)
+
+# Requests as seen by the gateway
+REQUESTS = registry.counter("gateway_requests_total", "Requests handled by the gateway.",
+                            ("method", "route", "status"))
+REQUEST_DURATION = registry.histogram("gateway_request_duration_seconds", "Time to handle a request.",
+                                      ("method", "route"))
+REQUEST_BYTES = registry.counter("gateway_request_bytes_total", "Request body bytes received.", ("route",))
+RESPONSE_BYTES = registry.counter("gateway_response_bytes_total", "Response body bytes sent.", ("route",))
+RATE_LIMITED = registry.counter("gateway_rate_limited_total", "Requests rejected by the rate limiter.", ("route",))
+
+# Upstream calls
+UPSTREAM_DURATION = registry.histogram("gateway_upstream_duration_seconds",
+                                       "Time until the upstream response headers arrived, retries included.",
+                                       ("upstream", "method", "status"))
+UPSTREAM_ERRORS = registry.counter("gateway_upstream_errors_total", "Upstream calls that failed without a response.",
+                                   ("upstream", "error"))
+UPSTREAM_RETRIES = registry.counter("gateway_upstream_retries_total", "Upstream call attempts that were retried.",
+                                    ("upstream",))
+UPSTREAM_CONNECTIONS = registry.gauge("gateway_upstream_connections", "Pooled upstream connections.",
+                                      ("upstream", "state"))
+UPSTREAM_HEALTHY = registry.gauge("gateway_upstream_healthy", "Whether the endpoint passes its health checks.",
+                                  ("endpoint",), aggregate="max")
+UPSTREAM_OUTSTANDING = registry.gauge("gateway_upstream_outstanding_requests",
+                                      "Requests sent to the endpoint that have not been answered yet.",
+                                      ("upstream", "endpoint"))
+UPSTREAM_EJECTIONS = registry.counter("gateway_upstream_ejections_total",
+                                      "Times the endpoint was ejected from its pool as an outlier.",
+                                      ("upstream", "endpoint"))
+CONCURRENCY_LIMIT = registry.gauge("gateway_upstream_concurrency_limit",
+                                   "Adaptive limit of concurrent calls to the upstream.", ("upstream",))
+UPSTREAM_INFLIGHT = registry.gauge("gateway_upstream_inflight_requests",
+                                   "Calls to the upstream holding a slot of its concurrency limit.", ("upstream",))
+UPSTREAM_QUEUED = registry.gauge("gateway_upstream_queued_requests",
+                                 "Calls waiting for a slot of the upstream's concurrency limit.", ("upstream",))
+UPSTREAM_SHED = registry.counter("gateway_upstream_shed_total",
+                                 "Calls rejected because the upstream was at its concurrency limit.",
+                                 ("upstream", "reason"))
+HEDGED_REQUESTS = registry.counter("gateway_hedged_requests_total",
+                                   "Requests that were hedged, by which call answered, or that could not be hedged.",
+                                   ("route", "outcome"))
+CIRCUIT_BREAKER_STATE = registry.gauge("gateway_circuit_breaker_state",
+                                       "Circuit breaker state (0 closed, 1 half-open, 2 open), worst across workers.",
+                                       ("breaker",), aggregate="max")
+
+# Authentication
+AUTHENTICATIONS = registry.counter("gateway_authentications_total", "Authentication outcomes.", ("result",))
+TOKEN_VERIFY_DURATION = registry.histogram("gateway_token_verify_duration_seconds",
+                                           "Time spent verifying tokens that were not cached.",
+                                           buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                                                    0.0025, 0.005, 0.01))
+
+# Caches
+CACHE_EVENTS = registry.counter("gateway_response_cache_events_total", "Response cache lookups and updates.",
+                                ("event",))
+CACHE_BYTES = registry.gauge("gateway_response_cache_bytes", "Bytes held by the in-process response caches.")
+
+# Compression
+COMPRESSION_BYTES = registry.counter("gateway_response_compression_bytes_total",
+                                     "Bytes of compressed response bodies, before and after compression.",
+                                     ("encoding", "stage"))
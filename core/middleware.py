@@ -1,100 +1,256 @@
-import json
 import logging
+import random
 import time
-from typing import Callable
+from typing import Optional
 
-from fastapi import Request
-from opentelemetry import trace
-from opentelemetry.exporter.jaeger.thrift import JaegerExporter
-from opentelemetry.propagate import inject
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.semconv.resource import ResourceAttributes
+from opentelemetry import context, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from config.config import config
+from core.access_log import access_log, capture_body, redact_headers
+from core.compression import encoded_headers, is_compressible, negotiate
+from core.metrics import COMPRESSION_BYTES, REQUEST_BYTES, REQUEST_DURATION, REQUESTS, RESPONSE_BYTES
+from core.tracing import tracing
 
-# Initialize Jaeger Tracer
-resource = Resource(attributes={
-    ResourceAttributes.SERVICE_NAME: "api-gateway",
-    ResourceAttributes.DEPLOYMENT_ENVIRONMENT: 'development',
-})
-trace_provider = TracerProvider(resource=resource)
-jaeger_exporter = JaegerExporter(
-    collector_endpoint=f"http://{config.JAEGER_HOST}:{config.JAEGER_PORT}/api/traces",
-)
-trace_processor = BatchSpanProcessor(jaeger_exporter)
-trace_provider.add_span_processor(trace_processor)
-tracer = trace.get_tracer(__name__)
-
-
-async def logging_middleware(request: Request, call_next):
+
+class LoggingMiddleware:
     """
-    Logs request and response info.
+    Records the request metrics and one structured access log entry per request: method, path, route, status,
+    latency and byte counts.
+
+    Bodies are never buffered. For a sampled share of requests (ACCESS_LOG_BODY_SAMPLE_RATE) the first
+    ACCESS_LOG_BODY_MAX_BYTES of each body and the redacted headers are captured as well.
+    Entries are handed to the access log queue and written by a background task.
     """
-    start_time = time.time()
-    response = None
-    try:
-        response = await call_next(request)
-    except Exception as e:
-        logging.error(f"Error processing request: {e}")
-        raise
-    finally:
-        process_time = time.time() - start_time
-        logging.info(
-            f"Request: {request.method} {request.url} | Status: {response.status_code if response else 'N/A'} | Process Time: {process_time:.4f}s"
-        )
-        logging.info(f"Request Headers: {dict(request.headers)}")
-        if request.method in ["POST", "PUT", "PATCH"]:
-            try:
-                request_body = await request.json()
-                logging.info(f"Request Body: {request_body}")
-            except Exception as e:
-                logging.error(f"Error reading request body: {e}")
-        if response:
-            logging.info(f"Response Headers: {dict(response.headers)}")
-            try:
-                response_body = [section async for section in response.body_iterator]
-                logging.info(f"Response Body: {response_body}")
-            except Exception as e:
-                logging.error(f"Error reading response body: {e}")
-    return response
-
-
-async def tracing_middleware(request: Request, call_next):
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        state = scope.setdefault("state", {})
+        enabled = config.ACCESS_LOG_ENABLED
+        capture = enabled and config.ACCESS_LOG_BODY_SAMPLE_RATE > 0 and (
+            random.random() < config.ACCESS_LOG_BODY_SAMPLE_RATE)
+        max_bytes = config.ACCESS_LOG_BODY_MAX_BYTES
+        request_bytes = response_bytes = 0
+        status_code = None
+        response_headers = None
+        request_body = []
+        response_body = []
+
+        async def logged_receive() -> Message:
+            nonlocal request_bytes
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                if capture and request_bytes < max_bytes:
+                    request_body.append(body[:max_bytes - request_bytes])
+                request_bytes += len(body)
+            return message
+
+        async def logged_send(message: Message):
+            nonlocal response_bytes, status_code, response_headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                response_headers = message.get("headers", [])
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if capture and response_bytes < max_bytes:
+                    response_body.append(body[:max_bytes - response_bytes])
+                response_bytes += len(body)
+            await send(message)
+
+        try:
+            await self.app(scope, logged_receive, logged_send)
+        except Exception as e:
+            logging.error(f"Error processing request: {e}")
+            status_code = status_code or 500
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            # Label by gateway route or endpoint path template, never by the raw path, to bound the label values
+            route = state.get("route") or getattr(scope.get("route"), "path", "unmatched")
+            REQUESTS.inc((scope["method"], route, status_code or 500))
+            REQUEST_DURATION.observe(duration, (scope["method"], route))
+            REQUEST_BYTES.inc((route,), request_bytes)
+            RESPONSE_BYTES.inc((route,), response_bytes)
+
+            if enabled and (capture or status_code is None or status_code >= 500 or (
+                    random.random() < config.ACCESS_LOG_SAMPLE_RATE)):
+                entry = {
+                    "ts": time.time(),
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": state.get("route"),
+                    "status": status_code,
+                    "duration_ms": duration * 1000,
+                    "upstream_ms": state.get("upstream_latency"),
+                    "request_bytes": request_bytes,
+                    "response_bytes": response_bytes,
+                }
+                if capture:
+                    entry["request_headers"] = redact_headers(scope["headers"], access_log.redact)
+                    entry["request_body"] = capture_body(request_body, request_bytes, max_bytes)
+                    entry["response_headers"] = redact_headers(response_headers or [], access_log.redact)
+                    entry["response_body"] = capture_body(response_body, response_bytes, max_bytes)
+                access_log.record(entry)
+
+
+class TracingMiddleware:
     """
-    Creates spans for each request to be logged in a tracing engine like jaeger.
+    Traces requests with a server span named after the gateway route. Which requests are traced is decided by
+    the sampling settings of `core/tracing.py`: the sampled ones get their span from the start, and the upstream
+    calls made for them get client spans whose trace context is passed to the upstream. A request that was not
+    sampled only gets a span, after the fact, when it failed or was slow.
+
+    The incoming request is never modified. With tracing off the middleware costs a single check.
     """
 
-    carrier = {}
-    inject(carrier)
-    headers = dict(request.headers)
-    headers.update(carrier)
-    request.scope['headers'] = [(k.encode("utf-8"), v.encode("utf-8")) for k, v in headers.items()]
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        tracer = tracing.tracer
+        if tracer is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = tracing.parent(scope["headers"])
+        sampled = tracing.sampled(parent)
+        if not sampled and not tracing.tail:
+            await self.app(scope, receive, send)
+            return
 
-    with tracer.start_as_current_span(f"{request.method} {request.url.path}") as span:
-        span.set_attribute("http.method", request.method)
-        span.set_attribute("http.url", str(request.url))
+        start = time.time_ns()
+        span = None
+        token = None
+        if sampled:
+            span = tracer.start_span(scope["method"], context=parent, kind=SpanKind.SERVER, start_time=start)
+            token = context.attach(trace.set_span_in_context(span, parent))
+        status_code = None
+        error = None
 
-        response = await call_next(request)
+        async def traced_send(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
-        span.set_attribute("http.status_code", response.status_code)
-        return response
+        try:
+            await self.app(scope, receive, traced_send)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if token is not None:
+                context.detach(token)
+            if span is None and tracing.keep(status_code if error is None else None,
+                                             (time.time_ns() - start) / 1e9):
+                span = tracer.start_span(scope["method"], context=parent, kind=SpanKind.SERVER, start_time=start,
+                                         attributes={"sampling.tail": True})
+            if span is not None:
+                self._finish(span, scope, status_code, error)
+
+    @staticmethod
+    def _finish(span: trace.Span, scope: Scope, status_code: Optional[int], error: Optional[Exception]):
+        route = scope.get("state", {}).get("route") or getattr(scope.get("route"), "path", None)
+        if route:
+            span.update_name(f"{scope['method']} {route}")
+            span.set_attribute("http.route", route)
+        span.set_attribute("http.method", scope["method"])
+        span.set_attribute("http.target", scope["path"])
+        if error is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+        elif status_code is not None:
+            span.set_attribute("http.status_code", status_code)
+            if status_code >= 500:
+                span.set_status(Status(StatusCode.ERROR))
+        span.end()
 
 
-async def transform_request_middleware(request: Request, call_next: Callable):
+class CompressionMiddleware:
     """
-    Example of request transformation middleware. You can add more sophisticated logic here.
+    Compresses responses with the best encoding the client accepts (gzip, br or zstd, see `core/compression.py`).
+
+    A body sent in one piece is compressed in one go when it is at least COMPRESSION_MIN_SIZE bytes. A streamed
+    body is compressed chunk by chunk, every chunk flushed so the client gets it right away. Responses that are
+    already encoded, not text-like, marked no-transform or partial (206, Content-Range) are passed through, as are
+    cached responses served with a precompressed variant.
     """
-    if request.method == "POST" and request.url.path.startswith("/service-b"):
-        try:
-            data = await request.json()
-            if isinstance(data, dict):
-                data['transformed'] = True
-                request._body = json.dumps(data).encode('utf-8')
 
-            return await call_next(request)
-        except:
-            return await call_next(request)
+    def __init__(self, app: ASGIApp, minimum_size: int = None):
+        self.app = app
+        self.minimum_size = config.COMPRESSION_MIN_SIZE if minimum_size is None else minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = next((v for k, v in scope["headers"] if k == b"accept-encoding"), None)
+        encoder = negotiate(accept_encoding.decode("latin-1")) if accept_encoding else None
+        if encoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        compress = None
+        original = compressed = 0
+
+        async def compressing_send(message: Message):
+            nonlocal start, compress, original, compressed
+            if message["type"] == "http.response.start":
+                # Held back until the first body chunk shows whether the body is worth compressing
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = start["headers"]
+                length = next((v for k, v in headers if k.lower() == b"content-length"), None)
+                if length is not None and length.isdigit():
+                    small = int(length) < self.minimum_size
+                else:
+                    small = not more_body and len(body) < self.minimum_size
+                if small or start["status"] in (204, 206, 304) or not is_compressible(headers):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                if not more_body:
+                    data = encoder.compress(body)
+                    COMPRESSION_BYTES.inc((encoder.name, "original"), len(body))
+                    COMPRESSION_BYTES.inc((encoder.name, "compressed"), len(data))
+                    await send({**start, "headers": encoded_headers(headers, encoder.name, len(data))})
+                    start = None
+                    await send({"type": "http.response.body", "body": data, "more_body": False})
+                    return
+                compress = encoder.stream()
+                await send({**start, "headers": encoded_headers(headers, encoder.name, None)})
+                start = None
+
+            if compress is None:
+                await send(message)
+                return
+            data = compress(body, not more_body)
+            original += len(body)
+            compressed += len(data)
+            if not more_body:
+                COMPRESSION_BYTES.inc((encoder.name, "original"), original)
+                COMPRESSION_BYTES.inc((encoder.name, "compressed"), compressed)
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
 
-    return await call_next(request)
+        await self.app(scope, receive, compressing_send)
+        if start is not None:
+            # The app returned without sending a body
+            await send(start)
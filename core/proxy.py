@@ -0,0 +1,277 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from loguru import logger
+from starlette.background import BackgroundTask
+
+from config.config import config
+from core.cache import CachedResponse, is_storable, parse_cache_control, response_cache, vary_names
+from core.coalesce import upstream_flights
+from core.compression import encoded_headers, is_compressible, negotiate
+from core.health import health_monitor
+from core.hedging import hedged
+from core.metrics import COMPRESSION_BYTES
+from core.resilience import Deadline, request_timeout
+from core.routing import Route
+from core.tiered_cache import tiered_response_cache
+from core.utils import proxy_headers, stream_request
+
+CONDITIONAL_HEADERS = frozenset({b"if-none-match", b"if-modified-since"})
+
+# A successful request with one of these methods invalidates the cached GET response for the same URL
+UNSAFE_METHODS = frozenset({"POST", "PUT", "PATCH", "DELETE"})
+
+COALESCE_KEY_HEADERS = tuple(name.strip().lower() for name in config.COALESCE_KEY_HEADERS.split(",") if name.strip())
+
+
+def cached_response(entry: CachedResponse, request: Request, age: bool = True, compress: bool = True) -> Response:
+    """
+    Builds the client response for a stored entry, answering with 304 when the client's validators match.
+    With `compress`, clients accepting a supported encoding get the entry's compressed variant, which is
+    compressed once and then served from the cache.
+    """
+    if entry.matches_conditional(request.headers):
+        response_cache.not_modified += 1
+        response = Response(status_code=304)
+        response.raw_headers = entry.response_headers(not_modified=True, age=age)
+        return response
+    if compress and config.COMPRESSION_ENABLED and len(entry.body) >= config.COMPRESSION_MIN_SIZE \
+            and is_compressible(entry.headers):
+        encoder = negotiate(request.headers.get("accept-encoding"))
+        if encoder is not None:
+            body = entry.encoded(encoder)
+            COMPRESSION_BYTES.inc((encoder.name, "original"), len(entry.body))
+            COMPRESSION_BYTES.inc((encoder.name, "compressed"), len(body))
+            response = Response(content=body, status_code=entry.status_code)
+            response.raw_headers = encoded_headers(entry.response_headers(age=age), encoder.name, len(body))
+            return response
+    response = Response(content=entry.body, status_code=entry.status_code)
+    response.raw_headers = entry.response_headers(age=age)
+    return response
+
+
+async def _cache_body(upstream_response: httpx.Response, cache_key: str, request: Request,
+                      headers: list[tuple[bytes, bytes]]):
+    """
+    Streams the upstream body to the client while keeping a copy that is stored once the body is complete.
+    Bodies larger than the per-entry limit are streamed without being cached.
+    """
+    chunks = []
+    size = 0
+    async for chunk in upstream_response.aiter_raw():
+        if chunks is not None:
+            size += len(chunk)
+            if size > response_cache.max_entry_bytes:
+                chunks = None
+            else:
+                chunks.append(chunk)
+        yield chunk
+
+    if chunks is not None:
+        entry = CachedResponse(upstream_response.status_code, headers, b"".join(chunks), vary_names(headers))
+        await tiered_response_cache.put(cache_key, request.headers, entry)
+
+
+async def _fetch_shared(url: str, request_headers, headers: list[tuple[bytes, bytes]], route: Route,
+                        cache_key: Optional[str], entry: Optional[CachedResponse],
+                        priority: Optional[int] = None) -> CachedResponse:
+    """
+    Fetches a GET response on behalf of every coalesced caller and buffers it so all of them can be answered.
+    Revalidates `entry` when given and stores the result in the response cache when allowed.
+    Responses that may not be shared are returned unread, as an Unshared response.
+    """
+    deadline = Deadline(route.timeout)
+    upstream_response = await hedged(
+        route, "GET", request_headers, health_monitor.is_healthy,
+        lambda endpoint: stream_request(url=endpoint.rebase(url), method="GET", headers=headers,
+                                        timeout=deadline.remaining(), route=route.name, endpoint=endpoint,
+                                        priority=priority),
+        discard=_close)
+    response_headers = proxy_headers(upstream_response.headers.raw)
+    revalidated = entry is not None and upstream_response.status_code == 304
+    if not revalidated and not _shareable(request_headers, upstream_response, response_headers):
+        return Unshared(upstream_response)
+    try:
+        if entry is not None and upstream_response.status_code == 304:
+            await tiered_response_cache.revalidated(cache_key, request_headers, entry, response_headers)
+            return entry
+        body = b"".join([chunk async for chunk in upstream_response.aiter_raw()])
+    finally:
+        await upstream_response.aclose()
+
+    logger.debug(f"📤 Fetched shared response from {url}, status code: {upstream_response.status_code}")
+
+    snapshot = CachedResponse(upstream_response.status_code, response_headers, body, vary_names(response_headers))
+    if cache_key is not None and is_storable(request_headers, upstream_response.status_code, response_headers):
+        await tiered_response_cache.put(cache_key, request_headers, snapshot)
+    return snapshot
+
+
+def _shareable(request_headers, upstream_response: httpx.Response, response_headers) -> bool:
+    """
+    Only responses the cache may store, and that are known to fit into a cache entry, are buffered for the
+    coalesced callers; large downloads are streamed a chunk at a time instead.
+    """
+    length = upstream_response.headers.get("content-length")
+    return (length is not None and length.isdigit() and int(length) <= response_cache.max_entry_bytes
+            and is_storable(request_headers, upstream_response.status_code, response_headers))
+
+
+class Unshared:
+    """
+    An unread upstream response that the coalesced callers cannot share. The first caller to claim it streams
+    it to its client and the others call the upstream on their own. It is closed when nobody claimed it,
+    after every caller went away.
+    """
+
+    __slots__ = ("response",)
+
+    # Callers waiting for the response claim it within a few event loop iterations
+    CLAIM_TIMEOUT = 1.0
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        asyncio.get_running_loop().call_later(self.CLAIM_TIMEOUT, self._close_unclaimed)
+
+    def claim(self) -> Optional[httpx.Response]:
+        response, self.response = self.response, None
+        return response
+
+    def _close_unclaimed(self):
+        response = self.claim()
+        if response is not None:
+            asyncio.ensure_future(response.aclose())
+
+
+async def _close(upstream_response: httpx.Response):
+    await upstream_response.aclose()
+
+
+async def _refresh(flight_key, *args):
+    try:
+        result = await upstream_flights.do(flight_key, lambda: _fetch_shared(*args))
+        if isinstance(result, Unshared) and (upstream_response := result.claim()) is not None:
+            await upstream_response.aclose()
+    except (HTTPException, httpx.HTTPError) as e:
+        logging.warning(f"Background revalidation of {flight_key[0]} failed: {e}")
+
+
+async def proxy_request(url: str, request: Request, route: Route, priority: Optional[int] = None) -> Response:
+    """
+    Pipes the request body to the upstream and streams the upstream response back untouched.
+    `url` is built from the route's base URL; each upstream call goes to the endpoint the route's balancer picks.
+    `priority` is the request's priority class for the upstream's concurrency limit.
+
+    Cacheable GET responses are served from and stored in the gateway response cache, and concurrent
+    identical GETs are coalesced into a single upstream call. Its response is buffered and shared when it may
+    be cached and fits into a cache entry; otherwise one caller streams it and the others call the upstream.
+    """
+    cache_key = None
+    entry: Optional[CachedResponse] = None
+    headers = proxy_headers(request.headers.raw)
+    transform = route.request_transform(request.method)
+    if transform is not None and transform.request_headers is not None:
+        headers = transform.request_headers(headers)
+    # Response body transforms need the identity body
+    compress = route.transform is None or route.transform.response_body is None
+    # A route's rewrite may carry a query of its own; the client's query is added to it
+    url, _, rewritten_query = url.partition("?")
+    query = "&".join(part for part in (rewritten_query, request.url.query) if part)
+    upstream_url = f"{url}?{query}" if query else url
+    has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+
+    if request.method == "GET" and config.RESPONSE_CACHE_ENABLED:
+        directives = parse_cache_control(request.headers.get("cache-control"))
+        if "no-store" not in directives:
+            cache_key = response_cache.base_key(request.method, url, query)
+            entry = await tiered_response_cache.get(cache_key, request.headers)
+            revalidate = "no-cache" in directives or directives.get("max-age") == "0"
+            if entry is not None and not revalidate and entry.is_fresh():
+                response_cache.hits += 1
+                return cached_response(entry, request, compress=compress)
+            if entry is not None and not revalidate and entry.is_within_stale_while_revalidate():
+                # Serve the stale copy now and refresh it once in the background
+                response_cache.stale_hits += 1
+                refresh_headers = [(k, v) for k, v in headers if k.lower() not in CONDITIONAL_HEADERS]
+                asyncio.ensure_future(_refresh(
+                    _flight_key(cache_key, request), upstream_url, request.headers,
+                    refresh_headers + entry.validators(), route, cache_key, entry, priority,
+                ))
+                return cached_response(entry, request, compress=compress)
+            if entry is not None and entry.has_validators:
+                # Revalidate the stale entry with our own validators instead of the client's
+                headers = [(k, v) for k, v in headers if k.lower() not in CONDITIONAL_HEADERS] + entry.validators()
+            else:
+                entry = None
+                response_cache.misses += 1
+
+    upstream_response = None
+    if request.method == "GET" and config.COALESCE_ENABLED and not has_body:
+        # The client's own validators are evaluated per caller against the shared response
+        shared_headers = headers
+        if entry is None:
+            shared_headers = [(k, v) for k, v in headers if k.lower() not in CONDITIONAL_HEADERS]
+        flight_key = _flight_key(cache_key or response_cache.base_key(request.method, url, query), request)
+        started = time.perf_counter()
+        snapshot = await upstream_flights.do(
+            flight_key, lambda: _fetch_shared(upstream_url, request.headers, shared_headers, route, cache_key,
+                                              entry, priority))
+        request.state.upstream_latency = (time.perf_counter() - started) * 1000
+        if not isinstance(snapshot, Unshared):
+            return cached_response(snapshot, request, age=snapshot is entry, compress=compress)
+        upstream_response = snapshot.claim()
+
+    invalidate_key = None
+    if request.method in UNSAFE_METHODS and config.RESPONSE_CACHE_ENABLED:
+        invalidate_key = response_cache.base_key("GET", url, query)
+
+    if upstream_response is None:
+        # Only attach a body stream when the client sent one, otherwise httpx would switch to chunked encoding
+        content = request.stream() if has_body else None
+        if has_body and transform is not None and transform.request_body is not None:
+            # Body transforms need the whole body; it is decoded and encoded once for all of the route's rules
+            headers, content = transform.request_content(headers, await request.body())
+
+        deadline = Deadline(request_timeout(request.headers, route.timeout))
+        started = time.perf_counter()
+        # A request body can only be sent once, so such requests are never hedged
+        upstream_response = await hedged(
+            route, request.method, request.headers, health_monitor.is_healthy,
+            lambda endpoint: stream_request(url=endpoint.rebase(upstream_url), method=request.method,
+                                            headers=headers, content=content, timeout=deadline.remaining(),
+                                            route=route.name, endpoint=endpoint, priority=priority),
+            discard=_close, replayable=content is None)
+        request.state.upstream_latency = (time.perf_counter() - started) * 1000
+
+    logger.debug(f"📤 Streaming response from {upstream_response.url}, status code: {upstream_response.status_code}")
+
+    response_headers = proxy_headers(upstream_response.headers.raw)
+    if entry is not None and upstream_response.status_code == 304:
+        await upstream_response.aclose()
+        await tiered_response_cache.revalidated(cache_key, request.headers, entry, response_headers)
+        return cached_response(entry, request, compress=compress)
+
+    if invalidate_key is not None and upstream_response.status_code < 400:
+        await tiered_response_cache.invalidate(invalidate_key)
+
+    body = upstream_response.aiter_raw()
+    if cache_key is not None and is_storable(request.headers, upstream_response.status_code, response_headers):
+        body = _cache_body(upstream_response, cache_key, request, response_headers)
+
+    response = StreamingResponse(body, status_code=upstream_response.status_code,
+                                 background=BackgroundTask(upstream_response.aclose))
+    response.raw_headers = response_headers
+    return response
+
+
+def _flight_key(base_key: str, request: Request) -> tuple:
+    """
+    Requests only share an upstream call when they target the same resource with the same key headers
+    (by default the credentials and content negotiation headers).
+    """
+    return (base_key, *(request.headers.get(name) for name in COALESCE_KEY_HEADERS))
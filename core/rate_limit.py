@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import math
+import time
+from contextlib import suppress
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+from config.config import config
+from core import store
+
+_UNITS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+@lru_cache(maxsize=256)
+def parse_rate(rate: str) -> tuple[int, int]:
+    """
+    Parses a rate such as "100/minute" or "5/second" into (requests, period in seconds).
+    """
+    times, _, unit = rate.partition("/")
+    unit = unit.strip().lower().rstrip("s")
+    if unit not in _UNITS:
+        raise ValueError(f"Invalid rate limit: {rate!r}")
+    return int(times), _UNITS[unit]
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens and refills `capacity` tokens per `period` seconds.
+    """
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated")
+
+    def __init__(self, capacity: int, period: int, now: float):
+        self.capacity = capacity
+        self.refill_rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def try_acquire(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def drain(self, now: float):
+        self.tokens = 0.0
+        self.updated = now
+
+    def retry_after(self) -> float:
+        return max(1 - self.tokens, 0) / self.refill_rate
+
+
+class _Limit:
+    """
+    Local state of one rate limit key: the token bucket plus what is known about the cluster-wide count.
+    """
+
+    __slots__ = ("rate", "bucket", "limit", "period", "window", "pending", "reported", "previous", "share",
+                 "remaining", "used_at")
+
+    def __init__(self, rate: str, now: float):
+        limit, period = parse_rate(rate)
+        self.rate = rate
+        self.bucket = TokenBucket(limit, period, now)
+        self.limit = limit
+        self.period = period
+        self.window = int(time.time() // period)
+        # Requests admitted here that Redis does not know about yet, and those it does know about this window
+        self.pending = 0
+        self.reported = 0
+        # (window, requests reported) of the previous window until its final count has been read back
+        self.previous: Optional[tuple[int, int]] = None
+        # This worker's share of the key's traffic in the previous window, used to split what is left of the
+        # current window between workers
+        self.share = 1.0
+        # Requests this worker may still admit in the current window (None: unknown until the next sync)
+        self.remaining: Optional[int] = None
+        self.used_at = now
+
+    def next_window(self, window: int):
+        if self.reported:
+            self.previous = (self.window, self.reported)
+        self.window = window
+        self.reported = 0
+        self.remaining = None
+
+
+class RateLimiter:
+    """
+    Rate limiter that decides locally and reconciles with Redis in the background.
+
+    Every worker enforces each limit with a local token bucket, so a check never leaves the process.
+    Every `sync_interval` seconds the requests admitted since the last sync are added to a per-window counter
+    in Redis with one pipelined round trip for all keys. The returned totals tell each worker how much of the
+    cluster-wide limit is left; each worker spends the part of it that matches its share of the key's traffic
+    until the next sync. The cluster can overshoot a limit by what the workers admit while a key's count is
+    unknown (a new key or a new window), which ends with the next sync; such syncs are started early.
+    """
+
+    def __init__(self, prefix: str, sync_interval: float):
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.redis = None
+        self._limits: dict[str, _Limit] = {}
+        self._syncer: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def allow(self, key: str, rate: str) -> float:
+        """
+        Takes a token for `key`. Returns 0 when the request is allowed, otherwise the seconds until it would be.
+        """
+        now = time.monotonic()
+        state = self._limits.get(key)
+        if state is None or state.rate != rate:
+            # A new key, or one whose route was given another rate by a reload
+            fresh = _Limit(rate, now)
+            if state is not None and state.period == fresh.period:
+                # Requests admitted under the old rate still count against the window in Redis
+                fresh.pending = state.pending
+            state = self._limits[key] = fresh
+            self._request_sync()
+        state.used_at = now
+
+        if state.remaining is not None:
+            window = int(time.time() // state.period)
+            if window != state.window:
+                # A new window started since the last sync; the cluster-wide count is unknown until the next one
+                state.next_window(window)
+                self._request_sync()
+            elif state.remaining <= 0:
+                # Keep the bucket empty so it cannot save up a burst for the start of the next window
+                state.bucket.drain(now)
+                return (window + 1) * state.period - time.time()
+
+        if not state.bucket.try_acquire(now):
+            return state.bucket.retry_after()
+        state.pending += 1
+        if state.remaining is not None:
+            state.remaining -= 1
+        return 0
+
+    def check(self, key: str, rate: str):
+        """
+        Raises a 429 with a Retry-After header when `key` is over its limit.
+        """
+        retry_after = self.allow(key, rate)
+        if retry_after:
+            raise HTTPException(status_code=429, detail="Too Many Requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+    def _request_sync(self):
+        """
+        Wakes the syncer early when a key's cluster-wide count is unknown, so the local bucket alone
+        decides for as short a time as possible.
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, redis):
+        self.redis = redis
+        self._wakeup = asyncio.Event()
+        self._syncer = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._syncer:
+            self._syncer.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._syncer
+            self._syncer = None
+        self._wakeup = None
+        await self.sync()
+        self.redis = None
+
+    async def _run(self):
+        while True:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.sync_interval)
+            self._wakeup.clear()
+            await self.sync()
+            # Early syncs are limited to ten per sync interval
+            await asyncio.sleep(self.sync_interval / 10)
+
+    async def sync(self):
+        """
+        Pushes the locally admitted requests to Redis and pulls back the cluster-wide totals.
+        """
+        now = time.monotonic()
+        # Idle keys are dropped once Redis has been told about their requests; without Redis there is nothing
+        # to tell
+        for key in [key for key, state in self._limits.items()
+                    if (state.pending == 0 or self.redis is None) and now - state.used_at > state.period]:
+            del self._limits[key]
+        if self.redis is None or not self._limits:
+            return
+
+        wall = time.time()
+        batch = []
+        for key, state in self._limits.items():
+            window = int(wall // state.period)
+            if window != state.window:
+                state.next_window(window)
+            batch.append((key, state, state.pending))
+            state.pending = 0
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, state, pending in batch:
+                    counter = f"{self.prefix}{key}:{state.window}"
+                    pipe.incrby(counter, pending)
+                    pipe.expire(counter, state.period * 2)
+                    if state.previous:
+                        pipe.get(f"{self.prefix}{key}:{state.previous[0]}")
+                results = iter(await pipe.execute())
+        except store.errors() as e:
+            # Keep enforcing the local limits and report the requests on the next sync
+            logging.warning(f"Rate limit sync failed: {e}")
+            for key, state, pending in batch:
+                state.pending += pending
+            return
+
+        for key, state, pending in batch:
+            used = next(results)
+            next(results)
+            if state.previous:
+                total = next(results)
+                if total:
+                    state.share = state.previous[1] / int(total)
+                state.previous = None
+            state.reported += pending
+            # Every worker spends its own share of what is left, so together they do not overshoot the limit.
+            # Requests admitted while the round trip was in flight are still pending.
+            state.remaining = math.ceil((state.limit - used) * state.share) - state.pending
+
+
+class RateLimit:
+    """
+    FastAPI dependency applying a fixed rate per client address to a single endpoint.
+    """
+
+    def __init__(self, rate: str, name: str):
+        parse_rate(rate)
+        self.rate = rate
+        self.name = name
+
+    async def __call__(self, request: Request):
+        client = request.client.host if request.client else "unknown"
+        rate_limiter.check(f"{self.name}:{client}", self.rate)
+
+
+rate_limiter = RateLimiter(prefix=config.RATE_LIMIT_PREFIX, sync_interval=config.RATE_LIMIT_SYNC_INTERVAL)
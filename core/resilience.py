@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+import httpx
+
+from config.config import config
+from core.client import _origin
+from core.metrics import CIRCUIT_BREAKER_STATE, UPSTREAM_RETRIES, registry
+
+# Methods that may be sent again after the upstream has already seen them (RFC 9110, section 9.2.2)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Statuses that mean the upstream (or a proxy in front of it) could not handle the request right now
+RETRYABLE_STATUS_CODES = frozenset({502, 503, 504})
+
+# Errors raised before the request reached the upstream; these are safe to retry for every method
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream whose circuit breaker is open.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the request deadline expires before the upstream could be called (again).
+    """
+
+
+class CircuitBreaker:
+    """
+    Non-blocking circuit breaker for a single upstream.
+
+    Trips after `failure_threshold` consecutive failures, rejects calls for `reset_timeout` seconds and then
+    lets up to `half_open_max_calls` probes through. A successful probe closes the circuit, a failed one opens it again,
+    and one that ends without an answer (cancelled, or failed before the upstream was reached) frees its slot.
+    Only transport errors and 5xx responses count as failures; 4xx responses are the client's problem.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float, half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    def allow(self) -> bool:
+        """
+        Returns whether a call may go through, moving an expired open circuit to half-open.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._transition(self.HALF_OPEN)
+        if self._probes >= self.half_open_max_calls:
+            return False
+        self._probes += 1
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def release(self):
+        """
+        Gives back the slot of a half-open probe that ended without telling anything about the upstream.
+        """
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._transition(self.OPEN)
+
+    def _transition(self, state: str):
+        logging.warning(f"Circuit breaker for {self.name} is now {state}")
+        self.state = state
+        self._probes = 0
+
+
+class CircuitBreakerRegistry:
+    """
+    One circuit breaker per upstream origin, or per (origin, route) when CIRCUIT_BREAKER_PER_ROUTE is set.
+    """
+
+    def __init__(self):
+        self._breakers: dict[tuple, CircuitBreaker] = {}
+
+    def get(self, url: str, route: Optional[str] = None) -> CircuitBreaker:
+        origin = _origin(url)
+        key = (origin, route if config.CIRCUIT_BREAKER_PER_ROUTE else None)
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            name = f"{origin} ({route})" if key[1] else origin
+            breaker = self._breakers[key] = CircuitBreaker(
+                name,
+                failure_threshold=config.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                reset_timeout=config.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                half_open_max_calls=config.CIRCUIT_BREAKER_HALF_OPEN_MAX_CALLS,
+            )
+        return breaker
+
+    def states(self) -> dict[str, str]:
+        return {breaker.name: breaker.state for breaker in self._breakers.values()}
+
+
+class RetryBudget:
+    """
+    Caps retries at `ratio` of the requests seen over the last `window` seconds, plus a small floor of
+    `min_per_second` so low-traffic upstreams can still retry. Counts are kept in one bucket per second.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, window: int = 10):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._seconds = [0] * window
+        self._requests = [0] * window
+        self._retries = [0] * window
+
+    def _slot(self, second: int) -> int:
+        slot = second % self.window
+        if self._seconds[slot] != second:
+            self._seconds[slot] = second
+            self._requests[slot] = self._retries[slot] = 0
+        return slot
+
+    def record_request(self):
+        self._requests[self._slot(int(time.monotonic()))] += 1
+
+    def try_withdraw(self) -> bool:
+        """
+        Reserves a retry, returning False when the budget is spent.
+        """
+        second = int(time.monotonic())
+        requests = retries = 0
+        for slot, started in enumerate(self._seconds):
+            if second - started < self.window:
+                requests += self._requests[slot]
+                retries += self._retries[slot]
+        if retries >= self.min_per_second * self.window + self.ratio * requests:
+            return False
+        self._retries[self._slot(second)] += 1
+        return True
+
+
+class Deadline:
+    """
+    Absolute point in time by which the whole upstream call, retries and backoff included, has to be done.
+    """
+
+    def __init__(self, timeout: Optional[float]):
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+
+def request_timeout(headers, timeout: Optional[float]) -> Optional[float]:
+    """
+    Combines the route timeout with the time the client is willing to wait, taken from REQUEST_TIMEOUT_HEADER (seconds).
+    """
+    value = headers.get(config.REQUEST_TIMEOUT_HEADER)
+    if value is None:
+        return timeout
+    try:
+        client_timeout = float(value)
+    except ValueError:
+        return timeout
+    if client_timeout <= 0:
+        return timeout
+    return client_timeout if timeout is None else min(timeout, client_timeout)
+
+
+class RetryPolicy:
+    """
+    Retries failed upstream calls with exponential backoff and full jitter.
+
+    Connection failures are retried for any method since the upstream never saw the request. Other errors and
+    502/503/504 responses are only retried for idempotent methods. Requests with a body that can only be read
+    once (a streamed client body) are never retried. Every retry is paid for from the upstream's retry budget
+    and is skipped when it could not finish before the deadline.
+    """
+
+    def __init__(self, max_attempts: int, backoff_base: float, backoff_max: float):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._budgets: dict[str, RetryBudget] = {}
+
+    def budget(self, url: str) -> RetryBudget:
+        origin = _origin(url)
+        budget = self._budgets.get(origin)
+        if budget is None:
+            budget = self._budgets[origin] = RetryBudget(config.RETRY_BUDGET_RATIO,
+                                                         config.RETRY_BUDGET_MIN_PER_SECOND)
+        return budget
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retryable(self, method: str, attempt: int, replayable: bool, error: Exception = None,
+                   status_code: int = None) -> bool:
+        if attempt + 1 >= self.max_attempts or not replayable:
+            return False
+        if isinstance(error, NOT_SENT_ERRORS):
+            return True
+        if method not in IDEMPOTENT_METHODS:
+            return False
+        return error is not None or status_code in RETRYABLE_STATUS_CODES
+
+    async def call(self, url: str, method: str, send: Callable[[Optional[float]], Awaitable[httpx.Response]],
+                   breaker: CircuitBreaker, deadline: Deadline, replayable: bool = True) -> httpx.Response:
+        """
+        Calls `send(timeout)` until it succeeds, fails with a non-retryable error or runs out of attempts.
+
+        `send` receives the time left until the deadline (None when there is none) and returns the upstream response.
+        Raises CircuitOpenError, DeadlineExceeded or the last httpx.HTTPError.
+        """
+        budget = self.budget(url)
+        budget.record_request()
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(breaker.name)
+            remaining = deadline.remaining()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceeded(url)
+
+            try:
+                response = await send(remaining)
+            except httpx.HTTPError as e:
+                breaker.record_failure()
+                if not self._retryable(method, attempt, replayable, error=e) or not await self._wait(
+                        attempt, deadline, budget):
+                    raise
+            except BaseException:
+                # Cancelled (client gone, lost hedge or composite call) or broken on our side
+                breaker.release()
+                raise
+            else:
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                if not self._retryable(method, attempt, replayable, status_code=response.status_code):
+                    return response
+                if not await self._wait(attempt, deadline, budget):
+                    return response
+                await response.aclose()
+
+            attempt += 1
+            UPSTREAM_RETRIES.inc((_origin(url),))
+            logging.info(f"Retrying {method} {url} (attempt {attempt + 1}/{self.max_attempts})")
+
+    async def _wait(self, attempt: int, deadline: Deadline, budget: RetryBudget) -> bool:
+        """
+        Sleeps before the next attempt, returning False when there is no time or budget left for one.
+        """
+        delay = self.backoff(attempt)
+        remaining = deadline.remaining()
+        if remaining is not None and delay >= remaining:
+            return False
+        if not budget.try_withdraw():
+            return False
+        await asyncio.sleep(delay)
+        return True
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+_STATE_VALUES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+
+
+@registry.collector
+def _collect_breaker_states():
+    for name, state in circuit_breakers.states().items():
+        CIRCUIT_BREAKER_STATE.set((name,), _STATE_VALUES[state])
+
+retry_policy = RetryPolicy(
+    max_attempts=config.RETRY_MAX_ATTEMPTS,
+    backoff_base=config.RETRY_BACKOFF_BASE,
+    backoff_max=config.RETRY_BACKOFF_MAX,
+)
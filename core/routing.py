@@ -0,0 +1,408 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import Callable, Optional, Union
+
+from pydantic import BaseModel
+
+from config.config import config
+from core.balancer import Endpoint, EndpointPool
+from core.composition import Composite, CompositeConfig
+from core.hedging import HedgeConfig, Hedging
+from core.metrics import UPSTREAM_OUTSTANDING, registry
+from core.rate_limit import parse_rate
+from core.transform import Transform, TransformConfig
+
+
+class RouteConfig(BaseModel):
+    """
+    A single routing rule as declared in the routes file.
+    Exactly one of `prefix` or `regex` must be set, and exactly one of `upstream` or `composite`.
+    """
+    name: Optional[str] = None
+    upstream: Optional[str] = None
+    prefix: Optional[str] = None
+    regex: Optional[str] = None
+    host: Optional[str] = None
+    methods: Optional[list[str]] = None
+    # Prefix routes: strip the matched prefix, optionally replacing it with `rewrite`.
+    # Regex routes: `rewrite` is a substitution template such as "/v2/\\g<rest>".
+    strip_prefix: bool = True
+    rewrite: Optional[str] = None
+    timeout: Optional[float] = None
+    # Requests per JWT subject on this route, e.g. "100/minute"; RATE_LIMIT applies when unset
+    rate_limit: Optional[str] = None
+    # Header, JSON body and path rewrites of requests to and responses from the upstream
+    transform: Optional[TransformConfig] = None
+    # Several upstream calls run concurrently and merged into one JSON response, instead of a single upstream
+    composite: Optional[CompositeConfig] = None
+    # GETs that are slow to answer are sent again to another endpoint of the upstream
+    hedge: Optional[HedgeConfig] = None
+
+
+class EndpointConfig(BaseModel):
+    url: str
+    weight: int = 1
+
+
+class UpstreamConfig(BaseModel):
+    """
+    An upstream served by several endpoints. `balancer` is one of round_robin, weighted, least_outstanding,
+    power_of_two or consistent_hash (on the value of `hash_header`); UPSTREAM_BALANCER applies when unset.
+    With DISCOVERY_PROVIDER set, the endpoints of `service` (by default the upstream name) replace the configured
+    ones whenever the provider has any.
+    """
+    endpoints: list[Union[str, EndpointConfig]]
+    balancer: Optional[str] = None
+    hash_header: Optional[str] = None
+    service: Optional[str] = None
+
+    def pool(self, name: str) -> EndpointPool:
+        endpoints = [(endpoint, 1) if isinstance(endpoint, str) else (endpoint.url, endpoint.weight)
+                     for endpoint in self.endpoints]
+        return EndpointPool(name, endpoints, self.balancer, self.hash_header, self.service)
+
+
+def _upstream(value: Union[str, UpstreamConfig]) -> UpstreamConfig:
+    """
+    A plain string is a single base URL, or several separated by commas.
+    """
+    if isinstance(value, UpstreamConfig):
+        return value
+    return UpstreamConfig(endpoints=[url.strip() for url in value.split(",") if url.strip()])
+
+
+class RouteTableConfig(BaseModel):
+    """
+    Contents of the routes file: named upstreams (base URLs or endpoint pools) and the rules that point to them.
+    """
+    upstreams: dict[str, Union[str, UpstreamConfig]]
+    routes: list[RouteConfig]
+    # Health check path per upstream name; HEALTH_CHECK_UPSTREAM_PATH applies to the others
+    health_checks: dict[str, str] = {}
+
+
+class Route:
+    """
+    A compiled routing rule.
+    """
+    __slots__ = ("name", "upstream", "upstream_url", "endpoints", "methods", "timeout", "rate_limit", "transform",
+                 "composite", "hedging", "_depth", "_regex", "_rewrite", "_strip_prefix")
+
+    def __init__(self, rule: RouteConfig, pools: dict[str, EndpointPool]):
+        self.name = rule.name or rule.prefix or rule.regex
+        self.upstream = rule.upstream
+        # Composite routes have no upstream of their own; every call picks from its upstream's pool
+        self.composite = Composite(self.name, rule.composite, pools) if rule.composite is not None else None
+        self.endpoints = pools[rule.upstream] if rule.upstream is not None else None
+        # URLs built from the first endpoint identify a resource for caching and coalescing;
+        # `EndpointPool.pick` decides where each call goes
+        self.upstream_url = self.endpoints.base_url if self.endpoints is not None else None
+        self.methods = frozenset(m.upper() for m in rule.methods) if rule.methods else None
+        self.timeout = rule.timeout
+        self.rate_limit = rule.rate_limit
+        self.transform = Transform(rule.transform) if rule.transform is not None else None
+        self.hedging = Hedging(rule.hedge) if rule.hedge is not None else None
+        # Prefix length in path segments: the trie skips empty segments, so "//a/x" matches "/a" as well
+        self._depth = len(_segments(rule.prefix)) if rule.prefix is not None else 0
+        self._regex = re.compile(rule.regex) if rule.regex is not None else None
+        self._rewrite = rule.rewrite
+        self._strip_prefix = rule.strip_prefix
+
+    def allows(self, method: str) -> bool:
+        return self.methods is None or method in self.methods
+
+    def rewrite_prefix(self, path: str) -> str:
+        if self._rewrite is not None:
+            path = self._rewrite.rstrip("/") + _strip_segments(path, self._depth)
+        elif self._strip_prefix:
+            path = _strip_segments(path, self._depth)
+        return path if path.startswith("/") else f"/{path}"
+
+    def rewrite_regex(self, path: str) -> Optional[str]:
+        regex_match = self._regex.match(path)
+        if regex_match is None:
+            return None
+        if self._rewrite is None:
+            return path
+        path = regex_match.expand(self._rewrite)
+        return path if path.startswith("/") else f"/{path}"
+
+    def request_transform(self, method: str) -> Optional[Transform]:
+        """
+        Returns the route's transforms when its request transforms apply to the method.
+        """
+        if self.transform is not None and self.transform.applies(method):
+            return self.transform
+        return None
+
+    def url_for(self, path: str) -> str:
+        return f"{self.upstream_url}{path}"
+
+    def healthy(self, healthy: Callable[[str], bool]) -> bool:
+        if self.composite is not None:
+            return self.composite.healthy(healthy)
+        return any(healthy(endpoint.url) for endpoint in self.endpoints.endpoints)
+
+    def pick(self, headers, healthy: Callable[[str], bool] = None, avoid: Optional[Endpoint] = None) -> Endpoint:
+        """
+        Chooses the endpoint for one upstream call; it must be released with `Endpoint.release`.
+        """
+        return self.endpoints.pick(self.endpoints.hash_key(headers), healthy, avoid)
+
+
+def _segments(path: str) -> list[str]:
+    return [segment for segment in path.split("/") if segment]
+
+
+def _strip_segments(path: str, count: int) -> str:
+    """
+    Removes the first `count` non-empty segments from a path, however many slashes separate them.
+    """
+    position = 0
+    for _ in range(count):
+        while position < len(path) and path[position] == "/":
+            position += 1
+        end = path.find("/", position)
+        position = len(path) if end == -1 else end
+    return path[position:]
+
+
+class _TrieNode:
+    __slots__ = ("children", "routes")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.routes: list[Route] = []
+
+
+class RouteTable:
+    """
+    Immutable, compiled set of routes.
+
+    Prefix rules live in a trie keyed by path segment (one trie per host plus a host-agnostic one),
+    so a lookup costs O(path depth) regardless of how many routes exist. The longest matching prefix wins.
+    Regex rules are only consulted, in declaration order, when no prefix rule matches.
+    """
+
+    def __init__(self, table: RouteTableConfig):
+        self._tries: dict[Optional[str], _TrieNode] = {}
+        self._regex_routes: dict[Optional[str], list[Route]] = {}
+        self.routes: list[Route] = []
+        self.pools = {name: _upstream(upstream).pool(name) for name, upstream in table.upstreams.items()}
+        self._health_checks = table.health_checks
+
+        for rule in table.routes:
+            if (rule.prefix is None) == (rule.regex is None):
+                raise ValueError(f"Route {rule.name or rule.upstream!r} must define exactly one of prefix or regex")
+            if (rule.upstream is None) == (rule.composite is None):
+                raise ValueError(f"Route {rule.name or rule.prefix or rule.regex!r} must define exactly one of "
+                                 f"upstream or composite")
+            if rule.upstream is not None and rule.upstream not in table.upstreams:
+                raise ValueError(f"Route {rule.name or rule.upstream!r} references unknown upstream {rule.upstream!r}")
+            if rule.hedge is not None and rule.composite is not None:
+                raise ValueError(f"Route {rule.name or rule.prefix or rule.regex!r} cannot hedge a composite")
+            if rule.rate_limit is not None:
+                parse_rate(rule.rate_limit)
+
+            route = Route(rule, self.pools)
+            self.routes.append(route)
+            host = rule.host.lower() if rule.host else None
+            if rule.prefix is not None:
+                node = self._tries.setdefault(host, _TrieNode())
+                for segment in _segments(rule.prefix):
+                    node = node.children.setdefault(segment, _TrieNode())
+                node.routes.append(route)
+            else:
+                self._regex_routes.setdefault(host, []).append(route)
+
+    def health_targets(self) -> dict[str, str]:
+        """
+        Returns the health check URL of every endpoint, keyed by endpoint URL.
+        """
+        return {
+            endpoint.url: endpoint.url + self._health_checks.get(name, config.HEALTH_CHECK_UPSTREAM_PATH)
+            for name, pool in self.pools.items() for endpoint in pool.endpoints
+        }
+
+    def match(self, method: str, path: str, host: Optional[str] = None,
+              healthy: Callable[[str], bool] = None) -> Optional[tuple[Route, str]]:
+        """
+        Finds the route for a request and returns it with the rewritten upstream path.
+
+        With `healthy` (endpoint URL -> bool), routes whose endpoints are all unhealthy are skipped in favour of
+        the next matching route. When every matching route leads to an unhealthy upstream the best match is
+        returned anyway, since a failing health check is no proof that the request would fail.
+        """
+        if healthy is None:
+            return self._match(method, path, host, None)
+
+        skipped = []
+
+        def accept(route: Route) -> bool:
+            if route.healthy(healthy):
+                return True
+            skipped.append(route)
+            return False
+
+        found = self._match(method, path, host, accept)
+        if found is None and skipped:
+            found = self._match(method, path, host, lambda route: route is skipped[0])
+        return found
+
+    def _match(self, method: str, path: str, host: Optional[str],
+               accept: Optional[Callable[[Route], bool]]) -> Optional[tuple[Route, str]]:
+        if host:
+            host = host.split(":", 1)[0].lower()
+            if host in self._tries or host in self._regex_routes:
+                found = self._match_host(host, method, path, accept)
+                if found:
+                    return found
+        return self._match_host(None, method, path, accept)
+
+    def _match_host(self, host: Optional[str], method: str, path: str,
+                    accept: Optional[Callable[[Route], bool]]) -> Optional[tuple[Route, str]]:
+        node = self._tries.get(host)
+        if node is not None:
+            # Walk down the trie remembering every node that carries routes; the deepest one wins
+            candidates = [node] if node.routes else []
+            for segment in path.split("/"):
+                if not segment:
+                    continue
+                node = node.children.get(segment)
+                if node is None:
+                    break
+                if node.routes:
+                    candidates.append(node)
+            for candidate in reversed(candidates):
+                for route in candidate.routes:
+                    if route.allows(method) and (accept is None or accept(route)):
+                        return route, route.rewrite_prefix(path)
+
+        for route in self._regex_routes.get(host, ()):
+            if route.allows(method):
+                rewritten = route.rewrite_regex(path)
+                if rewritten is not None and (accept is None or accept(route)):
+                    return route, rewritten
+        return None
+
+
+def default_route_table() -> RouteTableConfig:
+    """
+    Route table used when no ROUTES_FILE is configured, equivalent to the built-in service-a/service-b setup.
+    """
+    return RouteTableConfig(
+        upstreams={"service-a": UpstreamConfig(endpoints=config.SERVICE_A_URLS),
+                   "service-b": UpstreamConfig(endpoints=config.SERVICE_B_URLS)},
+        routes=[
+            RouteConfig(name="service-a", prefix="/service-a", upstream="service-a"),
+            RouteConfig(name="service-b", prefix="/service-b", upstream="service-b",
+                        transform=TransformConfig.model_validate(
+                            {"request": {"methods": ["POST"], "body": {"set": {"transformed": True}}}})),
+        ],
+        health_checks={"service-a": config.HEALTH_CHECK_SERVICE_A, "service-b": config.HEALTH_CHECK_SERVICE_B},
+    )
+
+
+def load_route_table(path: str) -> RouteTableConfig:
+    """
+    Reads a JSON routes file. Environment variables such as ${SERVICE_A_URL} are expanded in upstream URLs.
+    """
+    with open(path, encoding="utf-8") as f:
+        table = RouteTableConfig.model_validate(json.load(f))
+    upstreams = {name: _upstream(os.path.expandvars(upstream) if isinstance(upstream, str) else upstream)
+                 for name, upstream in table.upstreams.items()}
+    for upstream in upstreams.values():
+        upstream.endpoints = [
+            os.path.expandvars(endpoint) if isinstance(endpoint, str)
+            else EndpointConfig(url=os.path.expandvars(endpoint.url), weight=endpoint.weight)
+            for endpoint in upstream.endpoints
+        ]
+    table.upstreams = upstreams
+    return table
+
+
+class Router:
+    """
+    Holds the active RouteTable and swaps it atomically when the routes file changes.
+    In-flight requests keep the Route they already matched, so a reload never interrupts them.
+    """
+
+    def __init__(self):
+        self._table: Optional[RouteTable] = None
+        self._mtime: Optional[float] = None
+        # Endpoints found by service discovery, per service name
+        self._discovered: dict[str, list[tuple[str, int]]] = {}
+
+    @property
+    def table(self) -> RouteTable:
+        if self._table is None:
+            self.reload()
+        return self._table
+
+    def reload(self) -> RouteTable:
+        """
+        Compiles the configured route table and makes it the active one.
+        """
+        if config.ROUTES_FILE:
+            self._mtime = os.path.getmtime(config.ROUTES_FILE)
+            table = RouteTable(load_route_table(config.ROUTES_FILE))
+        else:
+            table = RouteTable(default_route_table())
+        for pool in table.pools.values():
+            if pool.service in self._discovered:
+                pool.update(self._discovered[pool.service])
+        self._table = table
+        return table
+
+    def match(self, method: str, path: str, host: Optional[str] = None,
+              healthy: Callable[[str], bool] = None) -> Optional[tuple[Route, str]]:
+        return self.table.match(method, path, host, healthy)
+
+    def upstream_urls(self) -> list[str]:
+        return [endpoint.url for pool in self.table.pools.values() for endpoint in pool.endpoints]
+
+    def health_targets(self) -> dict[str, str]:
+        return self.table.health_targets()
+
+    def services(self) -> set[str]:
+        """
+        Returns the service discovery names of all upstreams.
+        """
+        return {pool.service for pool in self.table.pools.values()}
+
+    def set_endpoints(self, service: str, endpoints: list[tuple[str, int]]):
+        """
+        Applies the (url, weight) endpoints discovered for a service to every upstream that uses it.
+        They are applied again after a reload of the routes file.
+        """
+        self._discovered[service] = endpoints
+        for pool in self.table.pools.values():
+            if pool.service == service:
+                pool.update(endpoints)
+
+    async def watch(self, interval: float):
+        """
+        Polls the routes file and reloads it whenever it changes. A broken file keeps the previous table active.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if os.path.getmtime(config.ROUTES_FILE) != self._mtime:
+                    self.reload()
+                    logging.info(f"Reloaded {len(self._table.routes)} routes from {config.ROUTES_FILE}")
+            except (OSError, ValueError) as e:
+                logging.error(f"Failed to reload routes from {config.ROUTES_FILE}: {e}")
+
+
+router = Router()
+
+
+@registry.collector
+def _collect_outstanding():
+    for pool in router.table.pools.values():
+        for endpoint in pool.endpoints:
+            UPSTREAM_OUTSTANDING.set((pool.name, endpoint.url), endpoint.outstanding)
+
@@ -1,26 +1,191 @@
-from fastapi import HTTPException, Header
+import hashlib
+import logging
+import time
+from typing import Hashable, Optional
+
+import httpx
 import jwt
-from typing import Optional
+from cachetools import TLRUCache
+from fastapi import HTTPException, Header
 
 from config.config import config
+from core.client import UpstreamClientPool, upstream_clients
+from core.coalesce import SingleFlight
+from core.metrics import AUTHENTICATIONS, TOKEN_VERIFY_DURATION
 
 
-def authenticate(authorization: Optional[str] = Header(None)):
+class VerifiedTokenCache:
+    """
+    Bounded cache of already verified tokens, keyed by the SHA-256 of the token, so a token that was seen
+    before skips the signature check. Claims are kept until the token's `exp`, but never longer than `max_ttl`.
+    `keys` identifies the keys the tokens were verified with (see `signing_keys`); the cache is emptied when
+    it changes, so tokens signed with a key that was rotated out or reloaded away are verified again.
+    """
+
+    def __init__(self, maxsize: int, max_ttl: float, timer=time.monotonic):
+        self.max_ttl = max_ttl
+        self.timer = timer
+        # Values are (claims, expires at) with the expiry on the cache's own clock
+        self._tokens = TLRUCache(maxsize=maxsize, ttu=lambda key, value, now: value[1], timer=timer)
+        self._keys: Hashable = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def _verified_with(self, keys: Hashable):
+        if keys != self._keys:
+            self._tokens.clear()
+            self._keys = keys
+
+    def get(self, token: str, keys: Hashable = None) -> Optional[dict]:
+        self._verified_with(keys)
+        cached = self._tokens.get(self._key(token))
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return cached[0]
+
+    def put(self, token: str, claims: dict, keys: Hashable = None):
+        self._verified_with(keys)
+        ttl = self.max_ttl
+        if "exp" in claims:
+            ttl = min(ttl, float(claims["exp"]) - time.time())
+        if ttl <= 0:
+            return
+        now = self.timer()
+        self._tokens[self._key(token)] = (claims, now + ttl)
+
+    def clear(self):
+        self._tokens.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self._tokens), "hits": self.hits, "misses": self.misses}
+
+
+class JWKSKeyCache:
+    """
+    Signing keys fetched from a JWKS endpoint, looked up by `kid`.
+
+    The key set is refreshed after `ttl` seconds, or earlier when a token names an unknown `kid`
+    (key rotation), but at most once every `min_refresh_interval` seconds. Concurrent refreshes share one fetch.
+    `version` goes up whenever a refresh brings a different key set.
+    """
+
+    def __init__(self, url: str, ttl: float, min_refresh_interval: float, clients: UpstreamClientPool = None):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.clients = clients or upstream_clients
+        self._keys: dict[Optional[str], jwt.PyJWK] = {}
+        self._key_set: Optional[dict] = None
+        self.version = 0
+        self._fetched_at = None
+        self._flights = SingleFlight()
+
+    async def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        now = time.monotonic()
+        expired = self._fetched_at is None or now - self._fetched_at >= self.ttl
+        unknown = kid not in self._keys and (self._fetched_at is None
+                                             or now - self._fetched_at >= self.min_refresh_interval)
+        if expired or unknown:
+            await self._flights.do(self.url, self._refresh)
+        return self._keys.get(kid)
+
+    async def _refresh(self):
+        try:
+            response = await self.clients.get(self.url).get(self.url, timeout=config.JWT_JWKS_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            key_set = jwt.PyJWKSet.from_dict(data)
+        except (httpx.HTTPError, ValueError, jwt.PyJWTError) as e:
+            # Keep serving the keys we already have
+            logging.error(f"Failed to fetch JWKS from {self.url}: {e}")
+            if self._fetched_at is None:
+                return
+        else:
+            keys = {key.key_id: key for key in key_set.keys}
+            if len(key_set.keys) == 1:
+                # Tokens without a kid can only be matched when the set holds a single key
+                keys.setdefault(None, key_set.keys[0])
+            self._keys = keys
+            if data != self._key_set:
+                self._key_set = data
+                self.version += 1
+        self._fetched_at = time.monotonic()
+
+
+token_cache = VerifiedTokenCache(maxsize=config.JWT_CACHE_MAX_SIZE, max_ttl=config.JWT_CACHE_MAX_TTL)
+jwks_keys = JWKSKeyCache(config.JWT_JWKS_URL, ttl=config.JWT_JWKS_CACHE_TTL,
+                         min_refresh_interval=config.JWT_JWKS_MIN_REFRESH_INTERVAL) if config.JWT_JWKS_URL else None
+
+
+async def verification_key(token: str) -> tuple:
+    """
+    Returns the key that verifies the token and the algorithms it may be signed with.
+
+    With JWT_JWKS_URL set the key is picked from the key set by the token's `kid` and must be used with its own
+    algorithm. Otherwise JWT_PUBLIC_KEY is used for asymmetric algorithms and JWT_SECRET for HMAC.
+    """
+    algorithms = [algorithm.strip() for algorithm in config.JWT_ALGORITHM.split(",")]
+    if jwks_keys is not None:
+        key = await jwks_keys.get(jwt.get_unverified_header(token).get("kid"))
+        if key is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        return key.key, [key.algorithm_name] if key.algorithm_name else algorithms
+    if config.JWT_PUBLIC_KEY and not algorithms[0].startswith("HS"):
+        return config.JWT_PUBLIC_KEY, algorithms
+    return config.JWT_SECRET, algorithms
+
+
+def signing_keys() -> Hashable:
+    """
+    Identifies the keys tokens are currently verified with: the JWKS key set, or the configured secret and public
+    key, which a settings reload may change.
+    """
+    if jwks_keys is not None:
+        return jwks_keys.version
+    return config.JWT_ALGORITHM, config.JWT_SECRET, config.JWT_PUBLIC_KEY
+
+
+async def authenticate(authorization: Optional[str] = Header(None)):
     """
     Authenticates the JWT token.
     """
 
     if not authorization:
+        AUTHENTICATIONS.inc(("missing",))
         raise HTTPException(status_code=401, detail="Authorization header missing")
 
-    try:
-        scheme, token = authorization.split()
-        if scheme.lower() != "bearer":
-            raise HTTPException(status_code=401, detail="Invalid authorization scheme")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer":
+        AUTHENTICATIONS.inc(("invalid",))
+        raise HTTPException(status_code=401, detail="Invalid authorization scheme")
+    token = token.strip()
+
+    if config.JWT_CACHE_ENABLED:
+        payload = token_cache.get(token, signing_keys())
+        if payload is not None:
+            AUTHENTICATIONS.inc(("cached",))
+            return payload
 
-        payload = jwt.decode(token, config.JWT_SECRET, algorithms=[config.JWT_ALGORITHM])
-        return payload
+    start = time.perf_counter()
+    try:
+        key, algorithms = await verification_key(token)
+        payload = jwt.decode(token, key, algorithms=algorithms)
     except jwt.ExpiredSignatureError:
+        AUTHENTICATIONS.inc(("expired",))
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
\ No newline at end of file
+        AUTHENTICATIONS.inc(("invalid",))
+        raise HTTPException(status_code=401, detail="Invalid token")
+    TOKEN_VERIFY_DURATION.observe(time.perf_counter() - start)
+    AUTHENTICATIONS.inc(("verified",))
+
+    if config.JWT_CACHE_ENABLED:
+        # The key set may have been refreshed to verify this token
+        token_cache.put(token, payload, signing_keys())
+    return payload
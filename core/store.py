@@ -0,0 +1,21 @@
+import functools
+
+
+def connect(url: str):
+    """
+    Client of the Redis server the workers share. redis is only imported here, once a Redis URL is configured.
+    """
+    from redis.asyncio import Redis
+
+    return Redis.from_url(url)
+
+
+@functools.lru_cache(maxsize=1)
+def errors() -> tuple[type[Exception], ...]:
+    """
+    Exceptions of a failed Redis call, for `except errors()`. An except clause is only evaluated once something
+    was raised, so nothing imports redis before a client exists.
+    """
+    from redis.exceptions import RedisError
+
+    return RedisError, OSError
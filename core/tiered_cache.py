@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import logging
+import struct
+import time
+from typing import Callable, Optional
+
+from cachetools import TTLCache
+
+from config.config import config
+from core import store
+from core.cache import CachedResponse, ResponseCache, response_cache
+from core.metrics import CACHE_BYTES, CACHE_EVENTS, registry
+
+# Binary layout of a stored response:
+#   version, status code, wall-clock store time, age at store time, header count, vary names length
+#   then for every header: name length, value length, name, value
+#   then the vary names ("\n" separated) and finally the raw body
+_ENTRY_HEADER = struct.Struct("!BHddHH")
+_FIELD_HEADER = struct.Struct("!HI")
+_FORMAT_VERSION = 1
+
+
+def encode_response(entry: CachedResponse) -> bytes:
+    """
+    Serializes a cached response into a compact binary blob; the body is appended as-is.
+    """
+    vary = "\n".join(entry.vary).encode("latin-1")
+    parts = [_ENTRY_HEADER.pack(_FORMAT_VERSION, entry.status_code, time.time(), entry.age, len(entry.headers),
+                                len(vary))]
+    for name, value in entry.headers:
+        parts.append(_FIELD_HEADER.pack(len(name), len(value)))
+        parts.append(name)
+        parts.append(value)
+    parts.append(vary)
+    parts.append(entry.body)
+    return b"".join(parts)
+
+
+def decode_response(data: bytes) -> Optional[CachedResponse]:
+    """
+    Rebuilds a cached response from `encode_response` output, accounting for the time it spent in Redis.
+    """
+    version, status_code, stored_at, age, header_count, vary_length = _ENTRY_HEADER.unpack_from(data)
+    if version != _FORMAT_VERSION:
+        return None
+    offset = _ENTRY_HEADER.size
+    headers = []
+    for _ in range(header_count):
+        name_length, value_length = _FIELD_HEADER.unpack_from(data, offset)
+        offset += _FIELD_HEADER.size
+        name = data[offset:offset + name_length]
+        offset += name_length
+        headers.append((name, data[offset:offset + value_length]))
+        offset += value_length
+    vary = tuple(data[offset:offset + vary_length].decode("latin-1").split("\n")) if vary_length else ()
+    offset += vary_length
+
+    entry = CachedResponse(status_code, headers, data[offset:], vary)
+    entry.initial_age = age + max(time.time() - stored_at, 0)
+    return entry
+
+
+class InvalidationBus:
+    """
+    Redis pub/sub channel telling every worker, on every node, to drop entries from its in-process L1.
+
+    Messages are "<namespace>\\n<key>". After a reconnect the L1 caches are cleared entirely,
+    since invalidations may have been missed while the subscription was down.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.redis = None
+        self._handlers: dict[str, Callable[[Optional[str]], None]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    def register(self, namespace: str, handler: Callable[[Optional[str]], None]):
+        self._handlers[namespace] = handler
+
+    async def start(self, redis):
+        """
+        Attaches the shared Redis client and subscribes to the invalidation channel.
+        """
+        self.redis = redis
+        pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def stop(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        self._listener = None
+        self.redis = None
+
+    async def publish(self, namespace: str, key: str, delete: list[str]):
+        """
+        Deletes the L2 keys and notifies all workers in a single pipelined round trip.
+        """
+        if self.redis is None:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(*delete)
+                pipe.publish(self.channel, f"{namespace}\n{key}")
+                await pipe.execute()
+        except store.errors() as e:
+            logging.error(f"Failed to publish cache invalidation for {key}: {e}")
+
+    async def _listen(self, pubsub):
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    namespace, _, key = message["data"].decode("utf-8").partition("\n")
+                    handler = self._handlers.get(namespace)
+                    if handler:
+                        handler(key)
+            except store.errors() as e:
+                logging.error(f"Cache invalidation subscription lost: {e}")
+                await asyncio.sleep(1)
+                try:
+                    await pubsub.aclose()
+                    pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                    await pubsub.subscribe(self.channel)
+                except store.errors():
+                    continue
+                for handler in self._handlers.values():
+                    handler(None)
+
+
+class TieredCache:
+    """
+    Small in-process TTL cache (L1) in front of the Redis cache shared by all workers (L2). Values are bytes.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: int, bus: InvalidationBus = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1 = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.bus = bus or invalidation_bus
+        self.bus.register(namespace, self._drop)
+
+    def _key(self, key: str) -> str:
+        return f"{config.CACHE_L2_PREFIX}{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        """
+        Looks keys up in L1 and fetches all the missing ones from L2 with a single MGET.
+        """
+        values = [self.l1.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing and self.bus.redis is not None:
+            try:
+                found = await self.bus.redis.mget([self._key(keys[i]) for i in missing])
+            except store.errors() as e:
+                logging.warning(f"L2 cache read failed: {e}")
+                found = []
+            for i, value in zip(missing, found):
+                if value is not None:
+                    values[i] = self.l1[keys[i]] = value
+        return values
+
+    async def set(self, key: str, value: bytes):
+        self.l1[key] = value
+        if self.bus.redis is not None:
+            try:
+                await self.bus.redis.set(self._key(key), value, ex=self.ttl)
+            except store.errors() as e:
+                logging.warning(f"L2 cache write failed: {e}")
+
+    async def invalidate(self, key: str):
+        self.l1.pop(key, None)
+        await self.bus.publish(self.namespace, key, delete=[self._key(key)])
+
+    def _drop(self, key: Optional[str]):
+        if key is None:
+            self.l1.clear()
+        else:
+            self.l1.pop(key, None)
+
+
+class TieredResponseCache:
+    """
+    Two-tier HTTP response cache: the in-process ResponseCache (L1) backed by Redis (L2).
+
+    Every resource is one Redis hash holding its Vary header names and one field per stored variant,
+    so a lookup is a single HMGET for the common no-Vary case and an invalidation is a single DEL.
+    """
+
+    VARY_FIELD = b"vary"
+
+    def __init__(self, l1: ResponseCache, bus: InvalidationBus = None, namespace: str = "responses"):
+        self.l1 = l1
+        self.namespace = namespace
+        self.bus = bus or invalidation_bus
+        self.bus.register(namespace, self._drop)
+        self.l2_hits = 0
+        self.l2_misses = 0
+        self.l2_errors = 0
+
+    def _key(self, base_key: str) -> str:
+        return f"{config.CACHE_L2_PREFIX}{self.namespace}:{hashlib.sha1(base_key.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def _field(vary: tuple[str, ...], request_headers) -> str:
+        return "=" + ResponseCache._variant(vary, request_headers)
+
+    async def get(self, base_key: str, request_headers) -> Optional[CachedResponse]:
+        entry = self.l1.get(base_key, request_headers)
+        if entry is not None or self.bus.redis is None:
+            return entry
+
+        key = self._key(base_key)
+        try:
+            vary, data = await self.bus.redis.hmget(key, [self.VARY_FIELD, self._field((), request_headers)])
+            if vary is None:
+                self.l2_misses += 1
+                return None
+            names = tuple(vary.decode("latin-1").split("\n")) if vary else ()
+            if names:
+                data = await self.bus.redis.hget(key, self._field(names, request_headers))
+        except store.errors() as e:
+            self.l2_errors += 1
+            logging.warning(f"L2 response cache read failed: {e}")
+            return None
+
+        entry = decode_response(data) if data is not None else None
+        if entry is None:
+            self.l2_misses += 1
+            return None
+        self.l2_hits += 1
+        self.l1.put(base_key, request_headers, entry)
+        return entry
+
+    async def put(self, base_key: str, request_headers, entry: CachedResponse):
+        self.l1.put(base_key, request_headers, entry)
+        await self._store(base_key, request_headers, entry)
+
+    async def revalidated(self, base_key: str, request_headers, entry: CachedResponse,
+                          headers: list[tuple[bytes, bytes]]):
+        self.l1.revalidated(entry, headers)
+        await self._store(base_key, request_headers, entry)
+
+    async def invalidate(self, base_key: str):
+        self.l1.invalidate(base_key)
+        await self.bus.publish(self.namespace, base_key, delete=[self._key(base_key)])
+
+    async def _store(self, base_key: str, request_headers, entry: CachedResponse):
+        if self.bus.redis is None or entry.size > self.l1.max_entry_bytes:
+            return
+        key = self._key(base_key)
+        # Stale entries are kept for a while so they can still be revalidated with a cheap 304
+        ttl = max(int(entry.ttl - entry.age) + config.CACHE_L2_STALE_TTL, 1)
+        try:
+            async with self.bus.redis.pipeline(transaction=False) as pipe:
+                pipe.hset(key, mapping={
+                    self.VARY_FIELD: "\n".join(entry.vary),
+                    self._field(entry.vary, request_headers): encode_response(entry),
+                })
+                pipe.expire(key, ttl)
+                await pipe.execute()
+        except store.errors() as e:
+            self.l2_errors += 1
+            logging.warning(f"L2 response cache write failed: {e}")
+
+    def _drop(self, base_key: Optional[str]):
+        if base_key is None:
+            self.l1.clear()
+        else:
+            self.l1.invalidate(base_key)
+
+    def stats(self) -> dict:
+        return {
+            **self.l1.stats(),
+            "l2_hits": self.l2_hits,
+            "l2_misses": self.l2_misses,
+            "l2_errors": self.l2_errors,
+        }
+
+
+invalidation_bus = InvalidationBus(config.CACHE_INVALIDATION_CHANNEL)
+tiered_response_cache = TieredResponseCache(response_cache)
+
+
+@registry.collector
+def _collect_cache_stats():
+    stats = tiered_response_cache.stats()
+    CACHE_BYTES.set((), stats.pop("bytes"))
+    for name in ("entries", "max_bytes"):
+        stats.pop(name)
+    for event, count in stats.items():
+        CACHE_EVENTS.set((event,), count)
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import random
+from typing import Optional
+
+from opentelemetry import context, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+from config.config import config
+
+_propagator = TraceContextTextMapPropagator()
+
+# Incoming headers that carry the caller's trace context
+_CONTEXT_HEADERS = (b"traceparent", b"tracestate")
+
+
+def _exporter(name: str):
+    """
+    Builds the span exporter named by TRACING_EXPORTER; None turns tracing off.
+    """
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            logging.warning("TRACING_EXPORTER=otlp needs the opentelemetry-exporter-otlp-proto-http package, "
+                            "tracing is off")
+            return None
+        return OTLPSpanExporter(endpoint=config.OTLP_ENDPOINT)
+    if name == "jaeger":
+        try:
+            from opentelemetry.exporter.jaeger.thrift import JaegerExporter
+        except ImportError:
+            logging.warning("TRACING_EXPORTER=jaeger needs the opentelemetry-exporter-jaeger package, tracing is off")
+            return None
+        return JaegerExporter(collector_endpoint=f"http://{config.JAEGER_HOST}:{config.JAEGER_PORT}/api/traces")
+    if name not in ("", "none"):
+        logging.warning(f"Unknown TRACING_EXPORTER {name!r}, tracing is off")
+    return None
+
+
+class _UpstreamSpan:
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: trace.Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self):
+        self.token = context.attach(trace.set_span_in_context(self.span))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        context.detach(self.token)
+        if exc is not None:
+            self.span.record_exception(exc)
+            self.span.set_status(Status(StatusCode.ERROR, exc_type.__name__))
+        self.span.end()
+        return False
+
+    def response(self, status_code: int):
+        self.span.set_attribute("http.status_code", status_code)
+        if status_code >= 500:
+            self.span.set_status(Status(StatusCode.ERROR))
+
+
+class _Untraced:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def response(self, status_code: int):
+        pass
+
+
+_UNTRACED = _Untraced()
+
+
+class Tracing:
+    """
+    The gateway's tracer. Nothing is set up on import: `start` builds the provider and exporter in the lifespan,
+    in every worker process, and with TRACING_EXPORTER=none the tracer stays None, so every tracing hook is a
+    single check.
+
+    Sampling is decided per request by `TracingMiddleware`. A request whose caller sent a traceparent follows the
+    caller's decision, any other is traced with probability TRACING_SAMPLE_RATIO (head sampling). A request that
+    was not sampled still gets a server span, created after the fact, when it failed or was slow (tail sampling).
+    """
+
+    def __init__(self):
+        self.tracer: Optional[trace.Tracer] = None
+        self.sample_ratio = 0.0
+        self.slow_threshold = 0.0
+        self.tail_errors = False
+        self._provider = None
+
+    def start(self, exporter=None):
+        exporter = exporter or _exporter(config.TRACING_EXPORTER)
+        if exporter is None:
+            return
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        resource = Resource.create({"service.name": config.TRACING_SERVICE_NAME,
+                                    "deployment.environment": config.DEPLOYMENT_ENVIRONMENT})
+        # Spans are only started for requests the middleware decided to trace, so the provider keeps all of them
+        self._provider = TracerProvider(resource=resource)
+        self._provider.add_span_processor(BatchSpanProcessor(exporter))
+        self.tracer = self._provider.get_tracer("api-gateway")
+        self.sample_ratio = config.TRACING_SAMPLE_RATIO
+        self.slow_threshold = config.TRACING_TAIL_SLOW_THRESHOLD
+        self.tail_errors = config.TRACING_TAIL_ERRORS
+
+    async def stop(self):
+        """
+        Exports the spans still queued and shuts the exporter down.
+        """
+        provider, self._provider, self.tracer = self._provider, None, None
+        if provider is not None:
+            await asyncio.to_thread(provider.shutdown)
+
+    @property
+    def tail(self) -> bool:
+        return self.tail_errors or self.slow_threshold > 0
+
+    def parent(self, headers) -> Optional[context.Context]:
+        """
+        The caller's trace context from the W3C trace context headers, if it sent any.
+        """
+        carrier = None
+        for name, value in headers:
+            if name in _CONTEXT_HEADERS:
+                carrier = carrier or {}
+                carrier[name.decode("latin-1")] = value.decode("latin-1")
+        if carrier is None or "traceparent" not in carrier:
+            return None
+        return _propagator.extract(carrier)
+
+    def sampled(self, parent: Optional[context.Context]) -> bool:
+        if parent is not None:
+            span_context = trace.get_current_span(parent).get_span_context()
+            if span_context.is_valid:
+                return span_context.trace_flags.sampled
+        return random.random() < self.sample_ratio
+
+    def keep(self, status_code: Optional[int], duration: float) -> bool:
+        """
+        Tail sampling: whether an unsampled request is worth a span after all.
+        """
+        if self.tail_errors and (status_code is None or status_code >= 500):
+            return True
+        return 0 < self.slow_threshold <= duration
+
+    def upstream(self, method: str, url: str, upstream: str):
+        """
+        A client span for an upstream call of a traced request, current while the call runs so `inject` passes it
+        to the upstream. For a request that is not traced this costs one context lookup and does nothing.
+        """
+        if self.tracer is None or not trace.get_current_span().is_recording():
+            return _UNTRACED
+        return _UpstreamSpan(self.tracer.start_span(
+            f"{method} {upstream}", kind=SpanKind.CLIENT,
+            attributes={"http.method": method, "http.url": url, "peer.service": upstream}))
+
+    def inject(self, headers):
+        """
+        Adds the current span's trace context to the headers of an upstream request. Headers are returned as they
+        are when the request is not traced; the caller's own traceparent, if any, is then forwarded untouched.
+        """
+        if self.tracer is None or not trace.get_current_span().is_recording():
+            return headers
+        carrier = {}
+        _propagator.inject(carrier)
+        if isinstance(headers, dict):
+            headers = {k: v for k, v in headers.items() if k.lower() not in carrier}
+            headers.update(carrier)
+            return headers
+        names = {name.encode("latin-1") for name in carrier}
+        return [(k, v) for k, v in headers if k.lower() not in names] + [
+            (name.encode("latin-1"), value.encode("latin-1")) for name, value in carrier.items()]
+
+
+tracing = Tracing()
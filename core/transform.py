@@ -0,0 +1,247 @@
+import re
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+from core.codec import json_codec
+
+RawHeaders = list[tuple[bytes, bytes]]
+
+
+class HeaderRulesConfig(BaseModel):
+    """
+    Header rewrites, applied in the order remove, rename, set (replaces any value), add (appends a value).
+    """
+    remove: list[str] = []
+    rename: dict[str, str] = {}
+    set: dict[str, str] = {}
+    add: dict[str, str] = {}
+
+
+class BodyRulesConfig(BaseModel):
+    """
+    Rewrites of a JSON object body, applied in the order remove, rename, set. Fields are dotted paths into nested
+    objects ("user.email"); a rename keeps the field in its parent object. Bodies that are not JSON objects are
+    forwarded unchanged.
+    """
+    remove: list[str] = []
+    rename: dict[str, str] = {}
+    set: dict[str, Any] = {}
+
+
+class PathRuleConfig(BaseModel):
+    """
+    Regex substitution on the upstream path, e.g. {"pattern": "^/v1/", "replace": "/v2/"}.
+    """
+    pattern: str
+    replace: str
+
+
+class RequestTransformConfig(BaseModel):
+    # Methods the request transforms apply to; all methods when unset
+    methods: Optional[list[str]] = None
+    path: list[PathRuleConfig] = []
+    headers: Optional[HeaderRulesConfig] = None
+    body: Optional[BodyRulesConfig] = None
+
+
+class ResponseTransformConfig(BaseModel):
+    headers: Optional[HeaderRulesConfig] = None
+    body: Optional[BodyRulesConfig] = None
+
+
+class TransformConfig(BaseModel):
+    """
+    Transforms declared on a route in the routes file.
+    """
+    request: Optional[RequestTransformConfig] = None
+    response: Optional[ResponseTransformConfig] = None
+
+
+def compile_path(rules: list[PathRuleConfig]) -> Optional[Callable[[str], str]]:
+    if not rules:
+        return None
+    compiled = [(re.compile(rule.pattern), rule.replace) for rule in rules]
+
+    def rewrite(path: str) -> str:
+        for pattern, replace in compiled:
+            path = pattern.sub(replace, path)
+        return path if path.startswith("/") else f"/{path}"
+
+    return rewrite
+
+
+def compile_headers(rules: Optional[HeaderRulesConfig]) -> Optional[Callable[[RawHeaders], RawHeaders]]:
+    """
+    Compiles header rules into one function over raw (name, value) pairs that makes a single pass over the headers.
+    """
+    if rules is None:
+        return None
+    # Set headers replace every existing value
+    dropped = frozenset(name.lower().encode("latin-1") for name in [*rules.remove, *rules.set])
+    renamed = {old.lower().encode("latin-1"): new.lower().encode("latin-1") for old, new in rules.rename.items()}
+    appended = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                for values in (rules.set, rules.add) for name, value in values.items()]
+    if not dropped and not renamed and not appended:
+        return None
+
+    def transform(headers: RawHeaders) -> RawHeaders:
+        result = []
+        for name, value in headers:
+            lowered = name.lower()
+            if lowered in dropped:
+                continue
+            result.append((renamed.get(lowered, name), value))
+        result.extend(appended)
+        return result
+
+    return transform
+
+
+def _parent(data: dict, path: list[str], create: bool) -> Optional[dict]:
+    for key in path:
+        child = data.get(key)
+        if not isinstance(child, dict):
+            if not create:
+                return None
+            child = data[key] = {}
+        data = child
+    return data
+
+
+def _remove(field: str) -> Callable[[dict], None]:
+    *path, key = field.split(".")
+
+    def remove(data: dict):
+        parent = _parent(data, path, create=False)
+        if parent is not None:
+            parent.pop(key, None)
+
+    return remove
+
+
+def _rename(field: str, new_key: str) -> Callable[[dict], None]:
+    *path, key = field.split(".")
+
+    def rename(data: dict):
+        parent = _parent(data, path, create=False)
+        if parent is not None and key in parent:
+            parent[new_key] = parent.pop(key)
+
+    return rename
+
+
+def _set(field: str, value: Any) -> Callable[[dict], None]:
+    *path, key = field.split(".")
+
+    def set_field(data: dict):
+        _parent(data, path, create=True)[key] = value
+
+    return set_field
+
+
+def compile_body(rules: Optional[BodyRulesConfig]) -> Optional[Callable[[Any], Any]]:
+    """
+    Compiles body rules into one function over a decoded JSON document, so the body is decoded and encoded once
+    whatever the number of rules.
+    """
+    if rules is None:
+        return None
+    steps = [*map(_remove, rules.remove), *(_rename(field, key) for field, key in rules.rename.items()),
+             *(_set(field, value) for field, value in rules.set.items())]
+    if not steps:
+        return None
+
+    def transform(data: Any) -> Any:
+        if isinstance(data, dict):
+            for step in steps:
+                step(data)
+        return data
+
+    return transform
+
+
+def is_json(content_type: Optional[bytes]) -> bool:
+    """
+    Bodies without a content type are treated as JSON, as long as they decode.
+    """
+    return content_type is None or b"json" in content_type.lower()
+
+
+def transform_body(transform: Callable[[Any], Any], body: bytes) -> Optional[bytes]:
+    """
+    Applies a compiled body transform to an encoded JSON body. Returns None when the body is not JSON.
+    """
+    try:
+        data = json_codec.loads(body)
+    except ValueError:
+        return None
+    return json_codec.dumps(transform(data))
+
+
+def _header(headers: RawHeaders, name: bytes) -> Optional[bytes]:
+    return next((value for key, value in headers if key.lower() == name), None)
+
+
+def _with_length(headers: RawHeaders, length: int) -> RawHeaders:
+    return [(k, v) for k, v in headers if k.lower() != b"content-length"] + [
+        (b"content-length", str(length).encode("latin-1"))]
+
+
+class Transform:
+    """
+    The transforms of one route, compiled once when the route table is built.
+    Every attribute is None when there is nothing to do, so untransformed routes cost a single check.
+    """
+
+    __slots__ = ("methods", "path", "request_headers", "request_body", "response_headers", "response_body")
+
+    def __init__(self, transform: TransformConfig):
+        request = transform.request or RequestTransformConfig()
+        response = transform.response or ResponseTransformConfig()
+        self.methods = frozenset(m.upper() for m in request.methods) if request.methods else None
+        self.path = compile_path(request.path)
+        self.request_headers = compile_headers(request.headers)
+        self.request_body = compile_body(request.body)
+        self.response_headers = compile_headers(response.headers)
+        self.response_body = compile_body(response.body)
+
+    def applies(self, method: str) -> bool:
+        """
+        Whether the request transforms apply to a method; response transforms apply to every method.
+        """
+        return self.methods is None or method in self.methods
+
+    def request_content(self, headers: RawHeaders, body: bytes) -> tuple[RawHeaders, bytes]:
+        """
+        Applies the body transform to a buffered request body, fixing Content-Length when it changed.
+        """
+        if not is_json(_header(headers, b"content-type")):
+            return headers, body
+        transformed = transform_body(self.request_body, body)
+        if transformed is None:
+            return headers, body
+        return _with_length(headers, len(transformed)), transformed
+
+    async def response(self, response: Response) -> Response:
+        """
+        Applies the response transforms to a response built by the proxy. Only a body transform buffers a streamed
+        body, and only for uncompressed JSON.
+        """
+        headers = response.raw_headers
+        if self.response_body is not None and response.status_code not in (204, 304) \
+                and _header(headers, b"content-encoding") is None and is_json(_header(headers, b"content-type")):
+            body = getattr(response, "body", None)
+            if body is None:
+                body = b"".join([chunk async for chunk in response.body_iterator])
+            transformed = transform_body(self.response_body, body)
+            if transformed is not None:
+                body = transformed
+                headers = _with_length(headers, len(body))
+            buffered = Response(content=body, status_code=response.status_code, background=response.background)
+            buffered.raw_headers = headers
+            response = buffered
+        if self.response_headers is not None:
+            response.raw_headers = self.response_headers(headers)
+        return response
@@ -1,37 +1,149 @@
+import asyncio
+import time
+from typing import Optional
+
 import httpx
 from fastapi import HTTPException
-from tenacity import retry, stop_after_attempt, wait_fixed
-import pybreaker
-from cachetools import TTLCache
 
-# Circuit breaker configuration
-circuit_breaker = pybreaker.CircuitBreaker(fail_max=5, reset_timeout=60)
+from config.config import config
+from core.balancer import Endpoint
+from core.client import _origin, upstream_clients
+from core.codec import json_codec
+from core.concurrency import LoadShedError, concurrency_limits
+from core.metrics import UPSTREAM_DURATION, UPSTREAM_ERRORS
+from core.resilience import CircuitOpenError, Deadline, DeadlineExceeded, circuit_breakers, retry_policy
+from core.tracing import tracing
+
+# Hop-by-hop headers only apply to a single connection and are never proxied
+HOP_BY_HOP_HEADERS = frozenset({
+    b"connection",
+    b"host",
+    b"keep-alive",
+    b"proxy-authenticate",
+    b"proxy-authorization",
+    b"te",
+    b"trailer",
+    b"transfer-encoding",
+    b"upgrade",
+})
+
+
+def proxy_headers(raw_headers) -> list[tuple[bytes, bytes]]:
+    """
+    Filters raw (name, value) header pairs down to the ones that may be forwarded by a proxy.
+    """
+    return [(name, value) for name, value in raw_headers if name.lower() not in HOP_BY_HOP_HEADERS]
+
+def _with_deadline(headers, timeout: Optional[float]):
+    """
+    Tells the upstream how long the gateway is still willing to wait for it.
+    """
+    name = config.REQUEST_TIMEOUT_HEADER
+    if isinstance(headers, dict):
+        headers = {k: v for k, v in headers.items() if k.lower() != name}
+        if timeout is not None:
+            headers[name] = f"{timeout:.3f}"
+        return headers
+    headers = [(k, v) for k, v in headers if k.lower() != name.encode("latin-1")]
+    if timeout is not None:
+        headers.append((name.encode("latin-1"), f"{timeout:.3f}".encode("latin-1")))
+    return headers
+
+
+async def _call_upstream(url: str, method: str, send, route: Optional[str], timeout: Optional[float],
+                         endpoint: Optional[Endpoint], replayable: bool = True,
+                         priority: Optional[int] = None) -> httpx.Response:
+    """
+    Runs `send` through the retry policy and circuit breaker, recording the upstream latency and errors, and a
+    client span when the request is traced. The outcome is reported to the endpoint picked for the call, if any.
+    The call waits for a slot of the upstream's concurrency limit first, in the order of `priority`.
+    """
+    upstream = route or _origin(url)
+    deadline = Deadline(timeout)
+    limiter = concurrency_limits.get(url) if config.CONCURRENCY_LIMIT_ENABLED else None
+    with tracing.upstream(method, url, upstream) as span:
+        start = time.perf_counter()
+        # Outcome reported to the endpoint: None for a call that never reached it or was given up on
+        ok: Optional[bool] = False
+        acquired = overloaded = False
+        response = None
+        try:
+            if limiter is not None:
+                await limiter.acquire(concurrency_limits.priority({}) if priority is None else priority,
+                                      deadline.remaining())
+                acquired = True
+                start = time.perf_counter()
+            response = await retry_policy.call(url, method, send, circuit_breakers.get(url, route), deadline,
+                                               replayable=replayable)
+            ok = response.status_code < 500
+            overloaded = response.status_code in (503, 504)
+            span.response(response.status_code)
+        except CircuitOpenError:
+            UPSTREAM_ERRORS.inc((upstream, "circuit_open"))
+            raise
+        except LoadShedError:
+            UPSTREAM_ERRORS.inc((upstream, "shed"))
+            ok = None
+            raise
+        except DeadlineExceeded:
+            UPSTREAM_ERRORS.inc((upstream, "deadline"))
+            if limiter is not None and not acquired:
+                ok = None
+            overloaded = True
+            raise
+        except httpx.HTTPError as e:
+            UPSTREAM_ERRORS.inc((upstream, type(e).__name__))
+            overloaded = isinstance(e, httpx.TimeoutException)
+            raise
+        except asyncio.CancelledError:
+            # The client went away or a hedged call lost the race
+            ok = None
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            if endpoint is not None:
+                endpoint.release(ok, latency)
+            if acquired:
+                # Timeouts and 503/504 shrink the limit; a call that failed otherwise says nothing about latency
+                limiter.release(latency if response is not None else None, dropped=overloaded)
+    UPSTREAM_DURATION.observe(latency, (upstream, method, response.status_code))
+    return response
 
-# Cache configuration
-cache = TTLCache(maxsize=1024, ttl=60)
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-@circuit_breaker
-async def forward_request(url: str, method: str, headers: dict, data: dict = None, params: dict = None):
+async def forward_request(url: str, method: str, headers: dict, data: dict = None, params: dict = None,
+                          timeout: float = None, route: str = None, endpoint: Endpoint = None, priority: int = None):
     """
-    Forwards the request to the specified URL. Includes retry logic and circuit breaker.
+    Forwards the request to the specified URL. Includes retry logic and a per-upstream circuit breaker.
+    `timeout` is the deadline for the whole call, retries included. `endpoint` is the pool endpoint that `url`
+    points at, if it was picked by a load balancer. `priority` is the request's priority class
+    (`concurrency_limits.priority`), used when the upstream is at its concurrency limit.
     """
+    client = upstream_clients.get(url)
+    # The body is encoded once, not on every attempt; the client's Content-Length and Content-Type describe
+    # the body it sent, which is not the one forwarded
+    content = None
+    headers = {k: v for k, v in headers.items() if k.lower() not in ("content-length", "content-type")}
+    if data is not None:
+        content = json_codec.dumps(data)
+        headers["content-type"] = "application/json"
+
+    def send(remaining: Optional[float]):
+        return client.request(
+            method=method,
+            url=url,
+            headers=tracing.inject(_with_deadline(headers, remaining)),
+            content=content,
+            params=params,
+            timeout=httpx.USE_CLIENT_DEFAULT if remaining is None else remaining,
+        )
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params,
-            )
-            response.raise_for_status()
-            # Cache the response
-            if response.content:
-                cache[url] = response.json()
-                return response.json(), response.status_code
-            else:
-                return {}, response.status_code
+        response = await _call_upstream(url, method, send, route, timeout, endpoint, priority=priority)
+        response.raise_for_status()
+        if response.content:
+            return json_codec.loads(response.content), response.status_code
+        else:
+            return {}, response.status_code
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 404:
             raise HTTPException(status_code=404, detail=f"Error communicating with upstream: {e}")
@@ -39,19 +151,53 @@ async def forward_request(url: str, method: str, headers: dict, data: dict = Non
             raise HTTPException(status_code=500, detail=f"Internal server error: {e}")
         else:
             raise HTTPException(status_code=e.response.status_code, detail=f"HTTP error: {e}")
-    except pybreaker.CircuitBreakerError:
+    except CircuitOpenError:
         raise HTTPException(status_code=503, detail="Service temporarily unavailable due to circuit breaker")
+    except LoadShedError:
+        raise HTTPException(status_code=503, detail="Service overloaded, request shed",
+                            headers={"Retry-After": "1"})
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Upstream did not respond within the request deadline")
     except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Error communicating with upstream: {e}")
 
+async def stream_request(url: str, method: str, headers, content=None, timeout: float = None,
+                         route: str = None, endpoint: Endpoint = None, priority: int = None) -> httpx.Response:
+    """
+    Sends the request upstream and returns as soon as the response headers arrive.
+    The body is neither parsed nor buffered; the caller is responsible for closing the response.
+    Retries and the circuit breaker apply as for `forward_request`, but a streamed request body is never resent.
+    """
+    client = upstream_clients.get(url)
+
+    def send(remaining: Optional[float]):
+        request = client.build_request(method=method, url=url,
+                                       headers=tracing.inject(_with_deadline(headers, remaining)), content=content,
+                                       timeout=httpx.USE_CLIENT_DEFAULT if remaining is None else remaining)
+        return client.send(request, stream=True)
+
+    try:
+        return await _call_upstream(url, method, send, route, timeout, endpoint,
+                                    replayable=content is None or isinstance(content, bytes), priority=priority)
+    except CircuitOpenError:
+        raise HTTPException(status_code=503, detail="Service temporarily unavailable due to circuit breaker")
+    except LoadShedError:
+        raise HTTPException(status_code=503, detail="Service overloaded, request shed",
+                            headers={"Retry-After": "1"})
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="Upstream did not respond within the request deadline")
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"Error communicating with upstream: {e}")
+
+
 async def check_service_health(url: str):
     """
     Performs a health check for a given service
     """
     try:
-       async with httpx.AsyncClient() as client:
-          response = await client.get(url)
-          response.raise_for_status()
-          return True
+        client = upstream_clients.get(url)
+        response = await client.get(url, timeout=config.HEALTH_CHECK_TIMEOUT)
+        response.raise_for_status()
+        return True
     except httpx.HTTPError:
         return False
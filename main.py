@@ -1,37 +1,118 @@
-from contextlib import asynccontextmanager
-from json import JSONDecodeError
+import asyncio
+import signal
+import time
+from contextlib import asynccontextmanager, suppress
 from typing import Optional
 
-from cachetools import TTLCache
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
 from loguru import logger
 from pydantic import BaseModel
-from redis import Redis
 
 from config.config import config
-from core.middleware import logging_middleware, tracing_middleware, transform_request_middleware
+from core.access_log import access_log
+from core.middleware import CompressionMiddleware, LoggingMiddleware, TracingMiddleware
+from core.client import upstream_clients
+from core.coalesce import SingleFlight, upstream_flights
+from core import store
+from core.concurrency import concurrency_limits
+from core.codec import FastJSONResponse, json_codec
+from core.discovery import discovery
+from core.hedging import hedged
+from core.health import health_monitor
+from core.metrics import RATE_LIMITED, registry
+from core.routing import router
 from core.security import authenticate
-from core.utils import forward_request, check_service_health
+from core.tracing import tracing
+from core.tiered_cache import TieredCache, invalidation_bus, tiered_response_cache
+from core.proxy import proxy_request
+from core.rate_limit import RateLimit, rate_limiter
+from core.resilience import Deadline, request_timeout
+from core.utils import forward_request
 
-from redis.asyncio import Redis
 import h11
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
 
 
 @asynccontextmanager
 async def lifespan(app_instance: FastAPI):
-    # Setup Redis client
-    redis_client = Redis.from_url(config.REDIS_URL)
-    # Setup Rate Limiting
-    await FastAPILimiter.init(redis_client)
+    # Set up the span exporter, in every worker process (TRACING_EXPORTER)
+    tracing.start()
+    # Swap in freshly validated settings on SIGHUP (serve.py passes it on to every worker)
+    reloads = _on_sighup(reload_settings)
+    # Setup Redis client, when there is a Redis to share state with
+    redis_client = store.connect(config.REDIS_URL) if config.REDIS_URL else None
+    # Reconcile the local rate limit buckets with the other workers through Redis
+    await rate_limiter.start(redis_client)
+    # Share cached entries and invalidations between workers through Redis
+    if config.CACHE_L2_ENABLED and redis_client is not None:
+        await invalidation_bus.start(redis_client)
+    # Compile the route table and watch the routes file for changes
+    router.reload()
+    routes_watcher = None
+    if config.ROUTES_FILE and config.ROUTES_RELOAD_INTERVAL > 0:
+        routes_watcher = asyncio.create_task(router.watch(config.ROUTES_RELOAD_INTERVAL))
+    # Watch the service registry and apply endpoint changes to the upstream pools
+    if discovery:
+        await discovery.start(router.services, router.set_endpoints)
+    # Open the shared upstream connection pools
+    await upstream_clients.start(router.upstream_urls())
+    # Check the upstreams' health in the background
+    await health_monitor.start()
+    # Write access log entries in the background
+    await access_log.start()
+    # Share this worker's metrics with the other workers through METRICS_DIR
+    await registry.start()
     yield
+    if discovery:
+        await discovery.stop()
+    await health_monitor.stop()
+    await registry.stop()
+    await access_log.stop()
+    await rate_limiter.stop()
+    if routes_watcher:
+        routes_watcher.cancel()
+        with suppress(asyncio.CancelledError):
+            await routes_watcher
+    # Close upstream connections
+    await upstream_clients.close()
+    await invalidation_bus.stop()
     # Close Redis client
-    await redis_client.close()
+    if redis_client is not None:
+        await redis_client.close()
+    if reloads:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    # Export the spans still queued
+    await tracing.stop()
+
+
+def _on_sighup(handler) -> bool:
+    """
+    Calls `handler` on SIGHUP; returns False where the event loop cannot handle signals (on Windows or outside
+    the main thread, as under the test client).
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, handler)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        return False
+    return True
+
+
+def reload_settings():
+    """
+    Validates the settings sources again and swaps in the new settings, or keeps the current ones when a source
+    is broken. Settings read per request apply right away; those used at startup, such as the port, the
+    connection pools and the middlewares, need a restart.
+    """
+    try:
+        config.reload()
+    except (OSError, ValueError) as e:
+        logger.error(f"Keeping the current settings, reloading them failed: {e}")
+        return
+    logger.info("Reloaded the settings")
 
 
 app = FastAPI(lifespan=lifespan,
+              default_response_class=FastJSONResponse,
               title="API Gateway",
               description="This is an API Gateway that forwards requests to downstream services",
               version="0.1",
@@ -42,12 +123,15 @@ logger.remove()
 logger.add(lambda msg: print(msg, end=""), level="DEBUG" if config.DEBUG else "INFO")
 
 # Setup Cache
-cache = TTLCache(maxsize=1024, ttl=60)
+item_cache = TieredCache("items", maxsize=1024, ttl=60)
+item_flights = SingleFlight()
 
 # Apply Middlewares
-app.middleware("http")(logging_middleware)
-app.middleware("http")(tracing_middleware)
-app.middleware("http")(transform_request_middleware)
+if config.COMPRESSION_ENABLED:
+    # Innermost, so the access log and metrics count the bytes actually sent
+    app.add_middleware(CompressionMiddleware)
+app.add_middleware(LoggingMiddleware)
+app.add_middleware(TracingMiddleware)
 
 
 class ServiceHealthResponse(BaseModel):
@@ -61,33 +145,59 @@ class Item(BaseModel):
     description: Optional[str] = None
 
 
-@app.get("/items/{item_id}", dependencies=[Depends(RateLimiter(times=2, minutes=1))], operation_id="read_item")
+@app.get("/items/{item_id}", dependencies=[Depends(RateLimit("2/minute", name="read_item"))], operation_id="read_item")
 async def read_item(item_id: int):
-    if item_id in cache:
+    cached = await item_cache.get(str(item_id))
+    if cached is not None:
         logger.info(f"✅ Item: {item_id} found in the cache")
-        return cache[item_id]
+        return Item.model_validate_json(cached)
 
     logger.info(f"❌ Item: {item_id} NOT found in cache")
+    return await item_flights.do(item_id, lambda: load_item(item_id))
+
+
+async def load_item(item_id: int) -> Item:
     # Return hard-coded example item to demonstrate caching
     item = Item(id=item_id, name=f"Example Item {item_id}", description="This is an example")
-    cache[item_id] = item
+    await item_cache.set(str(item_id), item.model_dump_json().encode("utf-8"))
     return item
 
 
 @app.get(config.HEALTH_CHECK_PATH, response_model=ServiceHealthResponse, operation_id="health_check")
 async def health_check():
     """
-    Health check endpoint for the api gateway to check if the downstream services are running
+    Health check endpoint for the api gateway to check if the downstream services are running.
+    Answers from the results of the background health checks instead of probing the services.
     """
-    service_a_healthy = await check_service_health(url=f"{config.SERVICE_A_URL}{config.HEALTH_CHECK_SERVICE_A}")
-    service_b_healthy = await check_service_health(url=f"{config.SERVICE_B_URL}{config.HEALTH_CHECK_SERVICE_B}")
+    endpoints = await health_monitor.snapshot()
+    pools = router.table.pools
+    service_a_healthy, service_b_healthy = (
+        name in pools and any(endpoints.get(endpoint.url, {}).get("healthy") for endpoint in pools[name].endpoints)
+        for name in ("service-a", "service-b")
+    )
     return ServiceHealthResponse(service_a_healthy=service_a_healthy, service_b_healthy=service_b_healthy)
 
 
+@app.get(config.CACHE_STATS_PATH, operation_id="cache_stats")
+async def cache_stats():
+    """
+    Response cache counters (hits, misses, evictions, size), used to size RESPONSE_CACHE_MAX_BYTES.
+    """
+    return {**tiered_response_cache.stats(), "coalescing": upstream_flights.stats()}
+
+
+@app.get(config.METRICS_PATH, response_class=PlainTextResponse, operation_id="metrics")
+async def metrics():
+    """
+    Gateway metrics of all workers in the Prometheus text format.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @app.exception_handler(h11._util.LocalProtocolError)
 async def local_protocol_error_handler(request: Request, exc: h11._util.LocalProtocolError):
     logger.error(f"LocalProtocolError: {exc}")
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=400,
         content={"detail": "Too little data for declared Content-Length"},
     )
@@ -104,43 +214,91 @@ async def gateway(path: str, request: Request, auth_payload: dict = Depends(auth
     """
     logger.debug(f"📥 Received request: {request.method} {request.url}")
 
-    # Determine the backend URL based on path prefix (can be more sophisticated later)
-    if path.startswith("service-a"):
-        url = f"{config.SERVICE_A_URL}/{path.removeprefix('service-a/')}"
-    elif path.startswith("service-b"):
-        url = f"{config.SERVICE_B_URL}/{path.removeprefix('service-b/')}"
-    else:
+    # Determine the backend URL from the compiled route table
+    match = router.match(request.method, f"/{path}", request.headers.get("host"), healthy=health_monitor.is_healthy)
+    if match is None:
         raise HTTPException(status_code=404, detail="Service not found")
+    route, upstream_path = match
+    transform = route.request_transform(request.method)
+    if transform is not None and transform.path is not None:
+        upstream_path = transform.path(upstream_path)
+    request.state.route = route.name
+
+    if config.RATE_LIMIT_ENABLED:
+        subject = auth_payload.get("sub") or (request.client.host if request.client else "unknown")
+        try:
+            rate_limiter.check(f"{route.name}:{subject}", route.rate_limit or config.RATE_LIMIT)
+        except HTTPException:
+            RATE_LIMITED.inc((route.name,))
+            raise
+
+    # Decides the order of requests waiting for an upstream at its concurrency limit
+    priority = concurrency_limits.priority(auth_payload)
+
+    if route.composite is not None:
+        # Fan out to the route's upstream calls and answer with their merged responses
+        started = time.perf_counter()
+        merged = await route.composite.execute(request, upstream_path, route.timeout, health_monitor.is_healthy,
+                                               priority)
+        request.state.upstream_latency = (time.perf_counter() - started) * 1000
+        response = FastJSONResponse(content=merged)
+        if route.transform is not None:
+            response = await route.transform.response(response)
+        return response
+
+    url = route.url_for(upstream_path)
+    if config.STREAMING_PROXY:
+        response = await proxy_request(url, request, route, priority)
+        if route.transform is not None:
+            response = await route.transform.response(response)
+        return response
 
     # Construct headers (remove some headers that are meant for the gateway only)
-    headers = dict(request.headers)
+    raw_headers = request.headers.raw
+    if transform is not None and transform.request_headers is not None:
+        raw_headers = transform.request_headers(raw_headers)
+    headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in raw_headers}
     headers.pop("host", None)
     headers.pop("connection", None)
 
     # Read request body as JSON if it exists (and it's not a GET request)
     json_body = None
     if request.method != "GET":
+        body = await request.body()
         try:
-            json_body = await request.json()
-        except JSONDecodeError:
+            json_body = json_codec.loads(body) if body else None
+        except ValueError:
             json_body = None
+    if json_body is not None and transform is not None and transform.request_body is not None:
+        json_body = transform.request_body(json_body)
 
     # Handle query parameters
     params = dict(request.query_params)
 
     # Forward the request
-    response_data, status_code = await forward_request(url=url, method=request.method, headers=headers, data=json_body,
-                                                       params=params)
+    deadline = Deadline(request_timeout(request.headers, route.timeout))
+    started = time.perf_counter()
+    response_data, status_code = await hedged(
+        route, request.method, request.headers, health_monitor.is_healthy,
+        lambda endpoint: forward_request(url=endpoint.rebase(url), method=request.method, headers=headers,
+                                         data=json_body, params=params, timeout=deadline.remaining(),
+                                         route=route.name, endpoint=endpoint, priority=priority))
+    request.state.upstream_latency = (time.perf_counter() - started) * 1000
 
     logger.debug(f"📤 Forwarded request to {url}, status code: {status_code}")
 
     if not response_data:
         response_data = {}
+    if route.transform is not None and route.transform.response_body is not None:
+        response_data = route.transform.response_body(response_data)
 
-    return JSONResponse(content=response_data, status_code=status_code)
+    response = FastJSONResponse(content=response_data, status_code=status_code)
+    if route.transform is not None and route.transform.response_headers is not None:
+        response.raw_headers = route.transform.response_headers(response.raw_headers)
+    return response
 
 
 if __name__ == "__main__":
-    import uvicorn
+    from serve import serve
 
-    uvicorn.run(app, host="0.0.0.0", port=config.PORT)
+    raise SystemExit(serve(app))
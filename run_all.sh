@@ -16,7 +16,7 @@ check_status() {
 # Function to stop all services
 stop_services() {
   echo "Stopping API Gateway..."
-  pkill -f "uvicorn main:app --host 0.0.0.0 --port 8080"
+  pkill -f "python serve.py --port 8080"
   echo "Stopping service-b..."
   pkill -f "uvicorn services.service_b.main:app --host 0.0.0.0 --port 8002"
   echo "Stopping service-a..."
@@ -72,7 +72,7 @@ kill_port 14269
 # Check if Jaeger is running and only try to start it if it is not.
 if ! pgrep -x "jaeger-all-in-one" > /dev/null; then
   echo "Starting Jaeger..."
-  jaeger-all-in-one &
+  COLLECTOR_OTLP_ENABLED=true jaeger-all-in-one &
   sleep 5 # Give Jaeger some time to start
   check_status "true" "Starting Jaeger"
 else
@@ -126,5 +126,5 @@ check_status "true" "Starting service-b"
 
 # Start the FastAPI application
 echo "Starting API Gateway..."
-uvicorn main:app --host 0.0.0.0 --port 8080
+DISCOVERY_PROVIDER=consul TRACING_EXPORTER=otlp python serve.py --port 8080
 check_status "true" "Starting API Gateway"
\ No newline at end of file
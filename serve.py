@@ -0,0 +1,272 @@
+"""
+Runs the gateway in several worker processes on one port.
+
+The app is imported once, before the workers are forked, so they share its memory pages. Every worker gets a
+listening socket of its own bound with SO_REUSEPORT and the kernel spreads new connections over them; without
+SO_REUSEPORT the workers accept from a single shared socket. The master restarts workers that die and turns
+SIGTERM or SIGINT into a graceful drain: workers stop accepting connections and finish their in-flight requests
+within GRACEFUL_SHUTDOWN_TIMEOUT. A second signal stops them right away. SIGHUP is passed on to the workers,
+which reload their settings.
+
+    python serve.py [--workers N] [--host HOST] [--port PORT]
+"""
+import argparse
+import glob
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+from typing import Optional
+
+import uvicorn
+
+from config.config import config
+from core.metrics import registry
+
+logger = logging.getLogger("gateway.serve")
+
+# Exit status of a uvicorn worker whose startup failed; restarting it would fail again
+STARTUP_FAILURE = 3
+# Extra time the master gives draining workers before killing them (seconds)
+KILL_GRACE = 5.0
+
+
+def worker_count(workers: int = 0) -> int:
+    if not hasattr(os, "fork"):
+        return 1
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+def event_loop(name: str) -> str:
+    if name == "auto":
+        return "uvloop" if find_spec("uvloop") else "asyncio"
+    return name
+
+
+def http_protocol(name: str) -> str:
+    if name == "auto":
+        return "httptools" if find_spec("httptools") else "h11"
+    return name
+
+
+def bind(host: str, port: int, reuse_port: bool) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(config.SERVER_BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+def listeners(host: str, port: int, workers: int) -> list[socket.socket]:
+    """
+    One socket per worker with SO_REUSEPORT, otherwise a single socket shared by all workers.
+    The master keeps them open, so a restarted worker picks up the connections already queued on its socket.
+    """
+    if workers == 1 or not config.SERVER_REUSE_PORT or not hasattr(socket, "SO_REUSEPORT"):
+        return [bind(host, port, False)]
+    first = bind(host, port, True)
+    # Port 0 picks a free port; the other sockets join the first one on it
+    port = first.getsockname()[1]
+    return [first] + [bind(host, port, True) for _ in range(workers - 1)]
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    A worker's uvicorn server. Uvicorn drains it on SIGTERM; it also shuts down when the master is gone,
+    so an abandoned worker does not keep serving.
+    """
+
+    def __init__(self, server_config: uvicorn.Config, master: Optional[int] = None):
+        super().__init__(server_config)
+        self.master = master
+
+    async def on_tick(self, counter: int) -> bool:
+        if self.master is not None and counter % 10 == 0 and os.getppid() != self.master:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+def server_config(app) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        loop=event_loop(config.SERVER_LOOP),
+        http=http_protocol(config.SERVER_HTTP),
+        lifespan="on",
+        # Requests are logged by the gateway's own access log
+        access_log=False,
+        log_level="debug" if config.DEBUG else "info",
+        backlog=config.SERVER_BACKLOG,
+        timeout_graceful_shutdown=config.GRACEFUL_SHUTDOWN_TIMEOUT,
+    )
+
+
+def run_worker(app, sock: socket.socket, master: Optional[int] = None) -> int:
+    server = WorkerServer(server_config(app), master)
+    try:
+        server.run(sockets=[sock])
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    return 0 if server.started else STARTUP_FAILURE
+
+
+class Master:
+    """
+    Forks the workers, restarts the ones that die and drains them all on shutdown.
+    """
+
+    def __init__(self, app, sockets: list[socket.socket], workers: int):
+        self.app = app
+        self.sockets = sockets
+        self.workers = workers
+        # Worker slot by pid; slot i serves sockets[i] (or the only socket)
+        self.children: dict[int, int] = {}
+        self.signals: list[int] = []
+        self.status = 0
+
+    def spawn(self, slot: int):
+        sock = self.sockets[slot % len(self.sockets)]
+        master = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                # The master forwards signals; a terminal's Ctrl-C must not reach the workers twice
+                os.setpgid(0, 0)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                # Until the app handles SIGHUP itself, a reload must not kill the worker
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                for other in self.sockets:
+                    if other is not sock:
+                        other.close()
+                code = run_worker(self.app, sock, master)
+            finally:
+                os._exit(code)
+        self.children[pid] = slot
+        logger.info(f"Started worker {pid}")
+
+    def run(self) -> int:
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        signal.signal(signal.SIGHUP, lambda sig, frame: self.kill(signal.SIGHUP))
+        for slot in range(self.workers):
+            self.spawn(slot)
+
+        while not self.signals:
+            self.reap(restart=True)
+            time.sleep(0.2)
+        self.drain()
+        return self.status
+
+    def handle_signal(self, sig: int, frame):
+        self.signals.append(sig)
+        if len(self.signals) > 1:
+            # Second signal: uvicorn stops at once on a repeated SIGINT
+            self.kill(signal.SIGINT)
+
+    def reap(self, restart: bool):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is None or not restart:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            if code == STARTUP_FAILURE:
+                logger.error(f"Worker {pid} failed to start, shutting down")
+                self.status = STARTUP_FAILURE
+                self.signals.append(signal.SIGTERM)
+                return
+            logger.warning(f"Worker {pid} exited with status {code}, restarting it")
+            self.spawn(slot)
+
+    def kill(self, sig: int):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def drain(self):
+        logger.info(f"Draining {len(self.children)} workers")
+        # Closing the master's copies lets the kernel stop routing connections to a socket once its worker closes it
+        for sock in self.sockets:
+            sock.close()
+        self.kill(signal.SIGTERM)
+        deadline = time.monotonic() + config.GRACEFUL_SHUTDOWN_TIMEOUT + KILL_GRACE
+        while self.children and time.monotonic() < deadline:
+            self.reap(restart=False)
+            time.sleep(0.1)
+        if self.children:
+            logger.warning(f"Killing {len(self.children)} workers that did not finish draining")
+            self.kill(signal.SIGKILL)
+            while self.children:
+                self.reap(restart=False)
+                time.sleep(0.05)
+
+
+def metrics_dir(workers: int) -> Optional[str]:
+    """
+    Workers share metrics through METRICS_DIR. With several workers and no METRICS_DIR a temporary directory
+    is used; returns it so it is removed on exit. Snapshots left over from an earlier run are cleared.
+    """
+    if workers == 1:
+        return None
+    temporary = None
+    if config.METRICS_DIR:
+        for path in glob.glob(os.path.join(config.METRICS_DIR, "*.json")):
+            os.remove(path)
+    else:
+        temporary = config.METRICS_DIR = os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="gateway-metrics-")
+    # The registry may have been created before, e.g. when main.py imported the app and started the server
+    registry.directory = config.METRICS_DIR
+    return temporary
+
+
+def serve(app=None, host: str = None, port: int = None, workers: int = None) -> int:
+    logging.basicConfig(level=logging.DEBUG if config.DEBUG else logging.INFO)
+    host = config.HOST if host is None else host
+    port = config.PORT if port is None else port
+    workers = worker_count(config.WORKERS if workers is None else workers)
+    temporary = metrics_dir(workers)
+    try:
+        if app is None:
+            # Preloaded before the fork, so the workers share its memory pages
+            from main import app
+        sockets = listeners(host, port, workers)
+        logger.info(f"Serving on {host}:{sockets[0].getsockname()[1]} with {workers} workers "
+                    f"({event_loop(config.SERVER_LOOP)}, {http_protocol(config.SERVER_HTTP)}, "
+                    f"{'SO_REUSEPORT' if len(sockets) > 1 else 'shared socket'})")
+        if workers == 1:
+            return run_worker(app, sockets[0])
+        return Master(app, sockets, workers).run()
+    finally:
+        if temporary:
+            shutil.rmtree(temporary, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API gateway with several worker processes.")
+    parser.add_argument("--host", default=None, help="Interface to listen on (default: HOST)")
+    parser.add_argument("--port", type=int, default=None, help="Port to listen on (default: PORT)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: WORKERS, or one per CPU)")
+    args = parser.parse_args()
+    sys.exit(serve(host=args.host, port=args.port, workers=args.workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 app = FastAPI()
 
@@ -13,13 +14,19 @@ async def health_check():
 async def get_some_path():
     return {"message": "This is service-a"}
 
+@app.get("/cacheable")
+async def get_cacheable():
+    return JSONResponse({"message": "This is a cacheable response from service-a"},
+                        headers={"Cache-Control": "public, max-age=60"})
+
 @app.post("/some-path")
 async def post_some_path(data: dict):
-    return {"message": "POST request to service-a", "data": data}
+    # Returned as is, FastAPI would walk the echoed body item by item to encode it
+    return JSONResponse({"message": "POST request to service-a", "data": data})
 
 @app.put("/some-path")
 async def put_some_path(data: dict):
-    return {"message": "PUT request to service-a", "data": data}
+    return JSONResponse({"message": "PUT request to service-a", "data": data})
 
 @app.delete("/some-path")
 async def delete_some_path():
@@ -27,4 +34,4 @@ async def delete_some_path():
 
 @app.patch("/some-path")
 async def patch_some_path(data: dict):
-    return {"message": "PATCH request to service-a", "data": data}
+    return JSONResponse({"message": "PATCH request to service-a", "data": data})
@@ -1,4 +1,5 @@
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 
 app = FastAPI()
 
@@ -15,11 +16,11 @@ async def get_some_path():
 
 @app.post("/some-path")
 async def post_some_path(data: dict):
-    return {"message": "POST request to service-b", "data": data}
+    return JSONResponse({"message": "POST request to service-b", "data": data})
 
 @app.put("/some-path")
 async def put_some_path(data: dict):
-    return {"message": "PUT request to service-b", "data": data}
+    return JSONResponse({"message": "PUT request to service-b", "data": data})
 
 @app.delete("/some-path")
 async def delete_some_path():
@@ -27,4 +28,4 @@ async def delete_some_path():
 
 @app.patch("/some-path")
 async def patch_some_path(data: dict):
-    return {"message": "PATCH request to service-b", "data": data}
+    return JSONResponse({"message": "PATCH request to service-b", "data": data})
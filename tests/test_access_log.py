@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from config.config import config
+from core import middleware
+from core.access_log import AccessLog
+from core.middleware import LoggingMiddleware
+
+
+@pytest.fixture
+def access_log(monkeypatch, tmp_path):
+    log = AccessLog(max_size=100, flush_interval=60, path=str(tmp_path / "access.log"))
+    monkeypatch.setattr(middleware, "access_log", log)
+    return log
+
+
+async def echo(request):
+    request.state.route = "echo"
+    return Response(await request.body() * 10, headers={"set-cookie": "session=secret"})
+
+
+async def stream(request):
+    async def chunks():
+        for _ in range(3):
+            yield b"x" * 100
+
+    return StreamingResponse(chunks())
+
+
+def send(requests):
+    app = Starlette(routes=[Route("/echo", echo, methods=["POST"]), Route("/stream", stream)],
+                    middleware=[Middleware(LoggingMiddleware)])
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway") as client:
+            return [await client.request(method, url, **kwargs) for method, url, kwargs in requests]
+
+    return asyncio.run(scenario())
+
+
+def read(log: AccessLog) -> list[dict]:
+    async def scenario():
+        await log.start()
+        await log.stop()
+
+    asyncio.run(scenario())
+    with open(log.path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_entries_have_counts_but_no_bodies_by_default(access_log, monkeypatch):
+    monkeypatch.setattr(config, "ACCESS_LOG_BODY_SAMPLE_RATE", 0.0)
+    responses = send([("POST", "/echo", {"content": b"hello"}), ("GET", "/stream", {})])
+    assert responses[1].content == b"x" * 300
+
+    posted, streamed = read(access_log)
+    assert posted["route"] == "echo"
+    assert (posted["method"], posted["path"], posted["status"]) == ("POST", "/echo", 200)
+    assert (posted["request_bytes"], posted["response_bytes"]) == (5, 50)
+    assert streamed["response_bytes"] == 300
+    assert "request_body" not in posted and "request_headers" not in posted
+
+
+def test_sampled_bodies_are_truncated_and_headers_redacted(access_log, monkeypatch):
+    monkeypatch.setattr(config, "ACCESS_LOG_BODY_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "ACCESS_LOG_BODY_MAX_BYTES", 8)
+    send([("POST", "/echo", {"content": b"hello", "headers": {"Authorization": "Bearer token"}})])
+
+    entry, = read(access_log)
+    assert entry["request_body"] == {"body": "hello", "truncated": False}
+    assert entry["response_body"] == {"body": "hellohel", "truncated": True}
+    assert entry["request_headers"]["authorization"] == "[REDACTED]"
+    assert entry["response_headers"]["set-cookie"] == "[REDACTED]"
+
+
+def test_full_queue_drops_entries(access_log, monkeypatch):
+    monkeypatch.setattr(access_log, "max_size", 2)
+    send([("GET", "/stream", {})] * 5)
+    assert access_log.stats() == {"queued": 2, "written": 0, "dropped": 3}
@@ -0,0 +1,87 @@
+from collections import Counter
+
+import pytest
+
+from config.config import config
+from core.balancer import EndpointPool
+from core.routing import RouteTable, RouteTableConfig
+
+URLS = [("http://a:1", 1), ("http://b:1", 1), ("http://c:1", 1), ("http://d:1", 1)]
+
+
+def picks(pool: EndpointPool, count: int, key=None, healthy=None) -> Counter:
+    chosen = Counter()
+    for _ in range(count):
+        endpoint = pool.pick(key, healthy)
+        endpoint.release(True, 0.01)
+        chosen[endpoint.url] += 1
+    return chosen
+
+
+def test_round_robin_and_weighted_spread_requests():
+    assert set(picks(EndpointPool("s", URLS, "round_robin"), 8).values()) == {2}
+    weighted = EndpointPool("s", [("http://a:1", 3), ("http://b:1", 1)], "weighted")
+    assert [weighted.pick().url for _ in range(4)].count("http://a:1") == 3
+
+
+def test_least_outstanding_avoids_busy_endpoints():
+    pool = EndpointPool("s", URLS, "least_outstanding")
+    busy = [pool.pick() for _ in range(3)]
+    assert len({endpoint.url for endpoint in busy}) == 3
+    assert pool.pick().url not in {endpoint.url for endpoint in busy}
+
+
+def test_consistent_hash_is_sticky_and_skips_unavailable_endpoints():
+    pool = EndpointPool("s", URLS, "consistent_hash", hash_header="X-User")
+    assert pool.hash_key({"x-user": "alice"}) == "alice"
+    assert pool.hash_key([(b"X-User", b"alice")]) == "alice"
+    first = picks(pool, 10, key="alice")
+    assert len(first) == 1
+    owner = next(iter(first))
+    assert owner not in picks(pool, 10, key="alice", healthy=lambda url: url != owner)
+
+
+def test_failing_endpoint_is_ejected_but_not_the_whole_pool(monkeypatch):
+    monkeypatch.setattr(config, "OUTLIER_CONSECUTIVE_FAILURES", 3)
+    pool = EndpointPool("s", URLS[:2], "round_robin")
+    a, b = pool.endpoints
+    for _ in range(3):
+        a.outstanding += 1
+        a.release(False, 0.01)
+    assert a.ejected_until > 0
+    assert set(picks(pool, 4)) == {b.url}
+    # At most half of the pool may be ejected
+    for _ in range(3):
+        b.outstanding += 1
+        b.release(False, 0.01)
+    assert b.ejected_until == 0
+
+
+def test_slow_endpoint_is_ejected():
+    pool = EndpointPool("s", URLS, "round_robin")
+    for endpoint in pool.endpoints[1:]:
+        endpoint.latency = 0.01
+    slow = pool.endpoints[0]
+    slow.outstanding += 1
+    slow.release(True, 1.0)
+    assert slow.ejected_until > 0
+
+
+def test_routes_file_declares_endpoint_pools():
+    table = RouteTable(RouteTableConfig.model_validate({
+        "upstreams": {
+            "a": "http://a1:8001, http://a2:8001",
+            "b": {"endpoints": ["http://b1", {"url": "http://b2", "weight": 3}], "balancer": "weighted"},
+        },
+        "routes": [{"prefix": "/a", "upstream": "a"}, {"prefix": "/b", "upstream": "b"}],
+    }))
+    route, path = table.match("GET", "/a/x")
+    assert route.url_for(path) == "http://a1:8001/x"
+    endpoint = route.pick({})
+    assert endpoint.rebase(route.url_for(path)) in {"http://a1:8001/x", "http://a2:8001/x"}
+    assert [endpoint.weight for endpoint in table.pools["b"].endpoints] == [1, 3]
+    assert set(table.health_targets()) == {"http://a1:8001", "http://a2:8001", "http://b1", "http://b2"}
+    with pytest.raises(ValueError):
+        RouteTable(RouteTableConfig.model_validate({
+            "upstreams": {"a": {"endpoints": ["http://a"], "balancer": "random"}}, "routes": [],
+        }))
@@ -0,0 +1,104 @@
+from starlette.datastructures import Headers
+
+from core.cache import CachedResponse, ResponseCache, freshness_lifetime, is_storable, vary_names
+
+
+def raw(headers: dict) -> list[tuple[bytes, bytes]]:
+    return [(k.encode(), v.encode()) for k, v in headers.items()]
+
+
+def entry(body=b"{}", **headers):
+    response_headers = raw({k.replace("_", "-"): v for k, v in headers.items()})
+    return CachedResponse(200, response_headers, body, vary_names(response_headers))
+
+
+def test_freshness_prefers_s_maxage():
+    assert freshness_lifetime(raw({"cache-control": "max-age=10, s-maxage=60"})) == 60
+    assert freshness_lifetime(raw({"cache-control": "max-age=10"})) == 10
+    assert freshness_lifetime(raw({"cache-control": "no-cache, max-age=10"})) == 0
+
+
+def test_storable_rules():
+    anonymous = Headers({})
+    authenticated = Headers({"authorization": "Bearer x"})
+    assert is_storable(anonymous, 200, raw({"cache-control": "max-age=60"}))
+    assert is_storable(anonymous, 200, raw({"etag": '"v1"'}))
+    assert not is_storable(anonymous, 200, raw({}))
+    assert not is_storable(anonymous, 500, raw({"cache-control": "max-age=60"}))
+    assert not is_storable(anonymous, 200, raw({"cache-control": "private, max-age=60"}))
+    assert not is_storable(anonymous, 200, raw({"cache-control": "max-age=60", "vary": "*"}))
+    assert not is_storable(authenticated, 200, raw({"cache-control": "max-age=60"}))
+    assert is_storable(authenticated, 200, raw({"cache-control": "public, max-age=60"}))
+
+
+def test_key_normalizes_query_order():
+    assert ResponseCache.base_key("GET", "http://a/x", "b=2&a=1") == ResponseCache.base_key("GET", "http://a/x", "a=1&b=2")
+
+
+def test_vary_headers_select_variant():
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=10_000)
+    key = cache.base_key("GET", "http://a/x")
+    cache.put(key, Headers({"accept-language": "en"}), entry(b"en", cache_control="max-age=60", vary="Accept-Language"))
+    cache.put(key, Headers({"accept-language": "fr"}), entry(b"fr", cache_control="max-age=60", vary="Accept-Language"))
+
+    assert cache.get(key, Headers({"accept-language": "en"})).body == b"en"
+    assert cache.get(key, Headers({"accept-language": "fr"})).body == b"fr"
+    assert cache.get(key, Headers({"accept-language": "de"})) is None
+
+
+def test_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=2_000, max_entry_bytes=2_000)
+    keys = [cache.base_key("GET", f"http://a/{i}") for i in range(3)]
+    cache.put(keys[0], Headers({}), entry(b"x" * 600, cache_control="max-age=60"))
+    cache.put(keys[1], Headers({}), entry(b"x" * 600, cache_control="max-age=60"))
+    cache.get(keys[0], Headers({}))
+    cache.put(keys[2], Headers({}), entry(b"x" * 600, cache_control="max-age=60"))
+
+    assert cache.get(keys[1], Headers({})) is None
+    assert cache.get(keys[0], Headers({})) is not None
+    assert cache.evictions == 1
+    assert cache.size <= cache.max_bytes
+
+
+def test_oversized_entries_are_not_stored():
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=500)
+    key = cache.base_key("GET", "http://a/x")
+    cache.put(key, Headers({}), entry(b"x" * 1_000, cache_control="max-age=60"))
+    assert cache.get(key, Headers({})) is None
+
+
+def test_conditional_requests_and_revalidation():
+    stored = entry(etag='"v1"', last_modified="Wed, 21 Oct 2015 07:28:00 GMT", cache_control="max-age=0")
+    assert not stored.is_fresh()
+    assert stored.matches_conditional(Headers({"if-none-match": 'W/"v1", "v0"'}))
+    assert not stored.matches_conditional(Headers({"if-none-match": '"v2"'}))
+    assert stored.matches_conditional(Headers({"if-modified-since": "Wed, 21 Oct 2015 07:28:00 GMT"}))
+    assert (b"if-none-match", b'"v1"') in stored.validators()
+
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=10_000)
+    cache.revalidated(stored, raw({"cache-control": "max-age=60"}))
+    assert stored.is_fresh()
+    assert cache.revalidations == 1
+
+
+def test_invalidate_drops_all_variants():
+    cache = ResponseCache(max_bytes=10_000, max_entry_bytes=10_000)
+    key = cache.base_key("GET", "http://a/x")
+    for language in ("en", "fr"):
+        cache.put(key, Headers({"accept-language": language}),
+                  entry(language.encode(), cache_control="max-age=60", vary="accept-language"))
+    cache.invalidate(key)
+    assert cache.get(key, Headers({"accept-language": "en"})) is None
+    assert cache.size == 0
+
+
+def test_paths_with_newlines_are_evicted_and_invalidated():
+    size = entry(b"0123456789", cache_control="max-age=60").size
+    cache = ResponseCache(max_bytes=2 * size, max_entry_bytes=size)
+    key = cache.base_key("GET", "http://a/x\ny")
+    cache.put(key, Headers(), entry(b"0123456789", cache_control="max-age=60"))
+    cache.invalidate(key)
+    assert cache.get(key, Headers()) is None and cache.size == 0
+    for path in ("/a\nb", "/c\nd", "/e\nf"):
+        cache.put(cache.base_key("GET", f"http://a{path}"), Headers(), entry(b"0123456789", cache_control="max-age=60"))
+    assert cache.evictions == 1 and cache.size == 2 * size
@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+
+from core.client import UpstreamClientPool
+
+
+def test_one_client_per_origin_reused_until_closed():
+    origins = []
+    pool = UpstreamClientPool(transport=httpx.MockTransport(
+        lambda request: origins.append(request.url.host) or httpx.Response(200)))
+
+    async def scenario():
+        client = pool.get("http://users:8000/users/1")
+        assert pool.get("http://users:8000/teams?id=2") is client
+        assert pool.get("http://users:8001/users/1") is not client
+        assert pool.get("https://users:8000/users/1") is not client
+
+        # Requests to the same upstream go through the same client
+        for path in ("/users/1", "/users/2"):
+            response = await pool.get(f"http://users:8000{path}").get(f"http://users:8000{path}")
+            assert response.status_code == 200
+        assert pool.get("http://users:8000/") is client and not client.is_closed
+        assert len(pool._clients) == 3
+
+        clients = list(pool._clients.values())
+        await pool.close()
+        assert all(client.is_closed for client in clients)
+        # A closed pool opens new clients when it is used again
+        reopened = pool.get("http://users:8000/users/1")
+        assert reopened is not client and not reopened.is_closed
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert origins == ["users", "users"]
+
+
+def test_clients_are_not_shared_between_event_loops():
+    pool = UpstreamClientPool()
+
+    async def get():
+        return pool.get("http://users:8000/")
+
+    first = asyncio.run(get())
+    assert asyncio.run(get()) is not first
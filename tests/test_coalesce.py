@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from core.coalesce import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights = SingleFlight()
+        executions = 0
+
+        async def fetch():
+            nonlocal executions
+            executions += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flights.do("key", fetch) for _ in range(100)))
+        return results, executions, flights
+
+    results, executions, flights = asyncio.run(scenario())
+    assert results == ["result"] * 100
+    assert executions == 1
+    assert flights.stats() == {"in_flight": 0, "calls": 1, "coalesced": 99}
+
+
+def test_errors_are_shared_and_not_cached():
+    async def scenario():
+        flights = SingleFlight()
+        attempts = 0
+
+        async def fail():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(flights.do("key", fail) for _ in range(10)), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flights.do("key", fail)
+        return results, attempts
+
+    results, attempts = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert attempts == 2
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def scenario():
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        leader = asyncio.create_task(flights.do("key", fetch))
+        follower = asyncio.create_task(flights.do("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == "result"
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from starlette.responses import JSONResponse
+
+from core.codec import BACKENDS, FastJSONResponse, JSONCodec
+
+PAYLOAD = {"id": 2 ** 70, "name": "café ☕", "tags": ["a", "b"], "ratio": 0.25, "active": True, "parent": None}
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_backends_agree_with_the_standard_library(backend):
+    codec = JSONCodec(backend)
+    encoded = codec.dumps(PAYLOAD)
+    assert json.loads(encoded) == PAYLOAD
+    assert codec.loads(encoded) == PAYLOAD
+    assert codec.loads(encoded.decode("utf-8")) == PAYLOAD
+    # Whatever the fast backend cannot encode is handled by the standard library
+    assert codec.dumps({1: "a"}) == b'{"1":"a"}'
+    with pytest.raises(ValueError):
+        codec.loads(b'{"truncated":')
+
+
+@pytest.mark.parametrize("backend", list(BACKENDS))
+def test_backends_agree_on_non_finite_floats(backend):
+    codec = JSONCodec(backend)
+    assert codec.dumps({"n": float("nan"), "values": [float("inf"), -float("inf"), 1.5]}) == (
+        b'{"n":null,"values":[null,null,1.5]}')
+    for body in (b'{"n": NaN}', b'[Infinity]', b'[-Infinity]', b'[1e999]'):
+        with pytest.raises(ValueError):
+            codec.loads(body)
+
+
+def test_fast_response_renders_like_json_response():
+    content = {k: v for k, v in PAYLOAD.items() if k != "id"}
+    assert FastJSONResponse(content).body == JSONResponse(content).body
+    assert FastJSONResponse(content).headers["content-type"] == "application/json"
+
+
+def test_unknown_backend_falls_back():
+    assert JSONCodec("simdjson").name == next(iter(BACKENDS))
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from core.client import upstream_clients
+from core.routing import RouteTable, RouteTableConfig
+
+TABLE = {
+    "upstreams": {"users": "http://users", "orders": "http://orders"},
+    "routes": [{"name": "profile", "regex": "^/profile/(?P<id>\\d+)$", "rewrite": "/\\g<id>", "composite": {"calls": [
+        {"name": "user", "upstream": "users", "path": "/users{path}"},
+        {"name": "orders", "upstream": "orders", "path": "/orders?user={path}&limit={query.limit}"},
+        {"name": "team", "upstream": "users", "path": "/teams/{user.team.id}", "depends_on": ["user"],
+         "required": False},
+    ]}}],
+}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(str(request.url))
+        await asyncio.sleep(0.2)
+        if request.url.path == "/users/1":
+            return httpx.Response(200, json={"id": 1, "team": {"id": "a b"}})
+        if request.url.path == "/users/2":
+            return httpx.Response(200, json={"id": 2, "team": {"id": "gone"}})
+        if request.url.path == "/orders":
+            return httpx.Response(200, json=[{"id": 10}])
+        if request.url.path == "/teams/a b":
+            return httpx.Response(200, json={"name": "A"})
+        return httpx.Response(404, json={"detail": "not found"})
+
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(handler))
+    return calls
+
+
+def get(path: str, query: bytes = b"limit=5"):
+    route, upstream_path = RouteTable(RouteTableConfig.model_validate(TABLE)).match("GET", path)
+    request = Request({"type": "http", "method": "GET", "path": path, "query_string": query,
+                       "headers": [(b"authorization", b"Bearer token"), (b"content-length", b"0")]})
+    return asyncio.run(route.composite.execute(request, upstream_path, timeout=5))
+
+
+def test_independent_calls_run_concurrently(upstream):
+    started = time.perf_counter()
+    merged = get("/profile/1")
+    elapsed = time.perf_counter() - started
+
+    assert merged == {"user": {"id": 1, "team": {"id": "a b"}}, "orders": [{"id": 10}], "team": {"name": "A"}}
+    assert "http://orders/orders?user=/1&limit=5" in upstream
+    assert "http://users/teams/a%20b" in upstream
+    # user and orders overlap, team waits for user: two round trips, not three
+    assert elapsed < 0.55
+
+
+def test_failed_optional_calls_are_reported_and_required_ones_fail_the_request(upstream):
+    merged = get("/profile/2")
+    assert merged["user"] == {"id": 2, "team": {"id": "gone"}}
+    assert merged["team"] is None
+    assert merged["errors"]["team"]["status"] == 404
+
+    with pytest.raises(HTTPException) as error:
+        get("/profile/3")
+    assert error.value.status_code == 404
+
+    with pytest.raises(HTTPException) as error:
+        get("/profile/1", query=b"")
+    assert error.value.status_code == 400
+
+
+def test_calls_may_only_depend_on_earlier_calls():
+    table = {**TABLE, "routes": [{"prefix": "/x", "composite": {"calls": [
+        {"name": "b", "upstream": "users", "path": "/{a.id}", "depends_on": ["a"]},
+        {"name": "a", "upstream": "users"},
+    ]}}]}
+    with pytest.raises(ValueError, match="not declared before it"):
+        RouteTable(RouteTableConfig.model_validate(table))
+
+    table["routes"] = [{"prefix": "/x", "upstream": "users", "composite": {"calls": [{"name": "a", "upstream": "users"}]}}]
+    with pytest.raises(ValueError, match="exactly one of upstream or composite"):
+        RouteTable(RouteTableConfig.model_validate(table))
@@ -0,0 +1,135 @@
+import asyncio
+import gzip
+
+import httpx
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from core.cache import CachedResponse, ResponseCache
+from core.compression import ENCODERS, Encoder, encoded_headers, negotiate
+from core.middleware import CompressionMiddleware
+
+LARGE = {"items": [{"id": i, "name": f"item-{i}"} for i in range(200)]}
+
+
+async def large(request):
+    return JSONResponse(LARGE, headers={"etag": '"v1"'})
+
+
+async def small(request):
+    return JSONResponse({"ok": True})
+
+
+async def stream(request):
+    async def chunks():
+        for i in range(5):
+            yield b'{"chunk": %d}\n' % i
+
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+
+async def encoded(request):
+    return Response(gzip.compress(b"x" * 5000), headers={"content-encoding": "gzip"}, media_type="text/plain")
+
+
+async def partial(request):
+    return Response(b"x" * 5000, status_code=206, media_type="text/plain",
+                    headers={"content-range": "bytes 0-4999/10000"})
+
+
+async def malformed(request):
+    return Response(b"x" * 5000, media_type="text/plain", headers={"content-length": "5000, 5000"})
+
+
+def get(path: str, accept_encoding: str) -> httpx.Response:
+    app = CompressionMiddleware(Starlette(routes=[Route("/large", large), Route("/small", small),
+                                                  Route("/stream", stream), Route("/encoded", encoded),
+                                                  Route("/partial", partial), Route("/malformed", malformed)]),
+                                minimum_size=1024)
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway") as client:
+            return await client.get(path, headers={"accept-encoding": accept_encoding})
+
+    return asyncio.run(request())
+
+
+def test_negotiation_follows_q_values_then_gateway_preference():
+    preferred = next(iter(ENCODERS))
+    assert negotiate("gzip, br, zstd").name == preferred
+    assert negotiate("gzip;q=1, br;q=0.5, zstd;q=0.1").name == "gzip"
+    assert negotiate("*").name == preferred
+    assert negotiate("gzip;q=0, identity") is None
+    assert negotiate(None) is None
+
+
+def test_middleware_compresses_large_and_streamed_bodies_only():
+    response = get("/large", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"v1"'
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert response.json() == LARGE
+
+    assert "content-encoding" not in get("/small", "gzip").headers
+    assert "content-encoding" not in get("/large", "identity").headers
+
+    streamed = get("/stream", "gzip")
+    assert streamed.headers["content-encoding"] == "gzip"
+    assert "content-length" not in streamed.headers
+    assert streamed.text.splitlines() == ['{"chunk": %d}' % i for i in range(5)]
+
+    # Already encoded by the upstream: passed through untouched
+    assert get("/encoded", "br, zstd, gzip").content == b"x" * 5000
+
+
+def test_partial_responses_are_not_compressed():
+    response = get("/partial", "gzip")
+    assert response.status_code == 206
+    assert "content-encoding" not in response.headers
+    assert response.headers["content-range"] == "bytes 0-4999/10000"
+    assert response.content == b"x" * 5000
+
+
+def test_malformed_content_length_is_ignored():
+    response = get("/malformed", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.content == b"x" * 5000
+
+
+def test_cached_entries_are_compressed_once():
+    calls = []
+    encoder = Encoder("gzip", lambda data: calls.append(data) or gzip.compress(data), lambda: None)
+    cache = ResponseCache(max_bytes=1 << 20, max_entry_bytes=1 << 20)
+    entry = CachedResponse(200, [(b"content-type", b"application/json")], b"{}" * 1000, ())
+    cache.put("GET /a?", {}, entry)
+    size = cache.size
+
+    body = entry.encoded(encoder)
+    assert entry.encoded(encoder) is body
+    assert len(calls) == 1
+    assert cache.size == size + len(body)
+    cache.invalidate("GET /a?")
+    assert cache.size == 0
+    assert encoded_headers([(b"vary", b"Origin")], "br", 10) == [
+        (b"vary", b"Origin, Accept-Encoding"), (b"content-encoding", b"br"), (b"content-length", b"10")]
+
+
+def test_compressed_variants_count_against_the_cache_limits():
+    encoder = Encoder("gzip", gzip.compress, lambda: None)
+    first, second = (CachedResponse(200, [], bytes(range(256)) * 4, ()) for _ in range(2))
+    cache = ResponseCache(max_bytes=first.size + second.size + 100, max_entry_bytes=first.size + 100)
+    cache.put("GET /a?", {}, first)
+    cache.put("GET /b?", {}, second)
+
+    # Incompressible: the variant does not fit in an entry and is not kept
+    assert gzip.decompress(first.encoded(encoder)) == first.body
+    assert first.encodings == {} and cache.evictions == 0
+
+    # A variant that fits in the entry but not in the cache evicts the least recently used entry
+    cache.max_entry_bytes = 1 << 20
+    second.encoded(encoder)
+    assert "gzip" in second.encodings
+    assert cache.evictions == 1 and cache.get("GET /a?", {}) is None
+    assert cache.size == second.size <= cache.max_bytes
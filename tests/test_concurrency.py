@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from config.config import config
+from core.client import upstream_clients
+from core.concurrency import AdaptiveLimiter, LoadShedError, concurrency_limits
+from core.resilience import DeadlineExceeded
+from core.utils import forward_request
+
+# The upstream stand-in serves CAPACITY requests at a time in BASE_LATENCY seconds; past that, every request it
+# holds slows down in proportion, like a server whose CPU is shared by all of them
+CAPACITY = 4
+BASE_LATENCY = 0.05
+CLIENTS = 100
+DURATION = 2.0
+
+
+class SlowUpstream:
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        try:
+            await asyncio.sleep(BASE_LATENCY * max(1.0, self.active / CAPACITY))
+            return httpx.Response(200, json={"ok": True})
+        finally:
+            self.active -= 1
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = SlowUpstream()
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(upstream.handler))
+    monkeypatch.setattr(config, "CONCURRENCY_LIMIT_INITIAL", CAPACITY)
+    monkeypatch.setattr(config, "CONCURRENCY_LIMIT_MIN", 2)
+    monkeypatch.setattr(config, "CONCURRENCY_QUEUE_SIZE", 20)
+    monkeypatch.setattr(config, "CONCURRENCY_QUEUE_TIMEOUT", 0.25)
+    concurrency_limits.clear()
+    yield upstream
+    concurrency_limits.clear()
+
+
+def overload() -> tuple[list[float], list[float]]:
+    """
+    CLIENTS clients call the upstream back to back for DURATION seconds; returns the latencies of the calls that
+    were answered and of the ones that were shed.
+    """
+    answered = []
+    shed = []
+
+    async def client():
+        until = time.perf_counter() + DURATION
+        while (started := time.perf_counter()) < until:
+            try:
+                await forward_request("http://slow/work", "GET", headers={}, timeout=5)
+                answered.append(time.perf_counter() - started)
+            except HTTPException as e:
+                assert e.status_code == 503
+                shed.append(time.perf_counter() - started)
+                # A shed client backs off briefly, as it would on a 503 with Retry-After
+                await asyncio.sleep(0.1)
+
+    async def run():
+        await asyncio.gather(*(client() for _ in range(CLIENTS)))
+
+    asyncio.run(run())
+    return sorted(answered), sorted(shed)
+
+
+def p99(latencies: list[float]) -> float:
+    return latencies[int(len(latencies) * 0.99)]
+
+
+def test_latency_stays_bounded_under_overload(upstream, monkeypatch):
+    answered, shed = overload()
+    limited_peak = upstream.peak
+    assert answered and shed
+    # Shed calls are turned away within the queue timeout instead of waiting for the upstream; the latencies are
+    # only compared with each other, since wall-clock times depend on the machine's load
+    assert p99(shed) < p99(answered)
+    assert limited_peak < CLIENTS / 2
+
+    monkeypatch.setattr(config, "CONCURRENCY_LIMIT_ENABLED", False)
+    upstream.peak = 0
+    unlimited, not_shed = overload()
+    assert not not_shed
+    assert upstream.peak == CLIENTS
+    # Without a limit every call queues inside the upstream
+    assert p99(unlimited) > 2 * p99(answered)
+
+
+def test_limit_grows_at_steady_latency_and_shrinks_as_it_rises():
+    limiter = AdaptiveLimiter("test", initial=20, min_limit=2, max_limit=100, tolerance=1.5, queue_size=10,
+                              queue_timeout=1.0)
+
+    def release(rtt: float, calls: int = 50):
+        # Calls completing while the whole limit is in use
+        for _ in range(calls):
+            limiter.inflight = limiter.capacity
+            limiter.release(rtt)
+
+    release(0.01)
+    grown = limiter.limit
+    assert grown > 20
+    release(0.1)
+    assert limiter.limit < grown / 2
+    shrunk = limiter.limit
+    limiter.inflight = 1
+    limiter.release(None, dropped=True)
+    assert limiter.limit == pytest.approx(shrunk * 0.9)
+
+
+def test_waiting_calls_are_ordered_and_shed_by_priority():
+    async def run():
+        limiter = AdaptiveLimiter("test", initial=1, min_limit=1, max_limit=1, tolerance=1.5, queue_size=2,
+                                  queue_timeout=1.0)
+        await limiter.acquire(1)
+        batch = [asyncio.ensure_future(limiter.acquire(2)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # A full queue: a higher priority call takes the place of the latest lower priority one
+        critical = asyncio.ensure_future(limiter.acquire(0))
+        await asyncio.sleep(0.01)
+        with pytest.raises(LoadShedError):
+            await batch[1]
+        # and a call of the lowest priority queued is shed right away
+        with pytest.raises(LoadShedError):
+            await limiter.acquire(2)
+
+        limiter.release(0.01)
+        await asyncio.sleep(0.01)
+        assert critical.done() and not batch[0].done()
+        limiter.release(0.01)
+        await batch[0]
+
+        with pytest.raises(DeadlineExceeded):
+            await limiter.acquire(1, timeout=0.01)
+        limiter.queue_timeout = 0.01
+        with pytest.raises(LoadShedError):
+            await limiter.acquire(1)
+        assert limiter.queued == 0
+
+    asyncio.run(run())
+
+
+def test_priority_comes_from_the_token_claim():
+    assert concurrency_limits.priority({"priority": "critical"}) == 0
+    assert concurrency_limits.priority({}) == 1
+    assert concurrency_limits.priority({"priority": "unknown"}) == 1
+    assert concurrency_limits.priority({"priority": "batch"}) == 2
+    assert concurrency_limits.priority({"priority": ["critical"]}) == 1
+    assert concurrency_limits.priority({"priority": {"class": "critical"}}) == 1
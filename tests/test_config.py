@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+from pydantic import ValidationError
+
+from config.config import Config, Settings, load_settings
+
+ENVIRON = {"JWT_SECRET": "test-secret"}
+
+
+def test_environment_overrides_the_settings_file(tmp_path):
+    settings_file = tmp_path / "settings.json"
+    settings_file.write_text(json.dumps({"PORT": 9000, "WORKERS": 4, "TRACING_EXPORTER": "OTLP",
+                                         "SERVICE_A_URL": "http://a:1"}))
+    settings = load_settings({**ENVIRON, "SETTINGS_FILE": str(settings_file), "PORT": "9100",
+                              "SERVICE_B_URLS": "http://b:1, http://b:2,", "JWT_PUBLIC_KEY": "line\\nbreak"})
+    assert (settings.PORT, settings.WORKERS, settings.TRACING_EXPORTER) == (9100, 4, "otlp")
+    assert settings.SERVICE_A_URLS == ("http://a:1",)
+    assert settings.SERVICE_B_URLS == ("http://b:1", "http://b:2")
+    assert settings.JWT_PUBLIC_KEY == "line\nbreak"
+    assert load_settings(ENVIRON).PORT == Settings.model_fields["PORT"].default
+
+    settings_file.write_text(json.dumps({"PROT": 9000}))
+    with pytest.raises(ValueError, match="PROT"):
+        load_settings({**ENVIRON, "SETTINGS_FILE": str(settings_file)})
+
+
+@pytest.mark.parametrize("name, value", [("PORT", "eighty"), ("DEBUG", "maybe"), ("TRACING_EXPORTER", "zipkin"),
+                                         ("UPSTREAM_BALANCER", "random")])
+def test_invalid_settings_are_rejected(name, value):
+    with pytest.raises(ValidationError, match=name):
+        load_settings({**ENVIRON, name: value})
+
+
+def test_hmac_tokens_need_a_secret():
+    with pytest.raises(ValidationError, match="JWT_SECRET"):
+        load_settings({})
+    assert load_settings({"JWT_JWKS_URL": "https://issuer/jwks"}).JWT_SECRET
+    # In debug mode a secret is made up once per process
+    assert load_settings({"DEBUG": "true"}).JWT_SECRET == load_settings({"DEBUG": "true"}).JWT_SECRET
+
+
+def test_reload_swaps_the_whole_snapshot(tmp_path, monkeypatch):
+    settings_file = tmp_path / "settings.json"
+    settings_file.write_text(json.dumps({"ACCESS_LOG_SAMPLE_RATE": 0.5, "HEDGE_MIN_DELAY": 0.01}))
+    monkeypatch.setenv("SETTINGS_FILE", str(settings_file))
+    config = Config()
+    snapshot = config.snapshot
+    assert config.ACCESS_LOG_SAMPLE_RATE == 0.5
+    with pytest.raises(ValidationError):
+        snapshot.ACCESS_LOG_SAMPLE_RATE = 0.1
+
+    settings_file.write_text(json.dumps({"ACCESS_LOG_SAMPLE_RATE": 0.1}))
+    config.reload()
+    assert config.ACCESS_LOG_SAMPLE_RATE == 0.1
+    assert config.HEDGE_MIN_DELAY == Settings.model_fields["HEDGE_MIN_DELAY"].default
+    assert snapshot.ACCESS_LOG_SAMPLE_RATE == 0.5
+
+    # A broken source keeps the settings in effect
+    settings_file.write_text(json.dumps({"ACCESS_LOG_SAMPLE_RATE": "often"}))
+    with pytest.raises(ValidationError):
+        config.reload()
+    assert config.ACCESS_LOG_SAMPLE_RATE == 0.1
+
+
+def test_disabled_features_are_not_imported():
+    deferred = ("redis", "opentelemetry.sdk", "opentelemetry.exporter")
+    probe = f"import sys, main; print([name for name in sys.modules if name.startswith({deferred!r})])"
+    environ = {**os.environ, "REDIS_URL": "", "TRACING_EXPORTER": "none", "DISCOVERY_PROVIDER": ""}
+    output = subprocess.run([sys.executable, "-c", probe], env=environ, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+
+import httpx
+
+from core.discovery import ConsulDiscovery, FileDiscovery
+from core.routing import Router
+
+
+def test_file_discovery_updates_pools_incrementally(tmp_path):
+    path = tmp_path / "services.json"
+    path.write_text(json.dumps({"service-a": ["http://a1:8001", {"url": "http://a2:8001", "weight": 2}]}))
+    router = Router()
+    pool = router.table.pools["service-a"]
+    base_url = pool.base_url
+    discovery = FileDiscovery(str(path), interval=60)
+
+    async def run():
+        await discovery.start(router.services, router.set_endpoints)
+        await asyncio.sleep(0)
+        await discovery.stop()
+
+    asyncio.run(run())
+    assert [(endpoint.url, endpoint.weight) for endpoint in pool.endpoints] == [("http://a1:8001", 1),
+                                                                                ("http://a2:8001", 2)]
+    assert pool.base_url == base_url
+    a2 = pool.endpoints[1]
+    a2.outstanding = 3
+
+    # Endpoints that remain keep their state; services missing from the file keep their configured endpoints
+    path.write_text(json.dumps({"service-a": ["http://a2:8001", "http://a3:8001"]}))
+    os.utime(path, (1, 1))
+    discovery.refresh()
+    assert [endpoint.url for endpoint in pool.endpoints] == ["http://a2:8001", "http://a3:8001"]
+    assert pool.endpoints[0] is a2 and a2.outstanding == 3 and a2.weight == 1
+    assert router.table.pools["service-b"].base_url == router.table.pools["service-b"].endpoints[0].url
+
+    # Discovered endpoints survive a reload of the route table
+    router.reload()
+    assert [endpoint.url for endpoint in router.table.pools["service-a"].endpoints] == ["http://a2:8001",
+                                                                                       "http://a3:8001"]
+
+
+def test_consul_discovery_follows_blocking_queries():
+    instances = {
+        10: [{"Node": {"Address": "10.0.0.1"}, "Service": {"Address": "", "Port": 8001}}],
+        11: [{"Node": {"Address": "10.0.0.1"}, "Service": {"Address": "", "Port": 8001}},
+             {"Node": {"Address": "10.0.0.2"}, "Service": {"Address": "10.1.0.2", "Port": 8001,
+                                                           "Weights": {"Passing": 3, "Warning": 1}}}],
+    }
+    queries = []
+
+    async def consul(request: httpx.Request) -> httpx.Response:
+        queries.append(dict(request.url.params))
+        index = int(request.url.params.get("index", 0))
+        if index >= 11:
+            # Nothing changes any more: hold the query like Consul does
+            await asyncio.sleep(60)
+        index += 1 if index else 10
+        return httpx.Response(200, json=instances[index], headers={"X-Consul-Index": str(index)})
+
+    changes = []
+    discovery = ConsulDiscovery("http://consul:8500", wait=30, transport=httpx.MockTransport(consul))
+
+    async def run():
+        await discovery.start(lambda: {"service-a"}, lambda service, endpoints: changes.append((service, endpoints)))
+        for _ in range(100):
+            if len(queries) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await discovery.stop()
+
+    asyncio.run(run())
+    assert queries == [{"passing": "true"},
+                       {"passing": "true", "index": "10", "wait": "30s"},
+                       {"passing": "true", "index": "11", "wait": "30s"}]
+    assert changes == [
+        ("service-a", [("http://10.0.0.1:8001", 1)]),
+        ("service-a", [("http://10.0.0.1:8001", 1), ("http://10.1.0.2:8001", 3)]),
+    ]
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+from config.config import config
+from core import health
+from core.health import HealthMonitor
+
+
+def test_checks_run_concurrently_with_a_timeout(monkeypatch):
+    async def check(url):
+        await asyncio.sleep(10 if "slow" in url else 0.05)
+        return True
+
+    monkeypatch.setattr(health, "check_service_health", check)
+    monkeypatch.setattr(config, "HEALTH_CHECK_TIMEOUT", 0.2)
+    targets = {f"up-{i}": f"http://up-{i}/health" for i in range(10)}
+    monitor = HealthMonitor(lambda: {**targets, "slow": "http://slow/health"}, interval=60,
+                            unhealthy_threshold=1, healthy_threshold=1)
+
+    start = time.perf_counter()
+    snapshot = asyncio.run(monitor.snapshot())
+    assert time.perf_counter() - start < 0.5
+    assert snapshot["up-0"]["healthy"] is True
+    assert snapshot["slow"]["healthy"] is False
+    assert not monitor.is_healthy("slow")
+    assert monitor.is_healthy("unknown")
+
+
+def test_thresholds_prevent_flapping(monkeypatch):
+    results = iter([True, False, False, True])
+
+    async def check(url):
+        return next(results)
+
+    monkeypatch.setattr(health, "check_service_health", check)
+    monitor = HealthMonitor(lambda: {"a": "http://a/health"}, interval=60, unhealthy_threshold=2,
+                            healthy_threshold=1)
+
+    async def rounds():
+        states = []
+        for _ in range(4):
+            await monitor.check_all()
+            states.append(monitor.is_healthy("a"))
+        return states
+
+    assert asyncio.run(rounds()) == [True, True, False, True]
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from config.config import config
+from core.client import upstream_clients
+from core.concurrency import concurrency_limits
+from core.hedging import MIN_SAMPLES, LatencyWindow, hedged
+from core.routing import RouteTable, RouteTableConfig
+from core.utils import forward_request
+
+
+def catalog(hedge: dict = None):
+    table = RouteTable(RouteTableConfig.model_validate({
+        "upstreams": {"catalog": {"endpoints": ["http://slow", "http://fast"], "balancer": "round_robin"}},
+        "routes": [{"name": "catalog", "prefix": "/catalog", "upstream": "catalog", "hedge": hedge}],
+    }))
+    return table.routes[0]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    http://slow answers after 0.3 seconds, http://fast right away; returns the hosts that were called and the
+    ones whose call was cancelled.
+    """
+    calls = {"called": [], "cancelled": []}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls["called"].append(request.url.host)
+        try:
+            await asyncio.sleep(0.3 if request.url.host == "slow" else 0.001)
+        except asyncio.CancelledError:
+            calls["cancelled"].append(request.url.host)
+            raise
+        return httpx.Response(200, json={"from": request.url.host})
+
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(handler))
+    concurrency_limits.clear()
+    yield calls
+    concurrency_limits.clear()
+
+
+def get(route, method: str = "GET"):
+    async def run():
+        started = time.perf_counter()
+        data, _ = await hedged(route, method, {}, None,
+                               lambda endpoint: forward_request(endpoint.rebase(route.url_for("/items")), method,
+                                                                headers={}, timeout=5, route=route.name,
+                                                                endpoint=endpoint))
+        return data["from"], time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def test_slow_call_is_hedged_to_another_endpoint(upstream):
+    route = catalog({"delay": 0.05})
+    answered_by, latency = get(route)
+    assert answered_by == "fast"
+    assert 0.05 <= latency < 0.2
+    # The slow call was cancelled, and is not held against its endpoint
+    assert upstream == {"called": ["slow", "fast"], "cancelled": ["slow"]}
+    slow, fast = route.endpoints.endpoints
+    assert slow.outstanding == fast.outstanding == 0
+    assert slow.failures == 0 and slow.latency is None
+
+    # Other methods are never hedged
+    answered_by, latency = get(route, "DELETE")
+    assert answered_by == "slow" and latency >= 0.3
+
+
+def test_hedges_are_capped_by_the_budget(upstream, monkeypatch):
+    monkeypatch.setattr(config, "HEDGE_BUDGET_RATIO", 0.0)
+    monkeypatch.setattr(config, "HEDGE_BUDGET_MIN_PER_SECOND", 0.1)
+    route = catalog({"delay": 0.05})
+    # A single hedge over the budget's 10 second window: the next slow call is left to answer on its own
+    assert get(route)[0] == "fast"
+    answered_by, latency = get(route)
+    assert answered_by == "slow" and latency >= 0.3
+    assert upstream["called"] == ["slow", "fast", "slow"]
+
+
+def test_hedge_delay_follows_the_observed_latency(upstream):
+    route = catalog({"percentile": 0.9})
+    hedging = route.hedging
+    assert hedging.hedge_delay() is None
+    for i in range(MIN_SAMPLES):
+        hedging.latencies.record(0.01 if i % 10 else 0.5)
+    assert hedging.hedge_delay() == 0.5
+
+    window = LatencyWindow(100)
+    for _ in range(100):
+        window.record(0.01)
+    assert window.percentile(0.95) == 0.01
+    # The percentile is kept until a tenth of the window was replaced
+    for _ in range(9):
+        window.record(1.0)
+    assert window.percentile(0.95) == 0.01
+    window.record(1.0)
+    assert window.percentile(0.95) == 1.0
+
+    with pytest.raises(ValueError):
+        RouteTable(RouteTableConfig.model_validate({
+            "upstreams": {"catalog": "http://fast"},
+            "routes": [{"name": "catalog", "prefix": "/catalog", "hedge": {},
+                        "composite": {"calls": [{"name": "a", "upstream": "catalog", "path": "/"}]}}],
+        }))
@@ -1,11 +1,6 @@
-import httpx
 import jwt
 import pytest
-from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from fastapi_limiter import FastAPILimiter
-from redis.asyncio import Redis
-from tenacity import retry, stop_after_attempt, wait_fixed
 from json import JSONDecodeError
 
 from config.config import config
@@ -13,17 +8,8 @@ from main import app
 
 
 @pytest.fixture(scope="session")
-async def setup_limiter():
-    """Initializes the Rate limiter."""
-    redis = Redis.from_url(config.REDIS_URL)
-    await FastAPILimiter.init(redis)
-    yield redis
-    await redis.close()
-
-
-@pytest.fixture(scope="session")
-def client(setup_limiter):
-    """Initialize a test client with FastAPILimiter initialized in a test fixture."""
+def client():
+    """Initialize a test client."""
     return TestClient(app)
 
 
@@ -33,28 +19,6 @@ def get_auth_token():
     return f"Bearer {token}"
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_fixed(1))
-async def forward_request(url: str, method: str, headers: dict, data: dict = None, params: dict = None):
-    """
-    Forwards the request to the specified URL. Includes retry logic.
-    """
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=data,
-                params=params,
-            )
-            response.raise_for_status()
-            return response.json(), response.status_code
-    except httpx.HTTPStatusError as e:
-        if e.response.status_code == 404:
-            raise HTTPException(status_code=404, detail=f"Error communicating with upstream: {e}")
-        raise
-
-
 def test_health_check_returns_service_status(client):
     response = client.get("/health")
     assert response.status_code == 200
@@ -270,3 +234,12 @@ def test_too_little_data_for_declared_content_length_error(client):
         assert response.json() == {"detail": "Too little data for declared Content-Length"}
     except JSONDecodeError:
         assert response.content == b''
+
+
+def test_metrics_count_gateway_requests(client):
+    client.get("/service-a/some-path")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'gateway_authentications_total{result="missing"}' in response.text
+    assert 'gateway_requests_total{method="GET",route="/{path:path}",status="401"}' in response.text
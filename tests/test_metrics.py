@@ -0,0 +1,54 @@
+import json
+import os
+
+from core.metrics import Registry
+
+
+def build_registry(directory: str = "") -> Registry:
+    registry = Registry(directory=directory)
+    requests = registry.counter("requests_total", "Requests.", ("route", "status"))
+    duration = registry.histogram("duration_seconds", "Duration.", ("route",), buckets=(0.1, 1.0))
+    connections = registry.gauge("connections", "Connections.", ("upstream",))
+    requests.inc(("a", 200))
+    requests.inc(("a", 200))
+    duration.observe(0.05, ("a",))
+    duration.observe(0.1, ("a",))
+    duration.observe(5.0, ("a",))
+    connections.set(("http://a",), 3)
+    return registry
+
+
+def test_render_prometheus_text():
+    text = build_registry().render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="a",status="200"} 2' in text
+    # Buckets are cumulative and an observation equal to a bound falls in that bucket
+    assert 'duration_seconds_bucket{route="a",le="0.1"} 2' in text
+    assert 'duration_seconds_bucket{route="a",le="1.0"} 2' in text
+    assert 'duration_seconds_bucket{route="a",le="+Inf"} 3' in text
+    assert 'duration_seconds_count{route="a"} 3' in text
+    assert 'duration_seconds_sum{route="a"} 5.15' in text
+    assert 'connections{upstream="http://a"} 3' in text
+
+
+def test_collectors_run_on_snapshot():
+    registry = Registry()
+    breakers = registry.gauge("breaker_state", "Breaker state.", ("breaker",), aggregate="max")
+    registry.collector(lambda: breakers.set(("a",), 2))
+    assert registry.snapshot()["breaker_state"] == [[["a"], 2]]
+
+
+def test_workers_are_merged_and_gauges_of_exited_workers_dropped(tmp_path):
+    worker = build_registry(str(tmp_path))
+    worker.write()
+    # Pretend the snapshot came from a live worker (pid 1) and from one that has exited
+    snapshot = json.loads((tmp_path / f"{os.getpid()}.json").read_text())
+    (tmp_path / "1.json").write_text(json.dumps(snapshot))
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "999999999.json")
+    # Files that are not worker snapshots are skipped
+    (tmp_path / "settings.json").write_text(json.dumps(snapshot))
+
+    text = build_registry(str(tmp_path)).render()
+    assert 'requests_total{route="a",status="200"} 6' in text
+    assert 'duration_seconds_bucket{route="a",le="+Inf"} 9' in text
+    assert 'connections{upstream="http://a"} 6' in text
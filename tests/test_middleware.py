@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind, StatusCode
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from config.config import config
+from core import middleware
+from core.access_log import AccessLog
+from core.client import upstream_clients
+from core.metrics import REQUESTS
+from core.tracing import tracing
+from core.utils import forward_request
+from main import app as gateway
+
+CALLER = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+
+
+async def orders(request):
+    request.state.route = "orders"
+    data, _ = await forward_request("http://orders/items", "GET", headers={}, route="orders")
+    return JSONResponse({**data, "padding": "x" * 2000})
+
+
+async def missing(request):
+    raise HTTPException(status_code=404, detail="No such order")
+
+
+async def broken(request):
+    request.state.route = "broken"
+    raise RuntimeError("boom")
+
+
+# The gateway's own middleware stack, in the same order, around endpoints that answer, refuse and fail
+app = Starlette(routes=[Route("/orders", orders), Route("/missing", missing), Route("/broken", broken)],
+                middleware=gateway.user_middleware)
+
+
+@pytest.fixture
+def stack(monkeypatch, tmp_path):
+    """
+    Traces every request and logs every one of them; returns the access log, the span exporter and the trace
+    context the upstream received.
+    """
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received.append(request.headers.get("traceparent"))
+        return httpx.Response(200, json={"items": [1, 2]})
+
+    log = AccessLog(max_size=100, flush_interval=60, path=str(tmp_path / "access.log"))
+    monkeypatch.setattr(middleware, "access_log", log)
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(handler))
+    monkeypatch.setattr(config, "ACCESS_LOG_ENABLED", True)
+    monkeypatch.setattr(config, "ACCESS_LOG_SAMPLE_RATE", 1.0)
+    monkeypatch.setattr(config, "ACCESS_LOG_BODY_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(config, "TRACING_SAMPLE_RATIO", 1.0)
+    return log, InMemorySpanExporter(), received
+
+
+def send(stack, *paths: str, headers: dict = None) -> list[httpx.Response]:
+    log, exporter, _ = stack
+
+    async def scenario():
+        tracing.start(exporter)
+        try:
+            # Exceptions raised by the app are answered with a 500, as the server would
+            transport = httpx.ASGITransport(app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://gateway") as client:
+                return [await client.get(path, headers=headers) for path in paths]
+        finally:
+            await tracing.stop()
+            await log.start()
+            await log.stop()
+
+    return asyncio.run(scenario())
+
+
+def entries(log: AccessLog) -> list[dict]:
+    with open(log.path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def test_requests_are_logged_traced_and_compressed(stack):
+    log, exporter, received = stack
+    response, = send(stack, "/orders", headers={"traceparent": CALLER, "accept-encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["items"] == [1, 2]
+
+    entry, = entries(log)
+    assert {key: entry[key] for key in ("method", "path", "route", "status", "request_bytes")} == {
+        "method": "GET", "path": "/orders", "route": "orders", "status": 200, "request_bytes": 0}
+    # Counted after compression, as sent
+    assert entry["response_bytes"] == response.num_bytes_downloaded < len(response.content)
+    assert entry["duration_ms"] > 0
+
+    server, = [span for span in exporter.get_finished_spans() if span.kind == SpanKind.SERVER]
+    client, = [span for span in exporter.get_finished_spans() if span.kind == SpanKind.CLIENT]
+    assert server.name == "GET orders"
+    assert f"{server.context.trace_id:032x}" == "0af7651916cd43dd8448eb211c80319c"
+    assert received == [f"00-{client.context.trace_id:032x}-{client.context.span_id:016x}-01"]
+
+
+def test_errors_are_answered_logged_and_traced(stack):
+    log, exporter, received = stack
+    failures = REQUESTS._values.get(("GET", "broken", 500), 0)
+    refused, failed = send(stack, "/missing", "/broken")
+    assert refused.status_code == 404
+    assert refused.text == "No such order"
+    assert failed.status_code == 500
+
+    assert [(entry["path"], entry["route"], entry["status"]) for entry in entries(log)] == [
+        ("/missing", None, 404), ("/broken", "broken", 500)]
+    assert REQUESTS._values[("GET", "broken", 500)] == failures + 1
+
+    spans = {span.attributes["http.target"]: span for span in exporter.get_finished_spans()}
+    assert spans["/missing"].attributes["http.status_code"] == 404
+    assert spans["/missing"].status.status_code != StatusCode.ERROR
+    assert spans["/broken"].status.status_code == StatusCode.ERROR
+    assert spans["/broken"].events[0].attributes["exception.message"] == "boom"
+    assert received == []
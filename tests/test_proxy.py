@@ -0,0 +1,133 @@
+import asyncio
+
+import httpx
+import jwt
+import pytest
+
+from config.config import config
+from core.cache import response_cache
+from core.client import upstream_clients
+from core.concurrency import concurrency_limits
+from core.routing import RouteTable, RouteTableConfig, router
+from main import app
+
+BINARY = bytes(range(256)) * 64
+
+
+async def chunks(body: bytes, size: int = 1024):
+    """
+    A streamed body, as a real upstream connection delivers it (in-memory bodies of mock responses are read
+    before the gateway sees them).
+    """
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """
+    The upstream of the `files` route; returns the requests it received.
+    /binary answers with raw bytes (without a Content-Length) and hop-by-hop headers, /cached with a small
+    cacheable JSON body, anything else with an empty JSON object.
+    """
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received.append(request)
+        await asyncio.sleep(0.05)
+        if request.url.path == "/cached":
+            return httpx.Response(200, content=chunks(b'{"ok":true}'), headers={
+                "content-type": "application/json", "content-length": "11", "cache-control": "public, max-age=60"})
+        if request.url.path == "/binary":
+            return httpx.Response(200, content=chunks(BINARY), headers={
+                "content-type": "application/octet-stream", "x-checksum": "abc",
+                "connection": "close", "keep-alive": "timeout=5", "proxy-authenticate": "Basic"})
+        await request.aread()
+        return httpx.Response(200, content=chunks(b"{}"), headers={"content-type": "application/json"})
+
+    table = RouteTable(RouteTableConfig.model_validate({
+        "upstreams": {"files": "http://files"},
+        "routes": [{"name": "files", "prefix": "/files", "upstream": "files"},
+                   {"name": "users", "regex": "^/users/(?P<id>\\d+)$", "upstream": "files",
+                    "rewrite": "/some-path?user=\\g<id>"}],
+    }))
+    monkeypatch.setattr(router, "_table", table)
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(handler))
+    monkeypatch.setattr(config, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setattr(config, "STREAMING_PROXY", True)
+    response_cache.clear()
+    concurrency_limits.clear()
+    yield received
+    response_cache.clear()
+    concurrency_limits.clear()
+
+
+def call(method: str, path: str, headers: dict = None, content: bytes = None, count: int = 1):
+    """
+    Sends the request `count` times concurrently; returns the response, or the list of responses with `count`.
+    """
+    token = jwt.encode({"sub": "user"}, config.JWT_SECRET, algorithm=config.JWT_ALGORITHM)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway") as client:
+            return await asyncio.gather(*(
+                client.request(method, path, content=content,
+                               headers={"authorization": f"Bearer {token}", **(headers or {})})
+                for _ in range(count)))
+
+    responses = asyncio.run(scenario())
+    return responses if count > 1 else responses[0]
+
+
+def test_binary_responses_pass_through_untouched(upstream):
+    response = call("GET", "/files/binary", headers={"accept-encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content == BINARY
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-checksum"] == "abc"
+    # Hop-by-hop headers of the upstream connection stay there
+    assert "keep-alive" not in response.headers and "proxy-authenticate" not in response.headers
+    assert upstream[0].url == "http://files/binary"
+
+
+def test_request_bodies_stream_upstream_without_hop_by_hop_headers(upstream):
+    body = b"\x00\x01 not json \xfe"
+    response = call("POST", "/files/upload?x=1&y=2", content=body,
+                    headers={"content-type": "application/x-raw", "x-custom": "kept", "keep-alive": "timeout=5",
+                             "te": "trailers", "proxy-authorization": "Basic secret"})
+    assert response.status_code == 200
+    request = upstream[0]
+    assert request.url == "http://files/upload?x=1&y=2"
+    assert request.content == body
+    assert request.headers["content-type"] == "application/x-raw"
+    assert request.headers["x-custom"] == "kept"
+    assert not {"keep-alive", "te", "proxy-authorization"} & request.headers.keys()
+    # The host is the upstream's, not the gateway's
+    assert request.headers["host"] == "files"
+
+
+def test_only_small_cacheable_responses_are_shared_by_coalesced_requests(upstream, monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_ENABLED", False)
+    responses = call("GET", "/files/cached", count=3)
+    assert [response.json() for response in responses] == [{"ok": True}] * 3
+    assert len(upstream) == 1
+
+    # Without a Content-Length the body is streamed: one caller gets the response, the others their own
+    upstream.clear()
+    responses = call("GET", "/files/binary", {"accept-encoding": "identity"}, count=3)
+    assert all(response.content == BINARY for response in responses)
+    assert len(upstream) == 3
+
+    # As are bodies larger than a cache entry
+    upstream.clear()
+    monkeypatch.setattr(response_cache, "max_entry_bytes", 10)
+    responses = call("GET", "/files/cached", count=3)
+    assert [response.json() for response in responses] == [{"ok": True}] * 3
+    assert len(upstream) == 3
+
+
+def test_client_query_is_added_to_the_query_of_a_rewrite(upstream):
+    assert call("GET", "/users/12?x=1").status_code == 200
+    assert call("GET", "/users/12").status_code == 200
+    assert [str(request.url) for request in upstream] == ["http://files/some-path?user=12&x=1",
+                                                          "http://files/some-path?user=12"]
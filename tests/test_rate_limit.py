@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from core.rate_limit import RateLimiter, TokenBucket, parse_rate
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def test_parse_rate():
+    assert parse_rate("100/minute") == (100, 60)
+    assert parse_rate("5/seconds") == (5, 1)
+    assert parse_rate("1000/hour") == (1000, 3600)
+    with pytest.raises(ValueError):
+        parse_rate("10/fortnight")
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(capacity=2, period=1, now=0.0)
+    assert bucket.try_acquire(0.0) and bucket.try_acquire(0.0)
+    assert not bucket.try_acquire(0.0)
+    assert bucket.retry_after() == pytest.approx(0.5)
+    assert bucket.try_acquire(0.5)
+
+
+def test_limit_is_enforced_locally_and_raises_429():
+    limiter = RateLimiter(prefix="test:", sync_interval=60)
+    assert [limiter.allow("route:alice", "3/minute") == 0 for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("route:bob", "3/minute") == 0
+
+    with pytest.raises(HTTPException) as exc:
+        limiter.check("route:alice", "3/minute")
+    assert exc.value.status_code == 429
+    assert int(exc.value.headers["Retry-After"]) >= 1
+
+    # A reload that changes the route's rate applies to the keys already seen
+    assert limiter.allow("route:alice", "5/minute") == 0
+    assert limiter._limits["route:alice"].limit == 5
+
+
+def test_workers_share_the_limit_through_redis():
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        workers = [RateLimiter(prefix="test:", sync_interval=60) for _ in range(2)]
+        for worker in workers:
+            worker.redis = redis
+
+        # Each worker admits 6 of the 10 allowed requests before they have synced
+        first = [worker.allow("route:alice", "10/minute") == 0 for worker in workers for _ in range(6)]
+        # The first worker to sync only learns about the other's requests on its next sync
+        for worker in workers * 2:
+            await worker.sync()
+        second = [worker.allow("route:alice", "10/minute") == 0 for worker in workers]
+        return first, second, int(await redis.get(f"test:route:alice:{workers[0]._limits['route:alice'].window}"))
+
+    first, second, counted = asyncio.run(scenario())
+    assert all(first)
+    assert second == [False, False]
+    assert counted == 12
+
+
+def test_unsynced_requests_are_kept_when_redis_fails():
+    class BrokenRedis:
+        def pipeline(self, transaction=False):
+            raise ConnectionError("redis is down")
+
+    async def scenario():
+        limiter = RateLimiter(prefix="test:", sync_interval=60)
+        limiter.redis = BrokenRedis()
+        limiter.allow("route:alice", "10/minute")
+        await limiter.sync()
+        return limiter._limits["route:alice"].pending
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_idle_keys_are_dropped_without_redis():
+    limiter = RateLimiter(prefix="test:", sync_interval=60)
+    for client in range(1000):
+        limiter.allow(f"read_item:10.0.{client // 256}.{client % 256}", "2/second")
+    limiter.allow("route:alice", "2/second")
+    for state in limiter._limits.values():
+        state.used_at -= 2
+    limiter.allow("route:alice", "2/second")
+
+    asyncio.run(limiter.sync())
+    assert list(limiter._limits) == ["route:alice"]
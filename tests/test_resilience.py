@@ -0,0 +1,156 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from core.resilience import (CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, RetryBudget,
+                             RetryPolicy, request_timeout)
+
+URL = "http://upstream:8000/items"
+
+
+def make_policy(max_attempts=3):
+    return RetryPolicy(max_attempts=max_attempts, backoff_base=0.001, backoff_max=0.002)
+
+
+def make_breaker(threshold=5):
+    return CircuitBreaker("upstream", failure_threshold=threshold, reset_timeout=60)
+
+
+def responder(*outcomes):
+    """
+    Returns a `send` callable that yields the given status codes or raises the given exceptions in turn.
+    """
+    calls = []
+
+    async def send(timeout):
+        outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+        calls.append(timeout)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome)
+
+    return send, calls
+
+
+def test_breaker_opens_then_probes_and_closes():
+    breaker = CircuitBreaker("upstream", failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker("upstream", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    breaker = make_breaker(threshold=1)
+    send, calls = responder(404)
+    response = asyncio.run(make_policy().call(URL, "GET", send, breaker, Deadline(None)))
+    assert response.status_code == 404
+    assert len(calls) == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_idempotent_requests_are_retried():
+    send, calls = responder(503, httpx.ReadTimeout("slow"), 200)
+    response = asyncio.run(make_policy().call(URL, "GET", send, make_breaker(), Deadline(None)))
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_post_only_retried_when_not_sent():
+    send, calls = responder(503, 200)
+    response = asyncio.run(make_policy().call(URL, "POST", send, make_breaker(), Deadline(None)))
+    assert response.status_code == 503
+    assert len(calls) == 1
+
+    send, calls = responder(httpx.ConnectError("refused"), 200)
+    response = asyncio.run(make_policy().call(URL, "POST", send, make_breaker(), Deadline(None)))
+    assert response.status_code == 200
+    assert len(calls) == 2
+
+
+def test_streamed_bodies_are_never_resent():
+    send, calls = responder(httpx.ConnectError("refused"), 200)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(make_policy().call(URL, "PUT", send, make_breaker(), Deadline(None), replayable=False))
+    assert len(calls) == 1
+
+
+def test_open_breaker_short_circuits():
+    breaker = make_breaker(threshold=1)
+    breaker.record_failure()
+    send, calls = responder(200)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(make_policy().call(URL, "GET", send, breaker, Deadline(None)))
+    assert calls == []
+
+
+def test_retries_stop_at_the_deadline():
+    policy = RetryPolicy(max_attempts=10, backoff_base=0.05, backoff_max=0.05)
+    send, calls = responder(*[httpx.ConnectError("refused")] * 10)
+
+    with pytest.raises((httpx.ConnectError, DeadlineExceeded)):
+        asyncio.run(policy.call(URL, "GET", send, make_breaker(threshold=100), Deadline(0.1)))
+    assert 1 <= len(calls) < 10
+    assert all(0 < timeout <= 0.1 for timeout in calls)
+
+
+def test_retry_budget_caps_retries_to_a_share_of_traffic():
+    budget = RetryBudget(ratio=0.1, min_per_second=0)
+    for _ in range(100):
+        budget.record_request()
+    assert sum(budget.try_withdraw() for _ in range(50)) == 10
+
+
+def test_request_timeout_takes_the_smaller_deadline():
+    assert request_timeout({"x-request-timeout": "2.5"}, 10.0) == 2.5
+    assert request_timeout({"x-request-timeout": "20"}, 10.0) == 10.0
+    assert request_timeout({"x-request-timeout": "nope"}, None) is None
+    assert request_timeout({}, 3.0) == 3.0
+
+
+def test_cancelled_probe_frees_its_slot():
+    breaker = CircuitBreaker("upstream", failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    async def hang(timeout):
+        await asyncio.sleep(10)
+
+    async def run():
+        probe = asyncio.ensure_future(make_policy().call(URL, "GET", hang, breaker, Deadline(None)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(run())
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    breaker.release()
+
+    send, _ = responder(ValueError("broken"))
+    with pytest.raises(ValueError):
+        asyncio.run(make_policy().call(URL, "GET", send, breaker, Deadline(None)))
+    send, _ = responder(200)
+    assert asyncio.run(make_policy().call(URL, "GET", send, breaker, Deadline(None))).status_code == 200
+    assert breaker.state == CircuitBreaker.CLOSED
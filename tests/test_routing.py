@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from config.config import config
+from core.routing import RouteTable, RouteTableConfig, Router, load_route_table
+
+
+def build_table(routes, upstreams=None):
+    upstreams = upstreams or {"a": "http://a:8001", "b": "http://b:8002/"}
+    return RouteTable(RouteTableConfig.model_validate({"upstreams": upstreams, "routes": routes}))
+
+
+def test_prefix_route_strips_prefix():
+    table = build_table([{"prefix": "/service-a", "upstream": "a"}])
+    route, path = table.match("GET", "/service-a/some-path")
+    assert route.url_for(path) == "http://a:8001/some-path"
+
+
+def test_prefix_route_matches_whole_segments_only():
+    table = build_table([{"prefix": "/service-a", "upstream": "a"}])
+    assert table.match("GET", "/service-abc/some-path") is None
+    assert table.match("GET", "/service-c/some-path") is None
+
+
+def test_prefix_is_cut_by_segments_whatever_the_slashes():
+    table = build_table([{"prefix": "/service-a", "upstream": "a"},
+                         {"prefix": "/v2/a", "upstream": "b", "rewrite": "/api/v2"}])
+    for requested, forwarded in [("//service-a/x", "http://a:8001/x"), ("/service-a//x/", "http://a:8001//x/"),
+                                 ("//v2///a/x", "http://b:8002/api/v2/x"), ("//service-a", "http://a:8001/")]:
+        route, path = table.match("GET", requested)
+        assert route.url_for(path) == forwarded
+
+
+def test_longest_prefix_wins():
+    table = build_table([
+        {"prefix": "/api", "upstream": "a"},
+        {"prefix": "/api/orders", "upstream": "b"},
+    ])
+    route, path = table.match("GET", "/api/orders/42")
+    assert route.url_for(path) == "http://b:8002/42"
+    route, path = table.match("GET", "/api/users/42")
+    assert route.url_for(path) == "http://a:8001/users/42"
+
+
+def test_method_filter_falls_back_to_shorter_prefix():
+    table = build_table([
+        {"prefix": "/api", "upstream": "a"},
+        {"prefix": "/api/orders", "upstream": "b", "methods": ["post"]},
+    ])
+    assert table.match("POST", "/api/orders")[0].upstream == "b"
+    assert table.match("GET", "/api/orders")[0].upstream == "a"
+
+
+def test_prefix_rewrite():
+    table = build_table([{"prefix": "/v2/a", "upstream": "a", "rewrite": "/api/v2"}])
+    route, path = table.match("GET", "/v2/a/items")
+    assert route.url_for(path) == "http://a:8001/api/v2/items"
+
+
+def test_host_rules_take_precedence():
+    table = build_table([
+        {"prefix": "/", "upstream": "a"},
+        {"prefix": "/", "upstream": "b", "host": "internal.example.com"},
+    ])
+    assert table.match("GET", "/x", "internal.example.com:8080")[0].upstream == "b"
+    assert table.match("GET", "/x", "public.example.com")[0].upstream == "a"
+
+
+def test_regex_route_with_rewrite():
+    table = build_table([
+        {"prefix": "/service-a", "upstream": "a"},
+        {"regex": r"^/users/(?P<user_id>\d+)$", "upstream": "b", "rewrite": r"/accounts/\g<user_id>"},
+    ])
+    route, path = table.match("GET", "/users/7")
+    assert route.url_for(path) == "http://b:8002/accounts/7"
+    assert table.match("GET", "/users/abc") is None
+
+
+def test_unhealthy_upstream_is_skipped_unless_it_is_the_only_match():
+    table = build_table([
+        {"prefix": "/api", "upstream": "a"},
+        {"prefix": "/api/orders", "upstream": "b"},
+    ])
+    assert table.match("GET", "/api/orders/42", healthy=lambda url: url != "http://b:8002")[0].upstream == "a"
+    assert table.match("GET", "/api/orders/42", healthy=lambda url: False)[0].upstream == "b"
+    assert table.match("GET", "/other", healthy=lambda url: False) is None
+
+
+def test_invalid_route_is_rejected():
+    with pytest.raises(ValueError):
+        build_table([{"prefix": "/x", "regex": "^/x", "upstream": "a"}])
+    with pytest.raises(ValueError):
+        build_table([{"prefix": "/x", "upstream": "missing"}])
+
+
+def test_reload_swaps_table_without_touching_matched_routes(tmp_path, monkeypatch):
+    routes_file = tmp_path / "routes.json"
+    routes_file.write_text(json.dumps({"upstreams": {"a": "http://a"}, "routes": [{"prefix": "/x", "upstream": "a"}]}))
+    monkeypatch.setattr(config, "ROUTES_FILE", str(routes_file))
+
+    router = Router()
+    in_flight, _ = router.match("GET", "/x/1")
+
+    routes_file.write_text(json.dumps({"upstreams": {"b": "http://b"}, "routes": [{"prefix": "/x", "upstream": "b"}]}))
+    router.reload()
+
+    assert in_flight.upstream_url == "http://a"
+    assert router.match("GET", "/x/1")[0].upstream_url == "http://b"
+
+
+def test_example_routes_file_is_valid(monkeypatch):
+    monkeypatch.setenv("SERVICE_A_URL", "http://localhost:8001")
+    monkeypatch.setenv("SERVICE_B_URL", "http://localhost:8002")
+    table = RouteTable(load_route_table(str(Path(__file__).parent.parent / "docs" / "routes.example.json")))
+    route, path = table.match("GET", "/users/12")
+    assert route.url_for(path) == "http://localhost:8001/some-path?user=12"
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+
+import httpx
+import jwt
+import pytest
+from fastapi import HTTPException
+
+from config.config import config
+from core import security
+from core.client import UpstreamClientPool
+from core.security import JWKSKeyCache, VerifiedTokenCache, authenticate
+
+crypto = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    cache = VerifiedTokenCache(maxsize=100, max_ttl=300)
+    monkeypatch.setattr(security, "token_cache", cache)
+    return cache
+
+
+def bearer(claims: dict, key=None, algorithm=None, headers=None) -> str:
+    token = jwt.encode(claims, key or config.JWT_SECRET, algorithm=algorithm or config.JWT_ALGORITHM,
+                       headers=headers)
+    return f"Bearer {token}"
+
+
+def test_repeat_tokens_skip_verification(token_cache, monkeypatch):
+    decodes = []
+    decode = jwt.decode
+    monkeypatch.setattr(jwt, "decode", lambda *args, **kwargs: decodes.append(1) or decode(*args, **kwargs))
+    header = bearer({"sub": "user", "exp": int(time.time()) + 60})
+
+    payloads = [asyncio.run(authenticate(header)) for _ in range(5)]
+    assert all(payload["sub"] == "user" for payload in payloads)
+    assert len(decodes) == 1
+    assert token_cache.stats() == {"entries": 1, "hits": 4, "misses": 1}
+
+
+def test_cached_tokens_expire_with_the_token():
+    now = [0.0]
+    cache = VerifiedTokenCache(maxsize=10, max_ttl=300, timer=lambda: now[0])
+    cache.put("token", {"sub": "user", "exp": time.time() + 10})
+    assert cache.get("token") == {"sub": "user", "exp": pytest.approx(time.time() + 10, abs=1)}
+    now[0] = 11
+    assert cache.get("token") is None
+
+    cache.put("no-exp", {"sub": "user"})
+    now[0] = 11 + 301
+    assert cache.get("no-exp") is None
+
+
+def test_invalid_and_expired_tokens_are_not_cached(token_cache):
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(authenticate(bearer({"sub": "user"}, key="wrong-secret")))
+    assert exc.value.detail == "Invalid token"
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(authenticate(bearer({"sub": "user", "exp": int(time.time()) - 10})))
+    assert exc.value.detail == "Token has expired"
+    assert token_cache.stats()["entries"] == 0
+
+
+def test_jwks_keys_are_fetched_once_and_picked_by_kid(token_cache, monkeypatch):
+    private_keys = {kid: crypto.generate_private_key(public_exponent=65537, key_size=2048) for kid in ("k1", "k2")}
+    jwks = {"keys": []}
+    for kid, private_key in private_keys.items():
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+        jwks["keys"].append({**jwk, "kid": kid, "alg": "RS256", "use": "sig"})
+
+    fetches = []
+
+    def handler(request):
+        fetches.append(request.url)
+        return httpx.Response(200, json=jwks)
+
+    keys = JWKSKeyCache("http://idp/.well-known/jwks.json", ttl=300, min_refresh_interval=30,
+                        clients=UpstreamClientPool(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(security, "jwks_keys", keys)
+
+    async def scenario():
+        first = await authenticate(bearer({"sub": "a"}, private_keys["k1"], "RS256", {"kid": "k1"}))
+        second = await authenticate(bearer({"sub": "b"}, private_keys["k2"], "RS256", {"kid": "k2"}))
+        with pytest.raises(HTTPException):
+            await authenticate(bearer({"sub": "c"}, private_keys["k1"], "RS256", {"kid": "k2"}))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert (first["sub"], second["sub"]) == ("a", "b")
+    assert len(fetches) == 1
+
+    # k1 is rotated out: once the new key set is fetched, tokens signed with k1 are no longer taken from the cache
+    jwks["keys"] = jwks["keys"][1:]
+    keys.ttl = 0
+    token = bearer({"sub": "a"}, private_keys["k1"], "RS256", {"kid": "k1"})
+    assert asyncio.run(authenticate(token))["sub"] == "a"
+    asyncio.run(authenticate(bearer({"sub": "d"}, private_keys["k2"], "RS256", {"kid": "k2"})))
+    assert keys.version == 2
+    with pytest.raises(HTTPException):
+        asyncio.run(authenticate(token))
+
+
+def test_cached_tokens_are_verified_again_when_the_secret_changes(token_cache, monkeypatch):
+    header = bearer({"sub": "user"})
+    assert asyncio.run(authenticate(header))["sub"] == "user"
+    # As after a settings reload
+    monkeypatch.setattr(config, "JWT_SECRET", "rotated-secret")
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(authenticate(header))
+    assert exc.value.detail == "Invalid token"
+    assert asyncio.run(authenticate(bearer({"sub": "user"}, key="rotated-secret")))["sub"] == "user"
@@ -0,0 +1,117 @@
+import asyncio
+import contextlib
+import os
+import signal
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+from config.config import config
+from core.metrics import registry
+from serve import Master, listeners, serve
+
+
+async def slow(request):
+    await asyncio.sleep(0.5)
+    return PlainTextResponse(str(os.getpid()))
+
+
+async def snapshots(request):
+    return JSONResponse({"directory": registry.directory, "files": sorted(os.listdir(registry.directory))})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await registry.start()
+    yield
+    await registry.stop()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_listeners_share_one_port():
+    sockets = listeners("127.0.0.1", 0, 3)
+    try:
+        assert len({sock.getsockname()[1] for sock in sockets}) == 1
+        assert len(sockets) == (3 if hasattr(socket, "SO_REUSEPORT") else 1)
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="workers are forked")
+def test_sigterm_drains_in_flight_requests():
+    sockets = listeners("127.0.0.1", 0, 2)
+    port = sockets[0].getsockname()[1]
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = Master(Starlette(routes=[Route("/slow", slow)]), sockets, 2).run()
+        finally:
+            os._exit(code)
+    for sock in sockets:
+        sock.close()
+
+    responses = []
+
+    def request():
+        responses.append(httpx.get(f"http://127.0.0.1:{port}/slow", timeout=10))
+
+    # Wait until a worker answers, then start a slow request and stop the gateway while it runs
+    request()
+    inflight = threading.Thread(target=request)
+    inflight.start()
+    time.sleep(0.2)
+    os.kill(pid, signal.SIGTERM)
+    inflight.join()
+    _, status = os.waitpid(pid, 0)
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert os.waitstatus_to_exitcode(status) == 0
+    with pytest.raises(httpx.ConnectError):
+        httpx.get(f"http://127.0.0.1:{port}/slow", timeout=1)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="workers are forked")
+def test_workers_of_an_imported_app_share_their_metrics(monkeypatch):
+    # As with `python main.py`: the registry was created before serve() picked a METRICS_DIR
+    monkeypatch.setattr(config, "METRICS_DIR", "")
+    monkeypatch.setattr(registry, "directory", "")
+    monkeypatch.setattr(registry, "flush_interval", 0.1)
+    port = free_port()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            code = serve(Starlette(routes=[Route("/snapshots", snapshots)], lifespan=lifespan), "127.0.0.1", port, 2)
+        finally:
+            os._exit(code)
+
+    try:
+        found = None
+        for _ in range(100):
+            with contextlib.suppress(httpx.HTTPError):
+                found = httpx.get(f"http://127.0.0.1:{port}/snapshots", timeout=1).json()
+                if len(found["files"]) == 2:
+                    break
+            time.sleep(0.1)
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+    assert found["directory"]
+    # One snapshot per worker
+    assert len(found["files"]) == 2 and all(name[:-5].isdigit() for name in found["files"])
+    # The temporary directory goes away with the gateway
+    assert not os.path.exists(found["directory"])
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from starlette.datastructures import Headers
+
+from core.cache import CachedResponse, ResponseCache, vary_names
+from core.tiered_cache import (InvalidationBus, TieredCache, TieredResponseCache, decode_response,
+                               encode_response)
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+def make_entry(body=b'{"ok":true}', **headers):
+    raw = [(k.replace("_", "-").encode(), v.encode()) for k, v in headers.items()]
+    return CachedResponse(200, raw, body, vary_names(raw))
+
+
+async def start_workers(count: int):
+    """
+    Simulates `count` gateway workers, each with its own L1 and bus, sharing one Redis server.
+    """
+    server = fakeredis.FakeServer()
+    buses = []
+    for _ in range(count):
+        bus = InvalidationBus("test:invalidate")
+        await bus.start(fakeredis.FakeAsyncRedis(server=server))
+        buses.append(bus)
+    return buses
+
+
+async def stop_workers(buses):
+    for bus in buses:
+        await bus.stop()
+
+
+def test_binary_roundtrip_keeps_headers_body_and_age():
+    entry = make_entry(b"\x00\xffbinary", cache_control="max-age=60", vary="Accept-Language", etag='"v1"')
+    decoded = decode_response(encode_response(entry))
+    assert decoded.body == entry.body
+    assert decoded.headers == entry.headers
+    assert decoded.vary == ("accept-language",)
+    assert decoded.etag == '"v1"'
+    assert decoded.is_fresh()
+
+
+def test_response_served_from_l2_to_another_worker():
+    async def scenario():
+        buses = await start_workers(2)
+        worker_a = TieredResponseCache(ResponseCache(10_000, 10_000), bus=buses[0])
+        worker_b = TieredResponseCache(ResponseCache(10_000, 10_000), bus=buses[1])
+        key = ResponseCache.base_key("GET", "http://a/x")
+        english = Headers({"accept-language": "en"})
+
+        await worker_a.put(key, english, make_entry(b"en", cache_control="max-age=60", vary="Accept-Language"))
+        entry = await worker_b.get(key, english)
+        missing = await worker_b.get(key, Headers({"accept-language": "fr"}))
+        await stop_workers(buses)
+        return entry, missing, worker_b
+
+    entry, missing, worker_b = asyncio.run(scenario())
+    assert entry.body == b"en"
+    assert missing is None
+    assert worker_b.l2_hits == 1
+    assert worker_b.l1.get(ResponseCache.base_key("GET", "http://a/x"), Headers({"accept-language": "en"}))
+
+
+def test_invalidation_reaches_every_worker():
+    async def scenario():
+        buses = await start_workers(2)
+        worker_a = TieredResponseCache(ResponseCache(10_000, 10_000), bus=buses[0])
+        worker_b = TieredResponseCache(ResponseCache(10_000, 10_000), bus=buses[1])
+        key = ResponseCache.base_key("GET", "http://a/x")
+        headers = Headers({})
+
+        await worker_a.put(key, headers, make_entry(cache_control="max-age=60"))
+        assert await worker_b.get(key, headers) is not None
+
+        await worker_a.invalidate(key)
+        for _ in range(50):
+            if worker_b.l1.get(key, headers) is None:
+                break
+            await asyncio.sleep(0.01)
+        result = worker_b.l1.get(key, headers), await worker_b.get(key, headers)
+        await stop_workers(buses)
+        return result
+
+    l1_entry, l2_entry = asyncio.run(scenario())
+    assert l1_entry is None
+    assert l2_entry is None
+
+
+def test_generic_tiered_cache_multi_get():
+    async def scenario():
+        buses = await start_workers(2)
+        worker_a = TieredCache("items", maxsize=10, ttl=60, bus=buses[0])
+        worker_b = TieredCache("items", maxsize=10, ttl=60, bus=buses[1])
+        await worker_a.set("1", b"one")
+        await worker_a.set("2", b"two")
+        values = await worker_b.get_many(["1", "2", "3"])
+        await stop_workers(buses)
+        return values
+
+    assert asyncio.run(scenario()) == [b"one", b"two", None]
+
+
+def test_works_without_redis():
+    async def scenario():
+        cache = TieredCache("items", maxsize=10, ttl=60, bus=InvalidationBus("unused"))
+        await cache.set("1", b"one")
+        return await cache.get("1"), await cache.get("2")
+
+    assert asyncio.run(scenario()) == (b"one", None)
@@ -0,0 +1,110 @@
+import asyncio
+
+import httpx
+import pytest
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import SpanKind, StatusCode
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from config.config import config
+from core.client import upstream_clients
+from core.middleware import TracingMiddleware
+from core.tracing import tracing
+from core.utils import forward_request
+
+CALLER = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-{flags}"
+
+
+async def endpoint(request):
+    request.state.route = "orders"
+    if request.url.path == "/slow":
+        await asyncio.sleep(0.1)
+    if request.url.path == "/fail":
+        return Response(status_code=502)
+    headers = {k: v for k, v in request.headers.items() if k in ("traceparent", "tracestate")}
+    data, _ = await forward_request("http://orders/items", "GET", headers=headers, route="orders")
+    return JSONResponse(data)
+
+
+app = TracingMiddleware(Starlette(routes=[Route("/{path}", endpoint)]))
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    received = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        received.append(request.headers.get("traceparent"))
+        return httpx.Response(200, json={"items": []})
+
+    monkeypatch.setattr(upstream_clients, "transport", httpx.MockTransport(handler))
+    return received
+
+
+def run(requests: list, exporter=None) -> list:
+    async def scenario():
+        tracing.start(exporter)
+        try:
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app), base_url="http://gateway") as client:
+                return [(await client.get(path, headers=headers)).status_code for path, headers in requests]
+        finally:
+            await tracing.stop()
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def sampling(monkeypatch):
+    def configure(ratio: float = 0.0, tail_errors: bool = False, slow_threshold: float = 0.0):
+        monkeypatch.setattr(config, "TRACING_SAMPLE_RATIO", ratio)
+        monkeypatch.setattr(config, "TRACING_TAIL_ERRORS", tail_errors)
+        monkeypatch.setattr(config, "TRACING_TAIL_SLOW_THRESHOLD", slow_threshold)
+
+    configure()
+    return configure
+
+
+def test_untraced_requests_are_passed_through(upstream, sampling):
+    # Tracing off, and tracing on with nothing sampled: no spans, and the upstream sees the caller's context as is
+    assert run([("/a", {}), ("/a", {"traceparent": CALLER.format(flags="01")})]) == [200, 200]
+    assert tracing.tracer is None
+
+    sampling(ratio=1.0)
+    exporter = InMemorySpanExporter()
+    assert run([("/a", {}), ("/a", {"traceparent": CALLER.format(flags="00")})], exporter) == [200, 200]
+    spans = exporter.get_finished_spans()
+    # The first request was sampled by ratio; the second one's caller decided against tracing
+    assert len(spans) == 2
+    assert upstream[2] is not None and upstream[3] == CALLER.format(flags="00")
+    assert upstream[:2] == [None, CALLER.format(flags="01")]
+
+
+def test_sampled_requests_pass_their_context_upstream(upstream, sampling):
+    exporter = InMemorySpanExporter()
+    assert run([("/a", {"traceparent": CALLER.format(flags="01")})], exporter) == [200]
+
+    server, = [span for span in exporter.get_finished_spans() if span.kind == SpanKind.SERVER]
+    client, = [span for span in exporter.get_finished_spans() if span.kind == SpanKind.CLIENT]
+    assert server.name == "GET orders"
+    assert server.attributes["http.status_code"] == 200
+    # The caller's trace is continued, and the upstream is told about the client span
+    assert f"{server.context.trace_id:032x}" == "0af7651916cd43dd8448eb211c80319c"
+    assert f"{server.parent.span_id:016x}" == "b7ad6b7169203331"
+    assert client.parent.span_id == server.context.span_id
+    assert upstream == [f"00-{client.context.trace_id:032x}-{client.context.span_id:016x}-01"]
+
+
+def test_failed_and_slow_requests_are_traced_when_not_sampled(upstream, sampling):
+    sampling(tail_errors=True, slow_threshold=0.05)
+    exporter = InMemorySpanExporter()
+    assert run([("/a", {}), ("/slow", {}), ("/fail", {})], exporter) == [200, 200, 502]
+
+    spans = sorted(exporter.get_finished_spans(), key=lambda span: span.attributes["http.target"])
+    assert [span.attributes["http.target"] for span in spans] == ["/fail", "/slow"]
+    assert all(span.attributes["sampling.tail"] for span in spans)
+    assert spans[0].status.status_code == StatusCode.ERROR
+    assert spans[1].end_time - spans[1].start_time >= 0.1e9
+    # Tail-sampled requests are only traced once they are done, so nothing was sent upstream
+    assert upstream == [None, None]
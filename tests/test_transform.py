@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from starlette.responses import StreamingResponse
+
+from core.routing import RouteTable, RouteTableConfig, default_route_table
+from core.transform import (BodyRulesConfig, HeaderRulesConfig, PathRuleConfig, Transform, TransformConfig,
+                            compile_body, compile_headers, compile_path)
+
+
+def test_header_rules_run_in_one_pass():
+    transform = compile_headers(HeaderRulesConfig(remove=["Cookie"], rename={"X-User": "X-Upstream-User"},
+                                                  set={"X-Gateway": "1"}, add={"Via": "gateway"}))
+    headers = [(b"cookie", b"a=1"), (b"x-user", b"alice"), (b"X-Gateway", b"spoofed"), (b"via", b"proxy")]
+    assert transform(headers) == [(b"x-upstream-user", b"alice"), (b"via", b"proxy"), (b"x-gateway", b"1"),
+                                  (b"via", b"gateway")]
+    assert compile_headers(HeaderRulesConfig()) is None
+
+
+def test_body_rules_edit_nested_fields():
+    transform = compile_body(BodyRulesConfig(remove=["password", "user.ssn"], rename={"user.mail": "email"},
+                                             set={"user.verified": True, "meta.source": "gateway"}))
+    data = {"password": "x", "user": {"ssn": "1", "mail": "a@example.com"}}
+    assert transform(data) == {"user": {"email": "a@example.com", "verified": True}, "meta": {"source": "gateway"}}
+    assert transform([1, 2]) == [1, 2]
+    assert compile_path([PathRuleConfig(pattern="^/v1/", replace="/v2/")])("/v1/items") == "/v2/items"
+
+
+def test_response_body_is_only_buffered_for_body_rules():
+    transform = Transform(TransformConfig.model_validate({"response": {
+        "headers": {"remove": ["server"]}, "body": {"remove": ["internal"]},
+    }}))
+
+    async def chunks():
+        yield b'{"id": 1, '
+        yield b'"internal": true}'
+
+    response = StreamingResponse(chunks(), media_type="application/json")
+    response.raw_headers = [(b"content-type", b"application/json"), (b"content-length", b"27"), (b"server", b"x")]
+    transformed = asyncio.run(transform.response(response))
+    assert json.loads(transformed.body) == {"id": 1}
+    assert transformed.raw_headers == [(b"content-type", b"application/json"),
+                                       (b"content-length", str(len(transformed.body)).encode())]
+
+    headers_only = Transform(TransformConfig.model_validate({"response": {"headers": {"set": {"x-a": "1"}}}}))
+    response = StreamingResponse(chunks(), media_type="application/json")
+    assert asyncio.run(headers_only.response(response)) is response
+    assert (b"x-a", b"1") in response.raw_headers
+
+
+def test_routes_declare_transforms_for_some_methods():
+    table = RouteTable(default_route_table())
+    route, _ = table.match("POST", "/service-b/x")
+    headers, body = route.request_transform("POST").request_content([(b"content-length", b"8")], b'{"k": 1}')
+    assert json.loads(body) == {"k": 1, "transformed": True}
+    assert headers == [(b"content-length", str(len(body)).encode())]
+    assert route.request_transform("PUT") is None
+    assert table.match("POST", "/service-a/x")[0].transform is None
+
+    table = RouteTable(RouteTableConfig.model_validate({
+        "upstreams": {"a": "http://a"},
+        "routes": [{"prefix": "/a", "upstream": "a",
+                    "transform": {"request": {"path": [{"pattern": "^/users", "replace": "/v2/users"}]}}}],
+    }))
+    route, path = table.match("GET", "/a/users/1")
+    assert route.request_transform("GET").path(path) == "/v2/users/1"